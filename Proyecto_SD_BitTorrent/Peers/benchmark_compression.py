@@ -0,0 +1,83 @@
+# bittorrent_project/benchmark_compression.py
+"""
+Benchmark de la compresión de bloques. Para cada tipo de dato y códec mide la razón de compresión
+y la velocidad de compresión y descompresión de bloques de BLOCK_SIZE, y calcula el punto de
+equilibrio: el ancho de banda por debajo del cual comprimir entrega los bloques antes.
+
+Enviar S bytes crudos tarda S/B; comprimidos, r*S/B + S/C + S/D (C y D: velocidades de
+compresión y descompresión). Comprimir conviene si B < (1 - r) / (1/C + 1/D).
+
+Uso: python benchmark_compression.py [MB_por_tipo] [archivo ...]
+"""
+import os
+import sys
+import time
+import random
+
+from compression import compress, decompress, sample_ratio, COMPRESSION_CODECS, MAX_COMPRESSED_RATIO
+from file_manager import BLOCK_SIZE
+
+def text_data(size):
+    words = ["".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(random.randint(2, 10))) for _ in range(2000)]
+    parts, total = [], 0
+    while total < size:
+        line = " ".join(random.choices(words, k=12)) + ".\n"
+        parts.append(line)
+        total += len(line)
+    return "".join(parts).encode()[:size]
+
+def log_data(size):
+    levels = ["INFO", "DEBUG", "WARN", "ERROR"]
+    parts, total, t = [], 0, time.time()
+    while total < size:
+        t += random.random()
+        line = (f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))} [{random.choice(levels)}] "
+                f"peer-{random.randint(1, 50)} chunk {random.randint(0, 4000)} served in {random.random() * 40:.2f} ms\n")
+        parts.append(line)
+        total += len(line)
+    return "".join(parts).encode()[:size]
+
+def random_data(size):
+    return os.urandom(size) # Como un archivo ya comprimido (jpg, zip...)
+
+def measure(codec, data):
+    """Retorna (razón, MB/s al comprimir, MB/s al descomprimir) sobre bloques de BLOCK_SIZE."""
+    blocks = [data[i:i + BLOCK_SIZE] for i in range(0, len(data), BLOCK_SIZE)]
+    start = time.perf_counter()
+    compressed = [compress(codec, block) for block in blocks]
+    compress_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for block, payload in zip(blocks, compressed):
+        decompress(codec, payload, len(block))
+    decompress_time = time.perf_counter() - start
+    megabytes = len(data) / (1024 * 1024)
+    ratio = sum(len(payload) for payload in compressed) / len(data)
+    return ratio, megabytes / max(compress_time, 1e-9), megabytes / max(decompress_time, 1e-9)
+
+def break_even(ratio, compress_speed, decompress_speed):
+    """MB/s de enlace por debajo de los que comprimir es más rápido (0 si nunca conviene)."""
+    return max(0.0, (1 - ratio) / (1 / compress_speed + 1 / decompress_speed))
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    size = size_mb * 1024 * 1024
+    datasets = [("texto", text_data(size)), ("logs", log_data(size)), ("aleatorio", random_data(size))]
+    for path in sys.argv[2:]:
+        with open(path, "rb") as f:
+            datasets.append((os.path.basename(path), f.read(size)))
+
+    print(f"[BENCHMARK] {size_mb} MB por tipo de dato, bloques de {BLOCK_SIZE // 1024} KB. "
+          f"Los bloques que no bajan de {MAX_COMPRESSED_RATIO:.0%} se envían sin comprimir.")
+    print(f"{'datos':<14}{'códec':<7}{'razón':>8}{'comp. MB/s':>12}{'desc. MB/s':>12}{'equilibrio MB/s':>17}")
+    for name, data in datasets:
+        for codec in COMPRESSION_CODECS:
+            ratio, compress_speed, decompress_speed = measure(codec, data)
+            worth = ratio <= MAX_COMPRESSED_RATIO
+            print(f"{name:<14}{codec:<7}{ratio:>8.3f}{compress_speed:>12.1f}{decompress_speed:>12.1f}"
+                  f"{break_even(ratio, compress_speed, decompress_speed) if worth else 0.0:>17.1f}")
+    for path in sys.argv[2:]:
+        print(f"[BENCHMARK] Muestra de {os.path.basename(path)}: razón zlib rápida {sample_ratio(path):.3f}")
+    print("[BENCHMARK] Con enlaces más lentos que 'equilibrio' la compresión acorta la transferencia; más rápidos, la alarga.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# bittorrent_project/benchmark_sendfile.py
+"""
+Benchmark del envío de chunks en el seeder. Compara tres caminos:
+  json     - lectura + base64 + JSON (clientes antiguos)
+  binary   - lectura en Python + frame binario
+  sendfile - frame binario con sendfile (del page cache al socket, sin copia en Python)
+Mide bytes/s en el cliente y CPU del proceso servidor por GB enviado.
+
+Uso: python benchmark_sendfile.py [MB_del_archivo] [pasadas]
+"""
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import asyncio
+import tempfile
+import multiprocessing
+from collections import deque
+
+from network_utils import start_listener, FRAME_JSON, FRAME_DATA
+from file_manager import read_chunk, open_chunk, CHUNK_SIZE
+from connection_pool import PeerSession, MAX_IN_FLIGHT
+
+MODES = ["json", "binary", "sendfile"]
+BENCH_IP = "127.0.0.1"
+BENCH_PORT = 9950
+
+def serve(mode, filepath, port, results):
+    """Proceso servidor: atiende una sesión persistente enviando chunks con el modo indicado."""
+    async def handler(conn, addr):
+        await conn.read_message(4096) # OPEN_SESSION
+        await conn.send_frame(FRAME_JSON, json.dumps({"status": "success", "session": "persistent"}).encode())
+        cpu_start = time.process_time()
+        while True:
+            try:
+                _, payload = await conn.read_frame()
+            except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError):
+                break
+            chunk_index = json.loads(payload.decode())["chunk_index"]
+            if mode == "sendfile":
+                chunk_file, offset, length = await conn.run_blocking(open_chunk, filepath, chunk_index)
+                with chunk_file:
+                    await conn.send_file_frame(FRAME_DATA, chunk_file, offset, length)
+            elif mode == "binary":
+                await conn.send_frame(FRAME_DATA, await conn.run_blocking(read_chunk, filepath, chunk_index))
+            else:
+                chunk_data = await conn.run_blocking(read_chunk, filepath, chunk_index)
+                response = {"status": "success", "chunk": base64.b64encode(chunk_data).decode('ascii')}
+                await conn.send_frame(FRAME_JSON, json.dumps(response).encode())
+        results.put(time.process_time() - cpu_start)
+
+    start_listener(BENCH_IP, port, handler)
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((BENCH_IP, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"El servidor de benchmark no abrió el puerto {port}")
+
+def run_mode(mode, filepath, num_chunks, passes, port):
+    results = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(mode, filepath, port, results), daemon=True)
+    server.start()
+    try:
+        wait_for_port(port)
+        session = PeerSession(BENCH_IP, port)
+        total_bytes = 0
+        pending = deque()
+
+        def consume(future):
+            frame_type, payload = future.result(timeout=60)
+            if frame_type == FRAME_DATA:
+                return len(payload)
+            return len(base64.b64decode(json.loads(payload.decode())["chunk"]))
+
+        start = time.perf_counter()
+        for _ in range(passes):
+            for chunk_index in range(num_chunks):
+                pending.append(session.submit({"command": "REQUEST_CHUNK", "chunk_index": chunk_index}))
+                while len(pending) >= MAX_IN_FLIGHT:
+                    total_bytes += consume(pending.popleft())
+        while pending:
+            total_bytes += consume(pending.popleft())
+        elapsed = time.perf_counter() - start
+        session.close()
+        server_cpu = results.get(timeout=30)
+    finally:
+        server.terminate()
+        server.join()
+    return total_bytes, elapsed, server_cpu
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    passes = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filepath = os.path.join(tmp_dir, "bench.bin")
+        with open(filepath, "wb") as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1024 * 1024))
+        with open(filepath, "rb") as f:
+            while f.read(8 * 1024 * 1024):
+                pass # Calentar el page cache para medir el envío y no el disco
+        num_chunks = (size_mb * 1024 * 1024 + CHUNK_SIZE - 1) // CHUNK_SIZE
+
+        print(f"[BENCHMARK] Archivo de {size_mb} MB ({num_chunks} chunks de {CHUNK_SIZE // 1024} KB), {passes} pasadas.")
+        print(f"{'modo':<10}{'MB/s':>10}{'CPU servidor (s/GB)':>22}")
+        for offset, mode in enumerate(MODES):
+            total_bytes, elapsed, server_cpu = run_mode(mode, filepath, num_chunks, passes, BENCH_PORT + offset)
+            gigabytes = total_bytes / (1024 ** 3)
+            print(f"{mode:<10}{total_bytes / elapsed / (1024 ** 2):>10.1f}{server_cpu / gigabytes:>22.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+# bittorrent_project/benchmark_swarm.py
+"""
+Benchmark de un enjambre completo en 127.0.0.1: levanta un tracker, N seeders con archivos
+generados y M leechers que descargan el mismo archivo a la vez con download_file. Mide:
+  - throughput de extremo a extremo y tiempo hasta la primera pieza de cada leecher
+  - solicitudes/s del tracker por comando (REGISTER, PING, UPDATE_DELTA, GET_PEERS_WITH_FILE, GET_NETWORK_STATUS)
+  - memoria máxima (RSS) de cada peer
+y escribe los resultados en JSON. Con --compare compara contra un JSON anterior y termina con
+código 1 si alguna métrica empeoró más que --tolerance.
+
+Uso: python benchmark_swarm.py [--seeders 2] [--leechers 2] [--size-mb 64] [--output swarm.json] [--compare base.json]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import queue
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from network_utils import send_json
+
+BENCH_IP = "127.0.0.1"
+BASE_PORT = 7100 # Tracker en BASE_PORT, peers a continuación
+TRACKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Trackers", "tracker.py")
+BENCH_FILE = "swarm.bin"
+STARTUP_TIMEOUT = 30
+DOWNLOAD_TIMEOUT = 600
+TRACKER_COMMANDS = ["REGISTER", "PING", "UPDATE_DELTA", "GET_PEERS_WITH_FILE", "GET_NETWORK_STATUS"]
+# Métricas que se comparan con --compare: (ruta en el JSON, True si más alto es mejor)
+COMPARED_METRICS = [(("download", "aggregate_mbps"), True), (("download", "mean_ttfb"), False),
+                    (("memory", "max_peer_rss_mb"), False)] + [(("tracker", command), True) for command in TRACKER_COMMANDS]
+
+def peak_rss_mb():
+    """RSS máximo del proceso en MB (None donde no existe el módulo resource, p.ej. Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024 # Bytes en macOS, KB en Linux
+
+def generate_file(path, size, compressible):
+    """Archivo de 'size' bytes: aleatorio, o líneas de texto repetitivas si 'compressible'."""
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            if compressible:
+                block = b"".join(b"%08d peer chunk served ok\n" % (written + i) for i in range(2048))
+            else:
+                block = os.urandom(1024 * 1024)
+            block = block[:size - written]
+            f.write(block)
+            written += len(block)
+
+def wait_for_port(port, timeout=STARTUP_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((BENCH_IP, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Nadie escucha en {BENCH_IP}:{port}")
+
+# --- PROCESOS DEL ENJAMBRE (modo --worker) ---
+def run_worker(role, name, port, tracker_port, workdir):
+    """
+    Proceso de un peer. Imprime READY al quedar registrado; un leecher espera una línea por stdin,
+    descarga e imprime RESULT con sus métricas. Con la siguiente línea imprime MEMORY y termina.
+    """
+    os.chdir(workdir)
+    os.environ.update({"BT_PEER_ID": name, "BT_PEER_IP": BENCH_IP, "BT_PEER_PORT": str(port),
+                       "BT_TRACKER_IP": BENCH_IP, "BT_TRACKER_PORT": str(tracker_port)})
+    import peer # La configuración sale de las variables de entorno: sin preguntas por consola
+
+    threading.Thread(target=peer.start_listener, args=(BENCH_IP, port, peer.serve_file_handler), daemon=True).start()
+    wait_for_port(port)
+    if not peer.TRACKER_CLIENT.announce(name, BENCH_IP, port, peer.SHARED_DIR, peer.RECEIVED_DIR,
+                                        initial_registration=True, bitfields=peer.partial_bitfields()):
+        raise RuntimeError(f"{name} no pudo registrarse en el tracker")
+    threading.Thread(target=peer.heartbeat_to_tracker, daemon=True).start()
+    print("READY", flush=True)
+
+    if role == "leecher":
+        sys.stdin.readline() # Todos los leechers empiezan a la vez
+        first_piece = []
+        start = time.perf_counter()
+        peer.download_file(BENCH_FILE, on_progress=lambda done, total: first_piece or first_piece.append(time.perf_counter()))
+        elapsed = time.perf_counter() - start
+        path = os.path.join(peer.RECEIVED_DIR, BENCH_FILE)
+        size = os.path.getsize(path) if os.path.exists(path) and not peer.has_resume_state(BENCH_FILE) else 0
+        result = {"name": name, "bytes": size, "seconds": round(elapsed, 4), "mbps": round(size / elapsed / (1024 * 1024), 2),
+                  "ttfb": round(first_piece[0] - start, 4) if first_piece else None}
+        print("RESULT " + json.dumps(result), flush=True)
+    sys.stdin.readline() # Seguir sirviendo hasta que el benchmark termine
+    print("MEMORY " + json.dumps(peak_rss_mb()), flush=True)
+
+# --- BENCHMARK ---
+class Swarm:
+    def __init__(self, args, root):
+        self.args = args
+        self.root = root
+        self.tracker_port = args.base_port
+        self.tracker = None
+        self.peers = [] # (rol, nombre, Popen)
+        self.lines = {} # Popen -> Queue con las líneas de su salida
+
+    def start_tracker(self):
+        tracker_dir = os.path.join(self.root, "tracker")
+        os.makedirs(tracker_dir)
+        env = dict(os.environ, BT_TRACKER_IP=BENCH_IP, BT_TRACKER_PORT=str(self.tracker_port))
+        self.tracker = subprocess.Popen([sys.executable, os.path.abspath(TRACKER_SCRIPT)], cwd=tracker_dir, env=env,
+                                        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for_port(self.tracker_port)
+
+    def start_peer(self, role, index, source_file=None):
+        name = f"{role}-{index}"
+        port = self.tracker_port + 1 + len(self.peers)
+        workdir = os.path.join(self.root, name)
+        os.makedirs(os.path.join(workdir, "sample_files"))
+        if source_file is not None:
+            target = os.path.join(workdir, "sample_files", BENCH_FILE)
+            try:
+                os.link(source_file, target) # Mismo contenido sin copiarlo
+            except OSError:
+                shutil.copyfile(source_file, target)
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", role, name, str(port),
+                                    str(self.tracker_port), workdir],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        self.peers.append((role, name, process))
+        # La salida se lee siempre: si el pipe se llenara, el peer se bloquearía al imprimir
+        self.lines[process] = queue.Queue()
+        threading.Thread(target=self.pump, args=(process,), daemon=True).start()
+        return process
+
+    def pump(self, process):
+        for line in process.stdout:
+            self.lines[process].put(line)
+        self.lines[process].put(None) # El proceso terminó
+
+    def read_line(self, process, prefix, timeout):
+        """Espera la siguiente línea de un peer que empiece con 'prefix' y retorna el resto (el resto de su salida se descarta)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                line = self.lines[process].get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                line = None
+            if line is None:
+                raise RuntimeError(f"Un peer terminó o no respondió '{prefix}' en {timeout} s")
+            if line.startswith(prefix):
+                return line[len(prefix):].strip()
+
+    def send_line(self, process):
+        process.stdin.write("\n")
+        process.stdin.flush()
+
+    def stop(self):
+        for _, _, process in self.peers:
+            process.kill()
+        if self.tracker is not None:
+            self.tracker.kill()
+
+def measure_tracker(tracker_port, requests, concurrency):
+    """Solicitudes/s del tracker por comando, con 'concurrency' clientes a la vez."""
+    files = [f"bench_{i:04d}.bin" for i in range(100)]
+    messages = {
+        "REGISTER": lambda i: {"command": "REGISTER", "peer_id": f"bench-{i % 200}", "ip": BENCH_IP, "port": 20000 + i % 200,
+                               "files": files, "bitfields": {}, "version": 1},
+        "PING": lambda i: {"command": "PING", "peer_id": f"bench-{i % 200}"},
+        "UPDATE_DELTA": lambda i: {"command": "UPDATE_DELTA", "peer_id": f"bench-{i % 200}", "base_version": 1, "version": 1,
+                                   "added": [], "removed": []},
+        "GET_PEERS_WITH_FILE": lambda i: {"command": "GET_PEERS_WITH_FILE", "filename": files[i % len(files)]},
+        "GET_NETWORK_STATUS": lambda i: {"command": "GET_NETWORK_STATUS"},
+    }
+    results = {}
+    for command in TRACKER_COMMANDS:
+        count = requests if command != "GET_NETWORK_STATUS" else max(1, requests // 10) # Respuesta grande: menos repeticiones
+        next_index = iter(range(count))
+        lock = threading.Lock()
+        failures = []
+
+        def client():
+            while True:
+                with lock:
+                    i = next(next_index, None)
+                if i is None:
+                    return
+                if send_json(BENCH_IP, tracker_port, messages[command](i), retries=1) is None:
+                    failures.append(i)
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        results[command] = round((count - len(failures)) / elapsed, 1)
+        if failures:
+            print(f"[SWARM] {command}: {len(failures)} solicitudes fallidas.")
+    return results
+
+def run_benchmark(args):
+    root = tempfile.mkdtemp(prefix="bt_swarm_")
+    swarm = Swarm(args, root)
+    try:
+        source_file = os.path.join(root, BENCH_FILE)
+        generate_file(source_file, args.size_mb * 1024 * 1024, args.compressible)
+        swarm.start_tracker()
+        seeders = [swarm.start_peer("seeder", i, source_file) for i in range(args.seeders)]
+        leechers = [swarm.start_peer("leecher", i) for i in range(args.leechers)]
+        for process in seeders + leechers:
+            swarm.read_line(process, "READY", STARTUP_TIMEOUT)
+
+        print(f"[SWARM] {args.seeders} seeders y {args.leechers} leechers descargando {args.size_mb} MB...")
+        wall_start = time.perf_counter()
+        for process in leechers:
+            swarm.send_line(process)
+        downloads = [json.loads(swarm.read_line(process, "RESULT ", DOWNLOAD_TIMEOUT)) for process in leechers]
+        wall = time.perf_counter() - wall_start
+
+        print(f"[SWARM] Midiendo el tracker ({args.tracker_requests} solicitudes por comando, {args.concurrency} clientes)...")
+        tracker = measure_tracker(swarm.tracker_port, args.tracker_requests, args.concurrency)
+
+        memory = {}
+        for _, name, process in swarm.peers:
+            swarm.send_line(process)
+            memory[name] = json.loads(swarm.read_line(process, "MEMORY ", STARTUP_TIMEOUT))
+    finally:
+        swarm.stop()
+        shutil.rmtree(root, ignore_errors=True)
+
+    total_bytes = sum(d["bytes"] for d in downloads)
+    ttfbs = [d["ttfb"] for d in downloads if d["ttfb"] is not None]
+    rss = [value for value in memory.values() if value is not None]
+    return {
+        "config": {"seeders": args.seeders, "leechers": args.leechers, "size_mb": args.size_mb, "compressible": args.compressible,
+                   "tracker_requests": args.tracker_requests, "concurrency": args.concurrency},
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "download": {"complete": all(d["bytes"] == args.size_mb * 1024 * 1024 for d in downloads),
+                     "aggregate_mbps": round(total_bytes / wall / (1024 * 1024), 2), "wall_seconds": round(wall, 3),
+                     "mean_ttfb": round(sum(ttfbs) / len(ttfbs), 4) if ttfbs else None, "leechers": downloads},
+        "tracker": tracker,
+        "memory": {"max_peer_rss_mb": round(max(rss), 1) if rss else None, "per_peer_rss_mb": memory},
+    }
+
+def compare(results, baseline, tolerance):
+    """Lista de métricas que empeoraron más que 'tolerance' (fracción) respecto de 'baseline'."""
+    regressions = []
+    for path, higher_is_better in COMPARED_METRICS:
+        current, previous = results, baseline
+        for key in path:
+            current = current.get(key) if isinstance(current, dict) else None
+            previous = previous.get(key) if isinstance(previous, dict) else None
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{'.'.join(path)}: {previous} -> {current} ({change:+.1%})")
+    return regressions
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        role, name, port, tracker_port, workdir = sys.argv[2:7]
+        run_worker(role, name, int(port), int(tracker_port), workdir)
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark de un enjambre tracker + peers en 127.0.0.1")
+    parser.add_argument("--seeders", type=int, default=2)
+    parser.add_argument("--leechers", type=int, default=2)
+    parser.add_argument("--size-mb", type=int, default=64, help="Tamaño del archivo generado")
+    parser.add_argument("--compressible", action="store_true", help="Archivo de texto en vez de bytes aleatorios")
+    parser.add_argument("--tracker-requests", type=int, default=2000, help="Solicitudes al tracker por comando")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clientes simultáneos contra el tracker")
+    parser.add_argument("--base-port", type=int, default=BASE_PORT)
+    parser.add_argument("--output", default="swarm_results.json")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior con el que comparar")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Empeoramiento máximo aceptado (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    download = results["download"]
+    print(f"[SWARM] Descarga: {download['aggregate_mbps']} MB/s en total, {download['wall_seconds']} s, "
+          f"primera pieza a los {download['mean_ttfb']} s de media, completa: {download['complete']}")
+    for leecher in download["leechers"]:
+        print(f"- {leecher['name']}: {leecher['mbps']} MB/s, {leecher['seconds']} s, primera pieza {leecher['ttfb']} s")
+    print("[SWARM] Tracker (solicitudes/s): " + ", ".join(f"{c} {r}" for c, r in results["tracker"].items()))
+    print(f"[SWARM] Memoria máxima por peer: {results['memory']['max_peer_rss_mb']} MB")
+    print(f"[SWARM] Resultados escritos en {args.output}")
+
+    failed = not download["complete"]
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"[SWARM] REGRESIÓN {regression}")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
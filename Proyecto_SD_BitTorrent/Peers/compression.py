@@ -0,0 +1,80 @@
+# bittorrent_project/compression.py
+import os
+import bz2
+import lzma
+import zlib
+
+# Compresión opcional de los bloques. El seeder anuncia en GET_FILE_INFO los códecs que acepta para
+# un archivo (ninguno si el archivo ya está comprimido) y el leecher pide uno en cada REQUEST_BLOCK.
+# El seeder responde FRAME_COMPRESSED, o FRAME_DATA si ese bloque no se reduce lo suficiente.
+COMPRESSION_CODECS = ["zlib", "lzma", "bz2"] # Códecs que acepta el seeder, en orden de preferencia
+PREFERRED_COMPRESSION = "zlib" # Códec que pide el leecher si el seeder lo ofrece (None: nunca comprimir)
+ZLIB_LEVEL = 6
+LZMA_PRESET = 1
+BZ2_LEVEL = 9
+MAX_COMPRESSED_RATIO = 0.9 # Un bloque que no baja de esta fracción de su tamaño se envía sin comprimir
+SAMPLE_SIZE = 64 * 1024 # Bytes de cada muestra con que se estima si un archivo se comprime
+SAMPLES = 3 # Muestras al inicio, a la mitad y al final del archivo
+
+# Formatos que ya vienen comprimidos: ni se muestrean
+INCOMPRESSIBLE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".mp3", ".mp4", ".mkv", ".avi", ".mov",
+                             ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".zst", ".jar", ".apk", ".docx", ".xlsx"}
+
+def compress(codec, data):
+    if codec == "zlib":
+        return zlib.compress(data, ZLIB_LEVEL)
+    if codec == "lzma":
+        return lzma.compress(data, preset=LZMA_PRESET)
+    if codec == "bz2":
+        return bz2.compress(data, BZ2_LEVEL)
+    raise ValueError(f"Códec de compresión desconocido: {codec}")
+
+def decompress(codec, data, max_size):
+    """
+    Descomprime 'data' sin producir más de 'max_size' bytes (un peer no puede inflar un bloque sin límite).
+    Cualquier dato inválido se reporta como ValueError.
+    """
+    try:
+        if codec == "zlib":
+            decompressor = zlib.decompressobj()
+            result = decompressor.decompress(data, max_size + 1)
+        elif codec in ("lzma", "bz2"):
+            decompressor = lzma.LZMADecompressor() if codec == "lzma" else bz2.BZ2Decompressor()
+            result = decompressor.decompress(data, max_length=max_size + 1)
+        else:
+            raise ValueError(f"Códec de compresión desconocido: {codec}")
+        complete = decompressor.eof
+    except (zlib.error, lzma.LZMAError, OSError, EOFError) as e:
+        raise ValueError(f"Bloque comprimido con {codec} inválido: {e}")
+    if len(result) > max_size or not complete:
+        raise ValueError(f"Bloque comprimido con {codec} inválido o mayor que {max_size} bytes")
+    return result
+
+def choose_codec(offered, preferred=PREFERRED_COMPRESSION):
+    """Códec a pedir a partir de los que ofrece el seeder (None si no hay uno en común)."""
+    if not offered or preferred is None:
+        return None
+    if preferred in offered:
+        return preferred
+    return next((codec for codec in COMPRESSION_CODECS if codec in offered), None)
+
+def looks_compressed(filename):
+    return os.path.splitext(filename)[1].lower() in INCOMPRESSIBLE_EXTENSIONS
+
+def sample_ratio(path, sample_size=SAMPLE_SIZE, samples=SAMPLES):
+    """Fracción del tamaño que ocupan unas muestras del archivo comprimidas con zlib rápido."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return 1.0
+    raw = compressed = 0
+    with open(path, "rb") as f:
+        for i in range(samples):
+            f.seek(max(0, (size - sample_size) * i // max(samples - 1, 1)))
+            data = f.read(sample_size)
+            raw += len(data)
+            compressed += len(zlib.compress(data, 1))
+    return compressed / raw if raw else 1.0
+
+def is_compressible(path):
+    """True si vale la pena ofrecer compresión para el archivo: por su extensión y una muestra de su contenido."""
+    return not looks_compressed(path) and sample_ratio(path) <= MAX_COMPRESSED_RATIO
@@ -0,0 +1,187 @@
+# bittorrent_project/connection_pool.py
+import socket
+import threading
+import time
+import json
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+from network_utils import send_frame, recv_frame, recv_prefix, FRAME_HEADER, FRAME_MAGIC, FRAME_JSON
+
+SESSION_TIMEOUT = 35 # Timeout de conexión y de cada solicitud (igual que las descargas de una sola conexión)
+CANCEL_POLL_INTERVAL = 0.05 # Cada cuánto mira una solicitud cancelable si la cancelaron mientras espera turno
+MAX_IN_FLIGHT = 4 # Solicitudes enviadas sin esperar respuesta por sesión (profundidad del pipeline)
+
+class SessionNotSupported(Exception):
+    """El peer remoto no entiende OPEN_SESSION (peer antiguo de una solicitud por conexión)."""
+
+class PeerSession:
+    """
+    Conexión persistente con un peer. Acepta muchas solicitudes por el mismo socket y
+    permite varias en vuelo: las respuestas llegan en el mismo orden en que se enviaron.
+    """
+    def __init__(self, ip, port, timeout=SESSION_TIMEOUT, max_in_flight=MAX_IN_FLIGHT):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.closed = False
+        self.pending = deque() # Futures en el orden en que se enviaron las solicitudes
+        self.send_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+
+        self.sock = socket.create_connection((ip, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            # Negociación: un peer antiguo responde JSON plano con "Unknown command" y cierra
+            self.sock.sendall(json.dumps({"command": "OPEN_SESSION"}).encode())
+            prefix = recv_prefix(self.sock, FRAME_HEADER.size)
+            if len(prefix) < FRAME_HEADER.size or not prefix.startswith(FRAME_MAGIC):
+                raise SessionNotSupported(f"{ip}:{port} no soporta sesiones persistentes")
+            frame_type, payload = recv_frame(self.sock, prefix)
+            if frame_type != FRAME_JSON or json.loads(payload.decode()).get("status") != "success":
+                raise SessionNotSupported(f"{ip}:{port} rechazó la sesión")
+        except Exception:
+            self.sock.close()
+            raise
+
+        # El lector espera sin timeout; el timeout se aplica a cada solicitud en 'request'
+        self.sock.settimeout(None)
+        threading.Thread(target=self._reader, daemon=True).start()
+
+    def submit(self, message, cancelled=None):
+        """
+        Envía una solicitud sin esperar la respuesta. Retorna un Future con (tipo_frame, payload),
+        o None si 'cancelled' (un Future) se completa mientras se espera sitio en el pipeline.
+        """
+        if cancelled is None:
+            acquired = self.slots.acquire(timeout=self.timeout)
+        else:
+            deadline = time.monotonic() + self.timeout
+            acquired = False
+            while not acquired and not cancelled.done() and time.monotonic() < deadline:
+                acquired = self.slots.acquire(timeout=CANCEL_POLL_INTERVAL)
+            if not acquired and cancelled.done():
+                return None
+        if not acquired:
+            raise TimeoutError(f"Pipeline lleno con {self.ip}:{self.port}")
+        future = Future()
+        send_error = None
+        with self.send_lock:
+            if self.closed:
+                self.slots.release()
+                raise ConnectionError(f"Sesión con {self.ip}:{self.port} cerrada")
+            # Encolar y enviar bajo el mismo lock para conservar el orden de las respuestas
+            self.pending.append(future)
+            try:
+                send_frame(self.sock, FRAME_JSON, json.dumps(message).encode())
+            except OSError as e:
+                send_error = e
+        if send_error is not None:
+            self.close() # Hace fallar este Future y los demás pendientes
+        return future
+
+    def request(self, message):
+        """Envía una solicitud y espera su respuesta."""
+        return self.submit(message).result(timeout=self.timeout)
+
+    def wait_response(self, future, cancelled=None):
+        """
+        Espera la respuesta de una solicitud enviada con submit(). Si 'cancelled' (un Future) se
+        completa antes, deja de esperar y retorna None: la respuesta se descartará al llegar.
+        """
+        if future is None:
+            return None # Cancelada antes de enviarse
+        if cancelled is not None:
+            wait([future, cancelled], timeout=self.timeout, return_when=FIRST_COMPLETED)
+            if cancelled.done() and future.cancel():
+                return None
+            if not future.done() and not future.running():
+                raise TimeoutError(f"Sin respuesta de {self.ip}:{self.port}")
+        return future.result(timeout=self.timeout)
+
+    def _reader(self):
+        """Hilo lector: empareja cada frame recibido con la solicitud más antigua pendiente."""
+        try:
+            while True:
+                frame = recv_frame(self.sock)
+                with self.send_lock:
+                    future = self.pending.popleft() if self.pending else None
+                if future is None:
+                    break # Respuesta sin solicitud: el flujo está desincronizado
+                self.slots.release()
+                if future.set_running_or_notify_cancel(): # Las canceladas se descartan, pero su frame se consume
+                    future.set_result(frame)
+        except Exception:
+            pass # Conexión cerrada por el otro extremo o por close()
+        finally:
+            self.close()
+
+    def close(self):
+        """Cierra la sesión y hace fallar las solicitudes que seguían pendientes."""
+        with self.send_lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending = list(self.pending)
+            self.pending.clear()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        for future in pending:
+            self.slots.release()
+            if not future.done():
+                future.set_exception(ConnectionError(f"Sesión con {self.ip}:{self.port} cerrada"))
+
+class ConnectionPool:
+    """Sesiones persistentes reutilizables, una por peer y compartidas por descargas y consultas de info."""
+    def __init__(self, timeout=SESSION_TIMEOUT, max_in_flight=MAX_IN_FLIGHT):
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.sessions = {} # (ip, port) -> PeerSession
+        self.legacy_peers = set() # Peers que solo aceptan una solicitud por conexión
+        self.lock = threading.Lock()
+
+    def get_session(self, ip, port):
+        """
+        Retorna una sesión abierta con el peer, creándola si hace falta.
+        Retorna None si el peer es antiguo y hay que usar una conexión por solicitud.
+        """
+        key = (ip, port)
+        with self.lock:
+            if key in self.legacy_peers:
+                return None
+            session = self.sessions.get(key)
+            if session is not None and not session.closed:
+                return session
+
+        # Conectar fuera del lock para no bloquear a los demás peers durante el handshake
+        try:
+            new_session = PeerSession(ip, port, self.timeout, self.max_in_flight)
+        except SessionNotSupported:
+            with self.lock:
+                self.legacy_peers.add(key)
+            return None
+
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None or session.closed:
+                self.sessions[key] = new_session
+                return new_session
+        new_session.close() # Otro hilo abrió la sesión mientras tanto
+        return session
+
+    def discard(self, ip, port):
+        """Cierra y olvida la sesión con un peer (p.ej. tras un timeout o un error)."""
+        with self.lock:
+            session = self.sessions.pop((ip, port), None)
+        if session is not None:
+            session.close()
+
+    def close_all(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.close()
@@ -0,0 +1,209 @@
+# bittorrent_project/download_manager.py
+import time
+import threading
+import itertools
+
+from upload_limiter import TokenBucket
+
+MAX_ACTIVE_DOWNLOADS = 3 # Descargas a la vez; las demás esperan en cola por prioridad
+MAX_DOWNLOAD_CONNECTIONS = 16 # Solicitudes a peers en curso entre todas las descargas activas
+GLOBAL_DOWNLOAD_RATE = 0 # Bytes/s de bajada en total (0 = sin límite)
+PRIORITIES = {"high": 0, "normal": 1, "low": 2} # Menor valor: sale antes de la cola
+
+class Download:
+    """
+    Una descarga administrada. download_file la recibe como 'control': attach() le entrega el
+    scheduler (para pausarla o cancelarla y ajustar cuántas solicitudes tiene en curso),
+    progress() actualiza los bytes y throttle() frena al worker según su parte de la tasa global.
+    """
+    def __init__(self, filename, priority, sequence):
+        self.filename = filename
+        self.priority = priority
+        self.sequence = sequence # Orden de llegada: desempata dentro de una misma prioridad
+        self.status = "queued" # queued, running, paused, completed, failed, cancelled
+        self.running = False # True mientras su hilo ejecuta download_file (también mientras se pausa)
+        self.stop_reason = None # "pause" o "cancel" si se pidió detenerla
+        self.bytes = 0
+        self.total = None
+        self.added = time.time()
+        self.started = None
+        self.finished = None
+        self.lock = threading.Lock()
+        self.scheduler = None
+        self.worker_limit = None
+        self.bucket = TokenBucket(0)
+        self.stopped = threading.Event() # Interrumpe la espera de throttle() al pausar o cancelar
+
+    def attach(self, scheduler):
+        """Registra el scheduler de la descarga. Si ya se pidió detenerla, lo detiene enseguida."""
+        with self.lock:
+            self.scheduler = scheduler
+            if self.worker_limit is not None:
+                scheduler.set_worker_limit(self.worker_limit)
+            if self.stop_reason is not None:
+                scheduler.stop()
+
+    def progress(self, num_bytes, total):
+        self.bytes, self.total = num_bytes, total
+
+    def throttle(self, num_bytes):
+        """Espera lo necesario para que la descarga no supere su parte de la tasa global."""
+        with self.lock:
+            delay = self.bucket.reserve(num_bytes)
+        if delay > 0:
+            self.stopped.wait(delay)
+
+    def limit(self, worker_limit, rate):
+        with self.lock:
+            self.worker_limit = worker_limit
+            self.bucket.set_rate(rate)
+            if self.scheduler is not None:
+                self.scheduler.set_worker_limit(worker_limit)
+
+    def request_stop(self, reason):
+        with self.lock:
+            self.stop_reason = reason
+            self.stopped.set()
+            if self.scheduler is not None:
+                self.scheduler.stop()
+
+    def reset(self):
+        """Prepara una nueva ejecución (al reanudar o volver a pedir el archivo)."""
+        with self.lock:
+            self.stop_reason = None
+            self.stopped.clear()
+            self.scheduler = None
+
+    def snapshot(self):
+        return {"status": self.status, "priority": self.priority, "bytes": self.bytes, "total": self.total,
+                "added": self.added, "started": self.started, "finished": self.finished, "connections": self.worker_limit}
+
+class DownloadManager:
+    """
+    Cola de descargas con prioridades. Como mucho 'max_active' descargas a la vez; entre ellas se
+    reparten en partes iguales 'max_connections' solicitudes en curso y 'global_rate' bytes/s.
+    Pedir un archivo que ya está en cola o descargándose retorna la descarga existente, así que
+    nunca hay dos descargas del mismo archivo escribiendo en received_files a la vez.
+    'run_download(download)' ejecuta la descarga (bloqueante) y retorna True si quedó completa;
+    'discard(filename)' borra lo descargado de una descarga cancelada.
+    """
+    def __init__(self, run_download, discard=None, max_active=MAX_ACTIVE_DOWNLOADS, max_connections=MAX_DOWNLOAD_CONNECTIONS,
+                 global_rate=GLOBAL_DOWNLOAD_RATE):
+        self.run_download = run_download
+        self.discard = discard
+        self.max_active = max_active
+        self.max_connections = max_connections
+        self.global_rate = global_rate
+        self.lock = threading.Lock()
+        self.downloads = {} # filename -> Download
+        self.sequence = itertools.count()
+
+    def submit(self, filename, priority="normal"):
+        """Encola un archivo. Retorna (snapshot de la descarga, True si es nueva o se volvió a encolar)."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Prioridad desconocida: {priority}")
+        with self.lock:
+            download = self.downloads.get(filename)
+            if download is not None and download.status in ("queued", "running", "paused"):
+                if PRIORITIES[priority] < PRIORITIES[download.priority]:
+                    download.priority = priority # Pedirlo de nuevo con más prioridad lo adelanta en la cola
+                return download.snapshot(), False
+            if download is None or not download.running:
+                download = self.downloads[filename] = Download(filename, priority, next(self.sequence))
+            else:
+                # Cancelada pero su hilo aún no terminó: se reutiliza y arranca cuando termine
+                download.priority, download.sequence, download.status = priority, next(self.sequence), "queued"
+            self.start_pending()
+            return download.snapshot(), True
+
+    def pause(self, filename):
+        """Detiene una descarga conservando su progreso. Retorna False si no estaba en cola ni en curso."""
+        with self.lock:
+            download = self.downloads.get(filename)
+            if download is None or download.status not in ("queued", "running"):
+                return False
+            download.status = "paused"
+            if download.running:
+                download.request_stop("pause")
+            return True
+
+    def resume(self, filename):
+        with self.lock:
+            download = self.downloads.get(filename)
+            if download is None or download.status != "paused":
+                return False
+            download.status = "queued"
+            self.start_pending()
+            return True
+
+    def cancel(self, filename):
+        """Detiene una descarga y descarta lo que se descargó de ella."""
+        with self.lock:
+            download = self.downloads.get(filename)
+            if download is None or download.status not in ("queued", "running", "paused"):
+                return False
+            download.status = "cancelled"
+            download.finished = time.time()
+            if download.running:
+                download.request_stop("cancel") # Su hilo descarta los datos al terminar
+                return True
+            discard = download.started is not None # Pausada: ya tiene datos en disco
+        if discard and self.discard is not None:
+            self.discard(filename)
+        return True
+
+    def configure(self, max_active=None, max_connections=None, global_rate=None):
+        """Cambia los límites en caliente. Los valores None se mantienen."""
+        with self.lock:
+            if max_active is not None:
+                self.max_active = max(1, max_active)
+            if max_connections is not None:
+                self.max_connections = max(1, max_connections)
+            if global_rate is not None:
+                self.global_rate = max(0, global_rate)
+            self.start_pending()
+
+    def snapshot(self):
+        with self.lock:
+            return {filename: download.snapshot() for filename, download in self.downloads.items()}
+
+    def limits(self):
+        with self.lock:
+            return {"max_active": self.max_active, "max_connections": self.max_connections, "global_rate": self.global_rate,
+                    "active": sum(1 for download in self.downloads.values() if download.running)}
+
+    def start_pending(self):
+        """Inicia las descargas en cola que quepan, por prioridad y orden de llegada. Se llama con el lock tomado."""
+        active = sum(1 for download in self.downloads.values() if download.running)
+        queued = sorted((download for download in self.downloads.values() if download.status == "queued" and not download.running),
+                        key=lambda download: (PRIORITIES[download.priority], download.sequence))
+        for download in queued[:max(0, self.max_active - active)]:
+            download.reset()
+            download.status = "running"
+            download.running = True
+            download.started = time.time()
+            download.finished = None
+            threading.Thread(target=self.run, args=(download,), daemon=True).start()
+        self.rebalance()
+
+    def rebalance(self):
+        """Reparte conexiones y tasa en partes iguales entre las descargas activas. Se llama con el lock tomado."""
+        active = [download for download in self.downloads.values() if download.running and download.stop_reason is None]
+        for download in active:
+            download.limit(max(1, self.max_connections // len(active)), self.global_rate / len(active))
+
+    def run(self, download):
+        try:
+            complete = self.run_download(download)
+        except Exception as e:
+            print(f"[DOWNLOADS] Error inesperado al descargar '{download.filename}': {e}")
+            complete = False
+        if download.stop_reason == "cancel" and not complete and self.discard is not None:
+            self.discard(download.filename) # Antes de que pueda volver a empezar si se pidió de nuevo
+        with self.lock:
+            download.running = False
+            if download.status == "running":
+                download.status = "completed" if complete else "failed"
+            if download.status != "queued":
+                download.finished = time.time()
+            self.start_pending() # Libera su lugar: entra la siguiente de la cola (o ella misma si se reanudó)
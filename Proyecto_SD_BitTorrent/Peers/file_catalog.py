@@ -0,0 +1,129 @@
+# bittorrent_project/file_catalog.py
+import os
+import time
+import threading
+
+from file_manager import manifest_cache, manifest_lock, piece_size_for, num_pieces
+
+RACY_MTIME_WINDOW = 2 # Segundos: un directorio modificado hace menos se vuelve a leer (mtime de baja resolución)
+
+class FileCatalog:
+    """
+    Catálogo en memoria de los archivos locales (compartidos y recibidos). Se construye una vez y
+    se mantiene al día comparando el mtime de cada directorio: si no cambió no se relee, y si cambió
+    solo se hace stat de los archivos nuevos. Un archivo que cambia de contenido sin crear ni borrar
+    entradas (p.ej. una descarga que termina) se actualiza con refresh(). 'version' aumenta con cada
+    cambio, para saber si hace falta anunciar algo al tracker.
+    """
+    def __init__(self, directories):
+        self.directories = directories # En orden de prioridad (SHARED_DIR antes que RECEIVED_DIR)
+        self.lock = threading.Lock()
+        self.dir_mtimes = {} # directorio -> mtime_ns de la última lectura
+        self.dir_entries = {directory: {} for directory in directories} # directorio -> {nombre: entrada}
+        self.version = 0
+        self.rescan()
+
+    def make_entry(self, path, st):
+        return {"path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "ino": st.st_ino,
+                "num_chunks": num_pieces(st.st_size, piece_size_for(st.st_size))}
+
+    def scan_directory(self, directory):
+        """
+        Relee un directorio que cambió. Una entrada conocida se conserva si su stat coincide; si no
+        (p.ej. el archivo se reemplazó con un renombrado atómico) se reconstruye.
+        """
+        known = self.dir_entries[directory]
+        entries = {}
+        changed = False
+        with os.scandir(directory) as it:
+            for dir_entry in it:
+                if not dir_entry.is_file():
+                    continue
+                try:
+                    st = dir_entry.stat()
+                except OSError:
+                    continue # Se borró mientras se listaba
+                entry = known.get(dir_entry.name)
+                if entry is None or (entry["size"], entry["mtime_ns"], entry["ino"]) != (st.st_size, st.st_mtime_ns, st.st_ino):
+                    entry = self.make_entry(dir_entry.path, st)
+                    changed = True
+                entries[dir_entry.name] = entry
+        changed = changed or entries.keys() != known.keys()
+        self.dir_entries[directory] = entries
+        return changed
+
+    def rescan(self):
+        """Pone al día el catálogo. Si ningún directorio cambió cuesta un stat por directorio."""
+        with self.lock:
+            changed = False
+            for directory in self.directories:
+                try:
+                    mtime = os.stat(directory).st_mtime_ns
+                except OSError:
+                    mtime = None
+                if mtime is not None and mtime == self.dir_mtimes.get(directory):
+                    continue
+                # Si el directorio cambió hace muy poco, otro cambio en el mismo instante no movería su mtime
+                recent = mtime is not None and time.time_ns() - mtime < RACY_MTIME_WINDOW * 1_000_000_000
+                self.dir_mtimes[directory] = None if recent else mtime
+                if mtime is None:
+                    changed = changed or bool(self.dir_entries[directory])
+                    self.dir_entries[directory] = {}
+                else:
+                    changed = self.scan_directory(directory) or changed
+            if changed:
+                self.version += 1
+
+    def refresh(self, filename):
+        """Vuelve a leer el tamaño y mtime de un archivo (p.ej. al terminar su descarga)."""
+        with self.lock:
+            for directory in self.directories:
+                path = os.path.join(directory, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    if self.dir_entries[directory].pop(filename, None) is not None:
+                        self.version += 1
+                    continue
+                entry = self.make_entry(path, st)
+                if self.dir_entries[directory].get(filename) != entry:
+                    self.dir_entries[directory][filename] = entry
+                    self.version += 1
+
+    def names(self):
+        """Nombres de todos los archivos locales (un archivo presente en ambos directorios aparece una vez)."""
+        self.rescan()
+        with self.lock:
+            names = set()
+            for directory in self.directories:
+                names.update(self.dir_entries[directory])
+            return list(names)
+
+    def get(self, filename):
+        """Entrada del archivo ({"path", "size", "mtime_ns", "ino", "num_chunks", "hashed"}) o None."""
+        self.rescan()
+        with self.lock:
+            for directory in self.directories:
+                entry = self.dir_entries[directory].get(filename)
+                if entry is not None:
+                    break
+            else:
+                return None
+        entry = dict(entry)
+        with manifest_lock:
+            cached = manifest_cache.get(entry["path"])
+        entry["hashed"] = bool(cached and cached[0] == entry["size"] and cached[1] == entry["mtime_ns"])
+        return entry
+
+    def path(self, filename):
+        entry = self.get(filename)
+        return entry["path"] if entry is not None else None
+
+    def entries(self):
+        """Todas las entradas, por nombre (la del directorio de mayor prioridad si está en ambos)."""
+        self.rescan()
+        with self.lock:
+            result = {}
+            for directory in reversed(self.directories):
+                result.update(self.dir_entries[directory])
+            return {name: dict(entry) for name, entry in result.items()}
@@ -4,76 +4,372 @@ import json
 import time
 import threading # Necesario para el heartbeat del peer
 import os # Necesario para listar archivos
+import struct # Cabeceras binarias del protocolo de chunks
+import asyncio # Servidor de conexiones entrantes
+from concurrent.futures import ThreadPoolExecutor
 
-def send_json(ip, port, message, retries=3, timeout=15): 
+from metrics import METRICS
+
+# --- PROTOCOLO BINARIO DE TRANSFERENCIA ---
+# Los mensajes de control siguen siendo JSON. Los chunks viajan en un frame binario:
+# cabecera de 9 bytes (magic, tipo de frame, longitud del payload) seguida de los bytes crudos.
+FRAME_MAGIC = b"BTP1"
+FRAME_HEADER = struct.Struct("!4sBI")
+FRAME_JSON = 0 # Payload JSON (respuestas de control o errores)
+FRAME_DATA = 1 # Payload binario (bytes del chunk sin codificar)
+FRAME_COMPRESSED = 2 # Payload binario comprimido con el códec que pidió el cliente (ver compression.py)
+
+# Modos de transferencia soportados por este peer, en orden de preferencia.
+# Un peer antiguo ignora el campo "transfer" del REQUEST_CHUNK y responde en JSON/base64.
+TRANSFER_MODES = ["binary", "json"]
+
+RECV_BUFFER_SIZE = 64 * 1024
+
+# Solicitudes al tracker (y a la API de control): van en JSON plano, que todo servidor entiende (uno
+# actual lo sigue leyendo aunque llegue en varios segmentos TCP). A un servidor que anunció en una
+# respuesta que acepta frames ("framing": true) se le envían en un frame FRAME_JSON con su longitud en
+# la cabecera, así sabe cuánto leer sin intentar decodificar a medias. Un tracker antiguo solo entiende
+# JSON plano de hasta LEGACY_MESSAGE_SIZE bytes.
+LEGACY_MESSAGE_SIZE = 4096
+FRAMED_SERVERS = set() # (ip, puerto) de servidores que anunciaron que aceptan solicitudes enmarcadas
+MAX_MESSAGE_SIZE = 32 * 1024 * 1024 # Tamaño máximo de una solicitud o respuesta JSON
+STREAM_CHUNK_SIZE = 64 * 1024 # Las respuestas grandes se envían en trozos de este tamaño
+
+class MessageTooLarge(Exception):
+    """El mensaje supera el tamaño máximo permitido."""
+
+def recv_exact(sock, size):
+    """Lee exactamente 'size' bytes en un buffer preasignado, sin concatenaciones."""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise ConnectionError(f"Conexión cerrada tras recibir {received}/{size} bytes")
+        received += n
+    return buffer
+
+def recv_until_close(sock, initial=b"", max_size=None):
+    """Lee todo lo que envíe el otro extremo hasta que cierre la conexión (como mucho 'max_size' bytes)."""
+    parts = [initial] if initial else []
+    received = len(initial)
+    while True:
+        data = sock.recv(RECV_BUFFER_SIZE)
+        if not data:
+            break
+        received += len(data)
+        if max_size is not None and received > max_size:
+            raise MessageTooLarge(f"Respuesta de más de {max_size} bytes")
+        parts.append(data)
+    return b"".join(parts)
+
+def recv_prefix(sock, size):
+    """Lee hasta 'size' bytes; devuelve menos si el otro extremo cierra antes."""
+    parts = []
+    received = 0
+    while received < size:
+        data = sock.recv(size - received)
+        if not data:
+            break
+        parts.append(data)
+        received += len(data)
+    return b"".join(parts)
+
+def send_frame(sock, frame_type, payload):
+    """Envía un frame binario: cabecera + payload (el payload no se copia ni se codifica)."""
+    sock.sendall(FRAME_HEADER.pack(FRAME_MAGIC, frame_type, len(payload)))
+    if payload:
+        sock.sendall(payload)
+
+def recv_frame(sock, header_bytes=None):
+    """
+    Recibe un frame binario y retorna (tipo, payload).
+    'header_bytes' permite pasar una cabecera ya leída (p.ej. al detectar el modo de la respuesta).
+    """
+    if header_bytes is None:
+        header_bytes = recv_exact(sock, FRAME_HEADER.size)
+    magic, frame_type, length = FRAME_HEADER.unpack(header_bytes)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Cabecera de frame inválida")
+    payload = recv_exact(sock, length) if length else bytearray()
+    return frame_type, payload
+
+def exchange_json(ip, port, payload, framed, timeout, max_response_size):
+    """Envía una solicitud ya codificada (enmarcada o en JSON plano) y retorna los bytes de la respuesta."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect((ip, port))
+        if framed:
+            send_frame(s, FRAME_JSON, payload)
+        else:
+            s.sendall(payload)
+        # Recibir todos los datos que el servidor envíe hasta que cierre la conexión.
+        return recv_until_close(s, max_size=max_response_size)
+
+def send_json(ip, port, message, retries=3, timeout=15, max_response_size=MAX_MESSAGE_SIZE): 
+    payload = json.dumps(message).encode()
     for attempt in range(retries):
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(timeout)
-                s.connect((ip, port))
-                s.sendall(json.dumps(message).encode()) 
-                
-                response_data = b""
-                # Recibir todos los datos que el servidor envíe hasta que cierre la conexión.
-                while True:
-                    chunk = s.recv(4096)
-                    if not chunk: # Si el chunk está vacío, el servidor ha cerrado su lado
-                        break 
-                    response_data += chunk
-                
-                # Una vez que se han recibido *todos* los datos, intentar decodificar el JSON
-                if response_data:
-                    try:
-                        decoded_response = json.loads(response_data.decode())
-                        return decoded_response
-                    except json.JSONDecodeError as json_e:
-                        print(f"[NETWORK_UTILS] Error al decodificar JSON de {ip}:{port}: {json_e}")
-                        print(f"[NETWORK_UTILS] Datos RAW recibidos: {response_data.decode(errors='ignore')}")
-                        return None
-                else:
-                    print(f"[NETWORK_UTILS] No se recibieron datos de respuesta de {ip}:{port}.")
+            framed = (ip, port) in FRAMED_SERVERS
+            response_data = exchange_json(ip, port, payload, framed, timeout, max_response_size)
+
+            # Una vez que se han recibido *todos* los datos, intentar decodificar el JSON
+            if response_data:
+                try:
+                    decoded_response = json.loads(response_data.decode())
+                    framing = decoded_response.get("framing") if isinstance(decoded_response, dict) else None
+                    if framing is True:
+                        FRAMED_SERVERS.add((ip, port)) # Las siguientes solicitudes ya van enmarcadas
+                    elif framing is False:
+                        FRAMED_SERVERS.discard((ip, port)) # El servidor dejó de aceptarlas
+                    return decoded_response
+                except json.JSONDecodeError as json_e:
+                    print(f"[NETWORK_UTILS] Error al decodificar JSON de {ip}:{port}: {json_e}")
+                    print(f"[NETWORK_UTILS] Datos RAW recibidos: {response_data.decode(errors='ignore')}")
                     return None
+            else:
+                print(f"[NETWORK_UTILS] No se recibieron datos de respuesta de {ip}:{port}.")
+                return None
 
         except (socket.timeout, ConnectionRefusedError) as e:
             print(f"[RETRY {attempt+1}] Error conectando con {ip}:{port} - {e}")
+            METRICS.inc("bt_send_json_retries_total")
             time.sleep(1)
         except Exception as e:
             print(f"[NETWORK_UTILS] Error inesperado al enviar JSON a {ip}:{port}: {e}")
             break 
     return None
 
-def start_listener(ip, port, handler):
-    """Inicia un servidor socket que ejecuta 'handler' por cada conexión."""
+# --- SERVIDOR ASYNCIO (COMPARTIDO POR PEERS Y TRACKER) ---
+# Un solo hilo con un event loop atiende todas las conexiones. La concurrencia está acotada por
+# MAX_CONNECTIONS, las lecturas tienen timeout, las escrituras esperan a que el socket drene
+# (backpressure) y las lecturas de disco bloqueantes van a un executor pequeño.
+MAX_CONNECTIONS = 512 # Conexiones atendidas a la vez; las demás esperan sin leer (TCP frena al cliente)
+READ_TIMEOUT = 30 # Segundos máximos esperando datos de un cliente
+DISK_WORKERS = 4 # Hilos para lecturas de disco bloqueantes
+
+def is_complete_json(data):
+    """True si 'data' ya es un JSON completo. Solo se intenta decodificar si termina como un objeto o lista."""
+    if not data.rstrip().endswith((b"}", b"]")):
+        return False
+    try:
+        json.loads(data)
+    except ValueError: # JSON incompleto (o inválido: se sigue leyendo hasta que el cliente cierre)
+        return False
+    return True
+
+class AsyncConnection:
+    """Conexión aceptada por el servidor asyncio: lecturas con timeout y escrituras con backpressure."""
+    def __init__(self, reader, writer, executor, read_timeout=READ_TIMEOUT):
+        self.reader = reader
+        self.writer = writer
+        self.executor = executor
+        self.addr = writer.get_extra_info("peername") # (ip, puerto) del cliente
+        self.read_timeout = read_timeout
+
+    async def read_message(self, max_size=4096):
+        """Lee lo que haya disponible (hasta 'max_size' bytes), como un recv(). Retorna b"" si el cliente cerró."""
+        return await asyncio.wait_for(self.reader.read(max_size), self.read_timeout)
+
+    async def read_exact(self, size):
+        return await asyncio.wait_for(self.reader.readexactly(size), self.read_timeout)
+
+    async def read_request(self, max_size=MAX_MESSAGE_SIZE, legacy_size=LEGACY_MESSAGE_SIZE):
+        """
+        Lee una solicitud JSON y retorna sus bytes: enmarcada (cualquier tamaño hasta 'max_size', leída
+        de forma incremental) o JSON plano de un cliente antiguo, leído hasta que esté completo.
+        """
+        data = await self.read_message(legacy_size)
+        while data and len(data) < len(FRAME_MAGIC) and FRAME_MAGIC.startswith(data):
+            more = await self.read_message(len(FRAME_MAGIC) - len(data))
+            if not more:
+                break
+            data += more
+        if not data.startswith(FRAME_MAGIC):
+            return await self.read_plain_json(data, max_size) # Clientes antiguos
+
+        if len(data) < FRAME_HEADER.size:
+            data += await self.read_exact(FRAME_HEADER.size - len(data))
+        _, frame_type, length = FRAME_HEADER.unpack_from(data)
+        if frame_type != FRAME_JSON:
+            raise ValueError(f"Tipo de frame inesperado: {frame_type}")
+        if length > max_size:
+            raise MessageTooLarge(f"Solicitud de {length} bytes (máximo {max_size})")
+        payload = data[FRAME_HEADER.size:]
+        if len(payload) < length:
+            payload += await self.read_exact(length - len(payload))
+        return payload[:length]
+
+    async def read_plain_json(self, data, max_size):
+        """
+        Completa una solicitud en JSON plano: puede llegar en varios segmentos TCP, así que se sigue
+        leyendo hasta que el JSON esté completo, el cliente cierre o se supere 'max_size'.
+        """
+        data = bytearray(data)
+        while data and not is_complete_json(data):
+            more = await self.read_message(RECV_BUFFER_SIZE)
+            if not more:
+                break
+            data += more
+            if len(data) > max_size:
+                raise MessageTooLarge(f"Solicitud de más de {max_size} bytes")
+        return bytes(data)
+
+    async def read_frame(self):
+        """Recibe un frame binario y retorna (tipo, payload)."""
+        magic, frame_type, length = FRAME_HEADER.unpack(await self.read_exact(FRAME_HEADER.size))
+        if magic != FRAME_MAGIC:
+            raise ValueError("Cabecera de frame inválida")
+        payload = await self.read_exact(length) if length else b""
+        return frame_type, payload
+
+    async def send(self, data):
+        self.writer.write(data)
+        await self.writer.drain() # Backpressure: esperar si el cliente no está leyendo
+
+    async def send_json(self, message):
+        await self.send(json.dumps(message).encode())
+
+    async def send_json_stream(self, message, chunk_size=STREAM_CHUNK_SIZE):
+        """Envía un JSON grande por partes a medida que se codifica, sin armar el mensaje entero en memoria."""
+        parts = []
+        pending = 0
+        for part in json.JSONEncoder().iterencode(message):
+            parts.append(part)
+            pending += len(part)
+            if pending >= chunk_size:
+                await self.send("".join(parts).encode())
+                parts, pending = [], 0
+        if parts:
+            await self.send("".join(parts).encode())
+
+    async def send_frame(self, frame_type, payload):
+        self.writer.write(FRAME_HEADER.pack(FRAME_MAGIC, frame_type, len(payload)))
+        if payload:
+            self.writer.write(payload)
+        await self.writer.drain()
+
+    async def send_file_frame(self, frame_type, file, offset, count):
+        """
+        Envía un frame cuyo payload son 'count' bytes de 'file' desde 'offset', con sendfile:
+        el kernel copia del page cache al socket sin pasar por Python (con fallback a lectura normal).
+        """
+        self.writer.write(FRAME_HEADER.pack(FRAME_MAGIC, frame_type, count))
+        await self.writer.drain()
+        try:
+            sent = await asyncio.get_running_loop().sendfile(self.writer.transport, file, offset, count)
+        except Exception:
+            self.writer.close() # La cabecera ya salió: el flujo quedaría desincronizado
+            raise
+        if sent != count:
+            self.writer.close()
+            raise ConnectionError(f"sendfile envió {sent} de {count} bytes")
+
+    async def run_blocking(self, func, *args):
+        """Ejecuta una operación bloqueante (lectura de disco) en el executor sin detener el event loop."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+async def serve_forever(ip, port, handler, max_connections, read_timeout, disk_workers, on_ready=None):
+    executor = ThreadPoolExecutor(max_workers=disk_workers)
+    slots = asyncio.Semaphore(max_connections)
+
+    async def on_connect(reader, writer):
+        addr = writer.get_extra_info("peername")
+        METRICS.inc("bt_connections_total")
+        async with slots:
+            conn = AsyncConnection(reader, writer, executor, read_timeout)
+            METRICS.inc("bt_connections_active")
+            try:
+                await handler(conn, addr)
+            except Exception as e:
+                print(f"[NETWORK_UTILS LISTENER ERROR] Error no controlado con {addr}: {e}")
+            finally:
+                METRICS.inc("bt_connections_active", -1)
+                await conn.close()
+
+    server = await asyncio.start_server(on_connect, ip, port, reuse_address=True)
+    print(f"[NETWORK_UTILS LISTENER] Escuchando conexiones entrantes en {ip}:{port}")
+    if on_ready is not None:
+        on_ready() # El puerto ya acepta conexiones
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((ip, port))
-        s.listen()
-        print(f"[NETWORK_UTILS LISTENER] Escuchando conexiones entrantes en {ip}:{port}") # <-- **IMPORTANTE: AÑADE/CORRIGE ESTA LÍNEA**
-        while True:
-            conn, addr = s.accept()
-            # El handler debe ser ejecutado en un hilo separado para manejar múltiples conexiones
-            #print(f"[NETWORK_UTILS LISTENER] Conexión aceptada de {addr}") # <-- **IMPORTANTE: AÑADE ESTA LÍNEA**
-            threading.Thread(target=handler, args=(conn, addr), daemon=True).start()
-            # ^^^ Aquí se pasa 'conn' y 'addr' al handler (serve_file_handler)
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False)
+
+def start_listener(ip, port, handler, max_connections=MAX_CONNECTIONS, read_timeout=READ_TIMEOUT, disk_workers=DISK_WORKERS, on_ready=None):
+    """
+    Inicia el servidor asyncio y bloquea mientras esté activo.
+    'handler' es una corrutina handler(conn, addr) que atiende cada conexión (conn es un AsyncConnection).
+    'on_ready()' se llama (en el hilo del listener) en cuanto el puerto está escuchando.
+    """
+    try:
+        asyncio.run(serve_forever(ip, port, handler, max_connections, read_timeout, disk_workers, on_ready))
     except OSError as e:
-        print(f"[NETWORK_UTILS LISTENER ERROR] Error al iniciar el listener en {ip}:{port}: {e}") # <-- **IMPORTANTE: CORRIGE ESTA LÍNEA**
+        print(f"[NETWORK_UTILS LISTENER ERROR] Error al iniciar el listener en {ip}:{port}: {e}")
     except Exception as e:
         # Captura cualquier otro error inesperado durante la ejecución del listener
-        print(f"[NETWORK_UTILS LISTENER ERROR] Error inesperado en el listener: {e}") # <-- **IMPORTANTE: AÑADE ESTA LÍNEA**
+        print(f"[NETWORK_UTILS LISTENER ERROR] Error inesperado en el listener: {e}")
     finally:
-        if 's' in locals() and s: # Asegúrate de que 's' exista antes de intentar cerrarlo
+        print(f"[NETWORK_UTILS LISTENER] Listener en {ip}:{port} cerrado.")
+
+# --- DETECCIÓN DE LAS IPs DEL PEER ---
+def get_aws_instance_ips():
+    """
+    IPs (privada, pública) del peer según los metadatos de AWS EC2 o, fuera de EC2, la IP local de
+    salida para ambas. Consulta la red (hasta dos timeouts de 1 s): solo se llama si no se configuró la IP.
+    """
+    import urllib.request # Solo aquí: importarlo retrasa el arranque del peer
+    private_ip = None
+    public_ip = None
+    try:
+        # Obtener IP privada de los metadatos de AWS EC2
+        # 'local-ipv4' es el endpoint para la IP privada
+        private_ip = urllib.request.urlopen("http://169.254.169.254/latest/meta-data/local-ipv4", timeout=1).read().decode()
+        # Obtener IP pública de los metadatos de AWS EC2
+        # 'public-ipv4' es el endpoint para la IP pública
+        public_ip = urllib.request.urlopen("http://169.254.169.254/latest/meta-data/public-ipv4", timeout=1).read().decode()
+        return private_ip, public_ip
+    except Exception:
+        # Si falla (no en EC2, metadatos no accesibles, etc.),
+        # intenta obtener la IP local del sistema de otra manera (será la misma para binding y advertised)
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.connect(("8.8.8.8", 80)) # Conecta a un servidor externo (Google DNS) para obtener la IP de salida
+            local_ip = s.getsockname()[0]
             s.close()
-            print(f"[NETWORK_UTILS LISTENER] Listener en {ip}:{port} cerrado.")
+            return local_ip, local_ip # En este caso, la IP local es tanto la de binding como la que se anuncia
+        except Exception as e:
+            print(f"Error al obtener IPs locales: {e}")
+            return None, None
 
 # --- NUEVAS FUNCIONES PARA INTERACCIÓN CON EL TRACKER ---
-def register_or_update_peer(tracker_ip, tracker_port, peer_id, peer_bind_ip, peer_port, shared_dir, received_dir, initial_registration=True, advertised_ip=None):
-    """Registra o actualiza un peer con el tracker, usando la IP anunciada si se proporciona."""
+def list_local_files(shared_dir, received_dir):
+    """Archivos que el peer puede compartir: los de su directorio compartido y los recibidos."""
+    files_to_share = [f for f in os.listdir(shared_dir) if os.path.isfile(os.path.join(shared_dir, f))]
+    files_to_share.extend([f for f in os.listdir(received_dir) if os.path.isfile(os.path.join(received_dir, f))])
+    return files_to_share
+
+def register_or_update_peer(tracker_ip, tracker_port, peer_id, peer_bind_ip, peer_port, shared_dir, received_dir, initial_registration=True, advertised_ip=None, bitfields=None, version=None, files=None,
+                            session=None, timeout=15, retries=3):
+    """
+    Registra o actualiza un peer con el tracker, usando la IP anunciada si se proporciona.
+    'bitfields' indica, para los archivos descargados a medias, qué chunks tiene el peer
+    (los archivos sin bitfield están completos). 'version' es la versión del catálogo enviado
+    y 'session' identifica el arranque del peer que la numeró.
+    """
     # Si no se proporciona advertised_ip, usa peer_bind_ip como fallback (para entornos no-NAT como localhost)
     ip_to_send_to_tracker = advertised_ip if advertised_ip else peer_bind_ip
 
-    files_to_share = [f for f in os.listdir(shared_dir) if os.path.isfile(os.path.join(shared_dir, f))]
-    files_to_share.extend([f for f in os.listdir(received_dir) if os.path.isfile(os.path.join(received_dir, f))])
+    files_to_share = files if files is not None else list_local_files(shared_dir, received_dir)
     
     command = "REGISTER" if initial_registration else "UPDATE_FILES"
     
@@ -83,15 +379,143 @@ def register_or_update_peer(tracker_ip, tracker_port, peer_id, peer_bind_ip, pee
         "ip": ip_to_send_to_tracker, # <-- ¡Envía la IP pública/anunciada aquí!
         "port": peer_port,
         "files": files_to_share,
+        "bitfields": bitfields or {},
         "status": "activo" # Siempre enviamos activo en el heartbeat
     }
-    response = send_json(tracker_ip, tracker_port, message)
+    if version is not None:
+        message["version"] = version
+    if session is not None:
+        message["session"] = session
+    response = send_json(tracker_ip, tracker_port, message, retries=retries, timeout=timeout)
     if response and (response.get("response") == "REGISTERED" or response.get("response") == "FILES_UPDATED"):
         return True
     else:
         # print(f"[NETWORK_UTILS] Error al {command} con el tracker: {response}") # Puedes comentar esto para menos ruido
         return False
 
+class CatalogVersions:
+    """
+    Numera el contenido que anuncia el peer (archivos y bitfields): la misma versión significa siempre
+    el mismo contenido, aunque se anuncie a varios trackers en momentos distintos. Así los trackers
+    que replican el estado entre sí pueden quedarse con la versión más nueva. 'session' distingue los
+    arranques del peer, que vuelven a numerar desde 1.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.session = int(time.time() * 1000)
+        self.version = 0
+        self.content = None
+
+    def version_for(self, catalog_key, bitfields):
+        content = (catalog_key, json.dumps(bitfields, sort_keys=True))
+        with self.lock:
+            if content != self.content:
+                self.version += 1
+                self.content = content
+            return self.version
+
+class TrackerAnnouncer:
+    """
+    Heartbeats con versión del catálogo a un tracker. Tras un registro completo, cada anuncio es un PING con la
+    versión que el tracker debería tener, o un UPDATE_DELTA con solo los archivos y bitfields que
+    cambiaron. Si el tracker perdió el estado (o la versión no coincide) se reenvía el catálogo completo.
+    Con un 'catalog' (FileCatalog del peer) los archivos salen de memoria en vez de listar los directorios,
+    y si la versión del catálogo no cambió ni siquiera se comparan. Con varios trackers hay un anunciador
+    por tracker y todos comparten 'versions'.
+    """
+    def __init__(self, catalog=None, versions=None, timeout=15, retries=3):
+        self.catalog = catalog
+        self.versions = versions if versions is not None else CatalogVersions()
+        self.timeout = timeout # Para send_json: con varios trackers conviene fallar pronto y seguir con otro
+        self.retries = retries
+        self.version = 0 # Versión que tiene el tracker
+        self.announced_files = None # None: el tracker no tiene nuestro catálogo y hay que enviarlo completo
+        self.announced_catalog_version = None
+        self.announced_bitfields = {}
+        self.legacy_tracker = False # Tracker antiguo sin versiones: siempre se envía el catálogo completo
+        self.lock = threading.Lock()
+
+    def send(self, tracker_ip, tracker_port, message):
+        return send_json(tracker_ip, tracker_port, message, retries=self.retries, timeout=self.timeout)
+
+    def announce(self, tracker_ip, tracker_port, peer_id, peer_bind_ip, peer_port, shared_dir, received_dir, initial_registration=False, advertised_ip=None, bitfields=None):
+        """Mismos argumentos que register_or_update_peer. Retorna True si el tracker quedó al día."""
+        bitfields = bitfields or {}
+        with self.lock:
+            catalog_version = None
+            if self.catalog is not None:
+                self.catalog.rescan()
+                catalog_version = self.catalog.version
+            catalog_unchanged = catalog_version is not None and catalog_version == self.announced_catalog_version
+            files = None if catalog_unchanged else self.local_files(shared_dir, received_dir)
+            target = self.versions.version_for(catalog_version if catalog_version is not None else frozenset(files), bitfields)
+
+            def full_sync():
+                nonlocal files
+                if files is None:
+                    files = self.local_files(shared_dir, received_dir)
+                self.announced_files = None
+                if not register_or_update_peer(tracker_ip, tracker_port, peer_id, peer_bind_ip, peer_port, shared_dir, received_dir,
+                                               initial_registration, advertised_ip, bitfields, version=target, files=files,
+                                               session=self.versions.session, timeout=self.timeout, retries=self.retries):
+                    return False
+                self.version = target
+                self.announced_files = set(files)
+                self.announced_catalog_version = catalog_version
+                self.announced_bitfields = dict(bitfields)
+                return True
+
+            if initial_registration or self.legacy_tracker or self.announced_files is None:
+                return full_sync()
+
+            if files is None:
+                current_files, added, removed = self.announced_files, [], []
+            else:
+                current_files = set(files)
+                added = [f for f in current_files if f not in self.announced_files]
+                removed = [f for f in self.announced_files if f not in current_files]
+            changed_bitfields = {f: b for f, b in bitfields.items() if self.announced_bitfields.get(f) != b}
+            removed_bitfields = [f for f in self.announced_bitfields if f not in bitfields]
+
+            if not (added or removed or changed_bitfields or removed_bitfields) and target == self.version:
+                # Nada cambió: un PING de pocos bytes basta para seguir activo
+                response = self.send(tracker_ip, tracker_port, {"command": "PING", "peer_id": peer_id, "version": self.version})
+                if not response or response.get("response") != "PONG":
+                    return False
+                if "version" not in response:
+                    self.legacy_tracker = True
+                if response.get("version") != self.version:
+                    return full_sync() # El tracker no nos conoce o tiene otra versión del catálogo
+                return True
+
+            message = {
+                "command": "UPDATE_DELTA",
+                "peer_id": peer_id,
+                "session": self.versions.session,
+                "base_version": self.version,
+                "version": target,
+                "added": added,
+                "removed": removed,
+                "bitfields": changed_bitfields,
+                "bitfields_removed": removed_bitfields
+            }
+            response = self.send(tracker_ip, tracker_port, message)
+            if response and response.get("response") == "DELTA_APPLIED":
+                self.version = target
+                self.announced_files = current_files
+                self.announced_catalog_version = catalog_version
+                self.announced_bitfields = dict(bitfields)
+                return True
+            if response and response.get("response") == "RESYNC":
+                return full_sync()
+            self.announced_files = None # Sin respuesta: no se sabe si el tracker aplicó el delta
+            return False
+
+    def local_files(self, shared_dir, received_dir):
+        if self.catalog is not None:
+            return self.catalog.names()
+        return list_local_files(shared_dir, received_dir)
+
 def get_peers_with_file(tracker_ip, tracker_port, filename):
     """Solicita al tracker la lista de peers que tienen un archivo específico."""
     message = {
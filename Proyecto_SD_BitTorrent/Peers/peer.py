@@ -4,177 +4,469 @@ import threading
 import json
 import os
 import time
-from tqdm import tqdm
-import urllib.request
-import random
 import base64
+import asyncio
 
 # Importaciones de módulos locales
-from file_manager import load_progress, save_progress, get_progress, remove_progress, CHUNK_SIZE
-from network_utils import send_json, start_listener, register_or_update_peer, get_peers_with_file, get_network_status
+from file_manager import load_progress, load_resume_state, has_resume_state, remove_resume_state, resume_state_filenames, ResumeState, preallocate_file, CHUNK_SIZE
+from file_manager import get_manifest, is_valid_manifest, verify_chunk, Bitfield, piece_size_for, num_pieces, piece_length, BLOCK_SIZE, MAX_BLOCK_SIZE
+from network_utils import start_listener, get_aws_instance_ips
+from network_utils import recv_frame, recv_prefix, recv_until_close, FRAME_HEADER, FRAME_MAGIC, FRAME_JSON, FRAME_DATA, FRAME_COMPRESSED, TRANSFER_MODES
+from connection_pool import ConnectionPool
+from scheduler import ChunkScheduler, DOWNLOAD_WORKERS
+from seeder_cache import SeederCache
+from file_catalog import FileCatalog
+from peer_stats import PeerStats
+from upload_limiter import UploadLimiter
+from tracker_client import TrackerClient, parse_trackers
+from download_manager import DownloadManager, PRIORITIES
+from compression import decompress, choose_codec, looks_compressed, COMPRESSION_CODECS
+from metrics import METRICS, start_metrics_http
 
 # --- CONFIGURACIÓN INICIAL DEL PEER ---
-PEER_ID = input("Ingrese el nombre del PEER: ")
-
-# --- MODIFICACIÓN AQUÍ: Función para obtener IPs públicas y privadas ---
-def get_aws_instance_ips():
-    private_ip = None
-    public_ip = None
-    try:
-        # Obtener IP privada de los metadatos de AWS EC2
-        # 'local-ipv4' es el endpoint para la IP privada
-        private_ip = urllib.request.urlopen("http://169.254.169.254/latest/meta-data/local-ipv4", timeout=1).read().decode()
-        # Obtener IP pública de los metadatos de AWS EC2
-        # 'public-ipv4' es el endpoint para la IP pública
-        public_ip = urllib.request.urlopen("http://169.254.169.254/latest/meta-data/public-ipv4", timeout=1).read().decode()
-        return private_ip, public_ip
-    except Exception:
-        #print("Nose pudo obtener las IPs")
-        # Si falla (no en EC2, metadatos no accesibles, etc.),
-        # intenta obtener la IP local del sistema de otra manera (será la misma para binding y advertised)
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80)) # Conecta a un servidor externo (Google DNS) para obtener la IP de salida
-            local_ip = s.getsockname()[0]
-            s.close()
-            return local_ip, local_ip # En este caso, la IP local es tanto la de binding como la que se anuncia
-        except Exception as e:
-            print(f"Error al obtener IPs locales: {e}")
-            return None, None
-
-# Obtener IPs al inicio
-PEER_BIND_IP, PEER_ADVERTISED_IP = get_aws_instance_ips()
-
-if PEER_BIND_IP is None:
-    print("[PEER] No se pudo determinar la IP del peer. Saliendo.")
-    exit()
-PEER_ADVERTISED_IP=input("Ingrese la IP Publica de este PEER: ")
+# Cada valor se toma de su variable de entorno si está definida (p.ej. para levantar peers sin
+# interacción desde benchmark_swarm.py); si no, se pregunta por consola.
+def config_value(env_name, prompt):
+    value = os.environ.get(env_name)
+    return value if value is not None else input(prompt)
+
+PEER_ID = config_value("BT_PEER_ID", "Ingrese el nombre del PEER: ")
+
+# Obtener IPs al inicio (con BT_PEER_IP no se consultan los metadatos ni la red: se usa esa IP para
+# el binding y, salvo que BT_PEER_ADVERTISED_IP diga otra, también para anunciarse al tracker)
+if os.environ.get("BT_PEER_IP"):
+    PEER_BIND_IP = os.environ["BT_PEER_IP"]
+    PEER_ADVERTISED_IP = os.environ.get("BT_PEER_ADVERTISED_IP") or PEER_BIND_IP
+else:
+    PEER_BIND_IP, PEER_ADVERTISED_IP = get_aws_instance_ips()
+
+    if PEER_BIND_IP is None:
+        print("[PEER] No se pudo determinar la IP del peer. Saliendo.")
+        exit()
+    PEER_ADVERTISED_IP = config_value("BT_PEER_ADVERTISED_IP", "Ingrese la IP Publica de este PEER: ")
 PEER_IP = PEER_BIND_IP # Esta IP se usará para el binding local del socket
-PEER_PORT = int(input("Ingrese el puerto de este PEER: "))
+PEER_PORT = int(config_value("BT_PEER_PORT", "Ingrese el puerto de este PEER: "))
 
-TRACKER_IP= "172.31.87.191"
-TRACKER_PORT=8080
+TRACKER_IP= os.environ.get("BT_TRACKER_IP", "172.31.87.191")
+TRACKER_PORT=int(os.environ.get("BT_TRACKER_PORT", 8080))
+# Varios trackers ("ip:puerto,ip:puerto"): el peer se anuncia a todos y consulta al más rápido que responda
+TRACKERS = parse_trackers(os.environ.get("BT_TRACKERS", ""), TRACKER_PORT) or [(TRACKER_IP, TRACKER_PORT)]
+TRACKER_IP, TRACKER_PORT = TRACKERS[0] # El primero, para mostrarlo
+METRICS_HTTP_PORT = int(os.environ["BT_METRICS_PORT"]) if os.environ.get("BT_METRICS_PORT") else None # Métricas Prometheus en 127.0.0.1 (opcional)
 
 SHARED_DIR = "sample_files"
 RECEIVED_DIR = "received_files"
 
+ZERO_COPY_SENDFILE = True # Servir los chunks binarios con sendfile (False: leerlos y enviarlos desde Python)
+SESSION_IDLE_TIMEOUT = 120 # Segundos que el seeder mantiene abierta una sesión persistente sin solicitudes
+
+# Sesiones persistentes con otros peers, compartidas por descargas y consultas de info
+CONNECTION_POOL = ConnectionPool()
+PEER_STATS = PeerStats() # Throughput, RTT y fallos de cada peer remoto: deciden a quién pedir cada chunk
+# Totales del endgame de todas las descargas: cuántas veces una solicitud duplicada llegó antes que la original
+ENDGAME_STATS = {"duplicate_requests": 0, "duplicate_bytes": 0, "won_by_duplicate": 0, "cancelled": 0}
+# Bloques recibidos comprimidos: bytes que viajaron por la red y bytes de datos que representan
+COMPRESSION_STATS = {"compressed_blocks": 0, "wire_bytes": 0, "raw_bytes": 0}
+
 # Asegurarse de que los directorios existan
 os.makedirs(SHARED_DIR, exist_ok=True)
 os.makedirs(RECEIVED_DIR, exist_ok=True)
 
+# Catálogo en memoria de los archivos locales: se lee una vez y luego solo se relee lo que cambió
+LOCAL_CATALOG = FileCatalog([SHARED_DIR, RECEIVED_DIR])
+SEEDER_CACHE = SeederCache([SHARED_DIR, RECEIVED_DIR], catalog=LOCAL_CATALOG) # Rutas, archivos abiertos y chunks populares del seeder
+UPLOAD_LIMITER = UploadLimiter() # Slots de subida con cola de espera y límites de tasa (configurables en caliente)
+
 # Cargar el progreso de descargas al iniciar
 load_progress()
 
+# Descargas en curso: filename -> {"file_size", "manifest", "bitfield", "piece_size"}. Permiten servir las
+# piezas ya recibidas de un archivo incompleto mientras se sigue descargando. El bitfield es el del ResumeState.
+partial_downloads = {}
+ANNOUNCE_INTERVAL = 2 # Segundos mínimos entre anuncios del bitfield al tracker durante una descarga
+TRACKER_CLIENT = TrackerClient(TRACKERS, LOCAL_CATALOG) # Versión del catálogo anunciado: los heartbeats solo envían cambios
+
 def clear_console():
     os.system('cls' if os.name == 'nt' else 'clear')
 
+# --- CHUNKS DISPONIBLES DE ARCHIVOS INCOMPLETOS ---
+# Bitfields de descargas interrumpidas (sin descarga en curso), leídos del sidecar una sola vez:
+# filename -> (bitfield, tamaño_de_pieza), o None si el archivo está completo. download_file y
+# discard_download los olvidan después de tocar el sidecar.
+resume_bitfields = {}
+resume_bitfields_lock = threading.Lock()
+BITFIELD_NOT_LOADED = object()
+
+def cached_local_bitfield(filename):
+    """Como local_bitfield, pero sin tocar el disco: BITFIELD_NOT_LOADED si aún no se leyó el sidecar."""
+    download = partial_downloads.get(filename)
+    if download is not None:
+        return download["bitfield"], download["piece_size"]
+    return resume_bitfields.get(filename, BITFIELD_NOT_LOADED)
+
+def local_bitfield(filename):
+    """
+    Piezas que este peer tiene de un archivo de RECEIVED_DIR que aún no está completo, como
+    (bitfield, tamaño_de_pieza), o None si el archivo está completo. Puede leer el sidecar.
+    """
+    local = cached_local_bitfield(filename)
+    if local is not BITFIELD_NOT_LOADED:
+        return local
+    with resume_bitfields_lock:
+        if filename not in resume_bitfields:
+            if has_resume_state(filename):
+                # Descarga interrumpida: el bitmap de reanudación indica qué piezas están en disco
+                state = load_resume_state(filename, RECEIVED_DIR)
+                local = (state.bitfield, state.piece_size) if state is not None else (Bitfield(0), CHUNK_SIZE)
+            else:
+                local = None
+            resume_bitfields[filename] = local
+        return resume_bitfields[filename]
+
+def forget_local_bitfield(filename):
+    """Descarta el bitfield leído del sidecar de un archivo (se llama después de reescribirlo o borrarlo)."""
+    with resume_bitfields_lock:
+        resume_bitfields.pop(filename, None)
+
+async def local_bitfield_async(conn, filename):
+    """local_bitfield desde el event loop: si hay que leer el sidecar, se lee en el executor."""
+    local = cached_local_bitfield(filename)
+    if local is BITFIELD_NOT_LOADED:
+        local = await conn.run_blocking(local_bitfield, filename)
+    return local
+
+def partial_bitfields():
+    """Bitfields (con su tamaño de pieza) de todos los archivos incompletos de RECEIVED_DIR, para anunciarlos al tracker."""
+    bitfields = {}
+    for filename in set(partial_downloads) | set(resume_state_filenames()):
+        local = local_bitfield(filename)
+        if local is not None:
+            bitfields[filename] = dict(local[0].to_dict(), piece_size=local[1])
+    return bitfields
+
 # --- HEARTBEAT CON EL TRACKER ---
 def heartbeat_to_tracker(interval=10):
-    """Envía un mensaje de 'keep-alive' y actualiza archivos al tracker periódicamente."""
+    """Envía un 'keep-alive' (PING) a los trackers periódicamente, con los archivos que cambiaron si los hay."""
     while True:
         # MODIFICACIÓN: Usar PEER_ADVERTISED_IP para registrar con el tracker
-        success = register_or_update_peer(TRACKER_IP, TRACKER_PORT, PEER_ID, PEER_ADVERTISED_IP, PEER_PORT, SHARED_DIR, RECEIVED_DIR, initial_registration=False)
+        success = TRACKER_CLIENT.announce(PEER_ID, PEER_ADVERTISED_IP, PEER_PORT, SHARED_DIR, RECEIVED_DIR, initial_registration=False, bitfields=partial_bitfields())
         if success:
             #print(f"[PEER] Heartbeat enviado al tracker. Estado: Activo.")
             pass # No imprimir en cada heartbeat para evitar spam en consola
         else:
-            print(f"[PEER] Falló el envío del heartbeat al tracker. Reintentando...")
+            print(f"[PEER] Falló el envío del heartbeat a todos los trackers. Reintentando...")
         time.sleep(interval)
 
 # --- FUNCIONES DE SERVICIO DE ARCHIVOS (SEEDER) ---
-def serve_file_handler(conn, addr):
+async def send_response(conn, response, binary_mode=False):
+    """Envía una respuesta de control: en un frame JSON si el cliente negoció el modo binario, o JSON plano."""
+    if binary_mode:
+        await conn.send_frame(FRAME_JSON, json.dumps(response).encode())
+    else:
+        await conn.send_json(response)
+
+async def handle_request(conn, request, binary_mode=False):
+    """Atiende una solicitud ya decodificada y envía su respuesta por 'conn'."""
+    command = request.get("command")
+
+    # --- Manejo de GET_FILE_INFO ---
+    if command == "GET_FILE_INFO":
+        filename = request["filename"]
+        filepath_received = os.path.join(RECEIVED_DIR, filename)
+        # Ruta cacheada (se invalida si el archivo cambió). Fuera del event loop: hace stat y puede releer el catálogo
+        file_path = await conn.run_blocking(SEEDER_CACHE.resolve, filename)
+
+        download = partial_downloads.get(filename) if file_path == filepath_received else None
+        if download is not None and download["manifest"] is not None:
+            # Archivo aún descargándose: se anuncia el manifiesto original y los chunks que ya se tienen
+            response = {"status": "success", "file_size": download["file_size"], "num_chunks": download["bitfield"].num_chunks,
+                        "piece_size": download["piece_size"], "transfer_modes": TRANSFER_MODES, "manifest": download["manifest"],
+                        "bitfield": download["bitfield"].to_dict(),
+                        "compression": [] if looks_compressed(filename) else COMPRESSION_CODECS} # Sin muestrear: el archivo está a medias
+            await send_response(conn, response, binary_mode)
+        elif file_path == filepath_received and await local_bitfield_async(conn, filename) is not None:
+            # Descarga sin manifiesto o interrumpida: el contenido completo del archivo aún no es válido
+            response = {"status": "error", "message": "File incomplete"}
+            await send_response(conn, response, binary_mode)
+        elif file_path:
+            file_size = SEEDER_CACHE.file_size(file_path)
+            piece_size = piece_size_for(file_size) # El manifiesto usa el mismo tamaño de pieza
+            num_chunks = num_pieces(file_size, piece_size)
+            response = {"status": "success", "file_size": file_size, "num_chunks": num_chunks, "piece_size": piece_size,
+                        "transfer_modes": TRANSFER_MODES, "manifest": await conn.run_blocking(get_manifest, file_path)}
+            # Códecs ofrecidos para este archivo: ninguno si ya viene comprimido (por extensión o por una muestra)
+            compressible = await conn.run_blocking(SEEDER_CACHE.is_compressible, file_path)
+            response["compression"] = COMPRESSION_CODECS if compressible else []
+            await send_response(conn, response, binary_mode)
+            #print(f"[PEER LISTENER] Respondiendo solicitud de info para '{filename}': {file_size} bytes, {num_chunks} chunks.")
+        else:
+            response = {"status": "error", "message": "File not found"}
+            await send_response(conn, response, binary_mode)
+            print(f"[PEER LISTENER] Archivo '{filename}' no encontrado para info.")
+
+    # --- Manejo de REQUEST_CHUNK (chunks de CHUNK_SIZE, clientes anteriores a las piezas por archivo) ---
+    elif command == "REQUEST_CHUNK":
+        chunk_index = request["chunk_index"]
+        # El cliente pide el modo binario; los clientes antiguos no envían este campo y reciben JSON/base64
+        binary_mode = binary_mode or request.get("transfer") == "binary"
+        await serve_range(conn, request["filename"], chunk_index * CHUNK_SIZE, CHUNK_SIZE, binary_mode, f"chunk {chunk_index}",
+                          request.get("compression"))
+
+    # --- Manejo de REQUEST_BLOCK: bloque (pieza, offset, longitud) con el tamaño de pieza del cliente ---
+    elif command == "REQUEST_BLOCK":
+        try:
+            piece, offset, length, piece_size = (int(request[k]) for k in ("piece", "offset", "length", "piece_size"))
+        except (KeyError, TypeError, ValueError):
+            piece = offset = length = piece_size = -1
+        if piece < 0 or offset < 0 or not 0 < length <= MAX_BLOCK_SIZE or piece_size <= 0 or offset + length > piece_size:
+            await send_response(conn, {"status": "error", "message": "Invalid block"}, binary_mode)
+        else:
+            await serve_range(conn, request["filename"], piece * piece_size + offset, length, binary_mode,
+                              f"bloque {piece}:{offset}+{length}", request.get("compression"))
+    elif command == "GET_CACHE_STATS":
+        await send_response(conn, {"status": "success", "stats": SEEDER_CACHE.stats()}, binary_mode)
+    elif command == "GET_UPLOAD_STATS":
+        await send_response(conn, {"status": "success", "stats": UPLOAD_LIMITER.snapshot()}, binary_mode)
+    elif command == "GET_METRICS":
+        await send_response(conn, {"status": "success", "metrics": METRICS.snapshot()}, binary_mode)
+    elif command == "GET_PEER_STATS":
+        await send_response(conn, {"status": "success", "stats": PEER_STATS.snapshot(), "endgame": dict(ENDGAME_STATS)}, binary_mode)
+    else:
+        print(f"[PEER LISTENER] Comando desconocido: {command}")
+        response = {"status": "error", "message": "Unknown command"}
+        await send_response(conn, response, binary_mode)
+
+async def serve_range(conn, filename, offset, length, binary_mode, description, compression=None):
+    """
+    Envía los bytes [offset, offset + length) de un archivo local (recortados al final del archivo).
+    Si el cliente pidió un códec de 'compression', los envía comprimidos cuando vale la pena.
+    """
+    filepath_received = os.path.join(RECEIVED_DIR, filename)
+    file_path = await conn.run_blocking(SEEDER_CACHE.resolve, filename) # stat y, si hace falta, relectura del catálogo
+    if not file_path:
+        print(f"[PEER LISTENER] Archivo no encontrado en el directorio compartido o de descarga: {filename}")
+        await send_response(conn, {"status": "error", "message": "File not found"}, binary_mode)
+        return
+
+    length = max(0, min(length, SEEDER_CACHE.file_size(file_path) - offset))
+    local = await local_bitfield_async(conn, filename) if file_path == filepath_received else None
+    if local is not None and length > 0 and not local[0].has_range(local[1], offset, length):
+        # Archivo incompleto: solo se sirven las piezas que ya se recibieron y verificaron
+        await send_response(conn, {"status": "error", "message": "Chunk not available"}, binary_mode)
+        return
+    if length == 0:
+        print(f"[PEER LISTENER] {description} vacío para {filename}. Fuera de rango o archivo más corto.")
+        await send_response(conn, {"status": "error", "message": "Chunk out of range or file too small"}, binary_mode)
+        return
+
+    # Slot de subida y tokens: con todos los slots ocupados se espera en cola; con la cola llena se rechaza
+    ticket = await UPLOAD_LIMITER.acquire(conn.addr)
+    if ticket is None:
+        await send_response(conn, {"status": "error", "message": "Upload queue full"}, binary_mode)
+        return
+    sent_bytes = 0
     try:
-        data = conn.recv(4096).decode()
+        if binary_mode and compression in COMPRESSION_CODECS:
+            compressed = SEEDER_CACHE.get_compressed_chunk(file_path, offset, length, compression)
+            if compressed is None:
+                compressed = await conn.run_blocking(SEEDER_CACHE.compress_chunk, file_path, offset, length, compression)
+            if compressed: # b"": no conviene comprimirlo y sigue por el camino normal
+                await UPLOAD_LIMITER.throttle(ticket, len(compressed)) # Se cobra lo que se envía, no el bloque original
+                await conn.send_frame(FRAME_COMPRESSED, compressed)
+                sent_bytes = len(compressed)
+                return
+        chunk_data = SEEDER_CACHE.get_cached_chunk(file_path, offset, length) # Rangos populares: desde memoria
+        if chunk_data is None and binary_mode and ZERO_COPY_SENDFILE and not SEEDER_CACHE.is_hot(file_path, offset, length):
+            # sendfile: los bytes pasan del page cache al socket sin copiarse a memoria de Python
+            pooled, offset, length = await conn.run_blocking(SEEDER_CACHE.open_chunk, file_path, offset, length)
+            try:
+                await UPLOAD_LIMITER.throttle(ticket, length)
+                await conn.send_file_frame(FRAME_DATA, pooled.file, offset, length)
+                sent_bytes = length
+            finally:
+                SEEDER_CACHE.release(pooled)
+            return
+        if chunk_data is None:
+            # La lectura de disco va al executor para no bloquear el event loop; el rango queda en la LRU
+            chunk_data = await conn.run_blocking(SEEDER_CACHE.read_chunk, file_path, offset, length)
+        if binary_mode:
+            await UPLOAD_LIMITER.throttle(ticket, len(chunk_data))
+            await conn.send_frame(FRAME_DATA, chunk_data) # Bytes crudos, sin base64 ni JSON
+            sent_bytes = len(chunk_data)
+        else:
+            encoded = json.dumps({"status": "success", "chunk": base64.b64encode(chunk_data).decode('ascii')}).encode()
+            await UPLOAD_LIMITER.throttle(ticket, len(encoded))
+            await conn.send(encoded)
+            sent_bytes = len(encoded)
+    except Exception as e:
+        print(f"[PEER LISTENER ERROR] Error al leer/enviar {description} de {filename}: {e}")
+        response = {"status": "error", "message": f"Error al leer/enviar chunk: {e}"}
+        await send_response(conn, response, binary_mode)
+    finally:
+        UPLOAD_LIMITER.release(ticket, sent_bytes)
+        if sent_bytes:
+            METRICS.inc("bt_served_bytes_total", sent_bytes, peer=conn.addr[0] if conn.addr else "?")
+
+async def serve_session(conn, addr):
+    """
+    Sesión persistente (OPEN_SESSION): atiende solicitudes enmarcadas por el mismo socket,
+    en orden, hasta que el cliente cierre o la sesión quede inactiva.
+    """
+    conn.read_timeout = SESSION_IDLE_TIMEOUT
+    await send_response(conn, {"status": "success", "session": "persistent"}, binary_mode=True)
+    while True:
+        try:
+            frame_type, payload = await conn.read_frame()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError):
+            return # El cliente cerró la sesión o estuvo inactivo demasiado tiempo
+        try:
+            request = json.loads(payload.decode())
+        except json.JSONDecodeError:
+            print(f"[PEER LISTENER ERROR] Frame JSON inválido recibido de {addr}")
+            await send_response(conn, {"status": "error", "message": "Invalid JSON"}, binary_mode=True)
+            continue
+        await handle_request(conn, request, binary_mode=True)
+
+async def serve_file_handler(conn, addr):
+    """Atiende una conexión entrante en el servidor asyncio (una solicitud o una sesión persistente)."""
+    try:
+        data = (await conn.read_request()).decode() # JSON plano (aunque llegue en varios segmentos) o enmarcado
         if not data:
             print(f"[PEER LISTENER] Conexión cerrada por {addr}.")
             return
 
         request = json.loads(data)
-        command = request.get("command")
-
-        # --- Manejo de GET_FILE_INFO ---
-        if command == "GET_FILE_INFO":
-            filename = request["filename"]
-            filepath_shared = os.path.join(SHARED_DIR, filename)
-            filepath_received = os.path.join(RECEIVED_DIR, filename)
-
-            file_path = None
-            if os.path.exists(filepath_shared):
-                file_path = filepath_shared
-            elif os.path.exists(filepath_received):
-                file_path = filepath_received
-
-            if file_path and os.path.exists(file_path):
-                file_size = os.path.getsize(file_path)
-                num_chunks = (file_size + CHUNK_SIZE - 1) // CHUNK_SIZE
-                response = {"status": "success", "file_size": file_size, "num_chunks": num_chunks}
-                conn.sendall(json.dumps(response).encode())
-                #print(f"[PEER LISTENER] Respondiendo solicitud de info para '{filename}': {file_size} bytes, {num_chunks} chunks.")
-            else:
-                response = {"status": "error", "message": "File not found"}
-                conn.sendall(json.dumps(response).encode())
-                print(f"[PEER LISTENER] Archivo '{filename}' no encontrado para info.")
-
-        # --- Manejo de REQUEST_CHUNK ---
-        elif command == "REQUEST_CHUNK":
-            filename = request["filename"]
-            chunk_index = request["chunk_index"]
-            
-            filepath_shared = os.path.join(SHARED_DIR, filename)
-            filepath_received = os.path.join(RECEIVED_DIR, filename)
-
-            file_path = None
-            if os.path.exists(filepath_shared):
-                file_path = filepath_shared
-            elif os.path.exists(filepath_received):
-                file_path = filepath_received
-
-            if file_path:
-                #print(f"[PEER LISTENER] Sirviendo {filename} (chunk {chunk_index}) desde {file_path}")
-                try:
-                    with open(file_path, "rb") as f:
-                        f.seek(chunk_index * CHUNK_SIZE)
-                        chunk_data = f.read(CHUNK_SIZE)
-                        
-                        if chunk_data:
-                            encoded_chunk = base64.b64encode(chunk_data).decode('ascii') 
-                            response = {"status": "success", "chunk": encoded_chunk} 
-                            conn.sendall(json.dumps(response).encode())
-                        else:
-                            print(f"[PEER LISTENER] Chunk {chunk_index} vacío para {filename}. Fuera de rango o archivo más corto.")
-                            response = {"status": "error", "message": "Chunk out of range or file too small"}
-                            conn.sendall(json.dumps(response).encode())
-                except Exception as e:
-                    print(f"[PEER LISTENER ERROR] Error al leer/enviar chunk {chunk_index} de {filename}: {e}")
-                    response = {"status": "error", "message": f"Error al leer/enviar chunk: {e}"}
-                    conn.sendall(json.dumps(response).encode())
-            else:
-                print(f"[PEER LISTENER] Archivo no encontrado en el directorio compartido o de descarga: {filename}")
-                response = {"status": "error", "message": "File not found"}
-                conn.sendall(json.dumps(response).encode())
+        if request.get("command") == "OPEN_SESSION":
+            await serve_session(conn, addr)
         else:
-            print(f"[PEER LISTENER] Comando desconocido: {command}")
-            response = {"status": "error", "message": "Unknown command"}
-            conn.sendall(json.dumps(response).encode())
+            await handle_request(conn, request) # Una sola solicitud por conexión (clientes antiguos)
 
     except json.JSONDecodeError:
         print(f"[PEER LISTENER ERROR] Datos JSON inválidos recibidos de {addr}")
         try:
-            conn.sendall(json.dumps({"status": "error", "message": "Invalid JSON"}).encode())
+            await conn.send_json({"status": "error", "message": "Invalid JSON"})
         except Exception as e:
             print(f"[PEER LISTENER ERROR] Error al enviar respuesta de error JSON: {e}")
+    except asyncio.TimeoutError:
+        print(f"[PEER LISTENER ERROR] Timeout esperando la solicitud de {addr}.")
     except ConnectionResetError:
         pass # Cliente cerró la conexión
     except Exception as e:
         print(f"[PEER LISTENER ERROR] Error general en serve_file_handler con {addr}: {e}")
     finally:
-        conn.close() # Asegúrate de que la conexión se cierre aquí
+        UPLOAD_LIMITER.forget(addr)
+    # El servidor asyncio cierra la conexión al terminar el handler
 
 # --- FUNCIONES DE DESCARGA DE ARCHIVOS (LEECHER) ---
+def chunk_from_frame(peer_ip, peer_port, frame, compression=None, max_size=CHUNK_SIZE):
+    """
+    Extrae los bytes de un frame de respuesta a REQUEST_CHUNK o REQUEST_BLOCK, o None si el peer respondió
+    un error. Un FRAME_COMPRESSED se descomprime con el códec pedido ('compression'), hasta 'max_size' bytes.
+    """
+    frame_type, payload = frame
+    if frame_type == FRAME_DATA:
+        return payload # Leído directamente en un buffer preasignado
+    if frame_type == FRAME_COMPRESSED and compression is not None:
+        try:
+            data = decompress(compression, payload, max_size)
+        except ValueError as e:
+            print(f"[DOWNLOAD] Bloque comprimido inválido de {peer_ip}:{peer_port}: {e}")
+            return None
+        COMPRESSION_STATS["compressed_blocks"] += 1
+        COMPRESSION_STATS["wire_bytes"] += len(payload)
+        COMPRESSION_STATS["raw_bytes"] += len(data)
+        return data
+    decoded_response = json.loads(payload.decode())
+    print(f"[DOWNLOAD] Error en la respuesta del peer {peer_ip}:{peer_port}: {decoded_response.get('message', 'Mensaje de error desconocido')}")
+    return None
+
+def pipeline_requests(peer_ip, peer_port, messages, cancelled=None):
+    """
+    Envía varias solicitudes de datos a un peer por su sesión persistente, todas en vuelo a la vez
+    (pipelining). Retorna una lista con los bytes de cada respuesta (None en las que fallaron), o None
+    si el peer no soporta sesiones. Si la sesión falla a mitad, se conservan las respuestas ya recibidas.
+    Si 'cancelled' (un Future) se completa, deja de esperar las respuestas que falten (endgame).
+    """
+    try:
+        session = CONNECTION_POOL.get_session(peer_ip, peer_port)
+    except (socket.timeout, ConnectionRefusedError, OSError) as e:
+        print(f"[DOWNLOAD] No se pudo abrir sesión con {peer_ip}:{peer_port}: {e}")
+        if isinstance(e, socket.timeout):
+            PEER_STATS.record_timeout((peer_ip, peer_port))
+        return [None] * len(messages)
+    if session is None:
+        return None
+
+    results = []
+    label = f"{peer_ip}:{peer_port}"
+    try:
+        futures, sent_at = [], []
+        for message in messages:
+            futures.append(session.submit(message, cancelled))
+            sent_at.append(time.perf_counter())
+        for message, future, started in zip(messages, futures, sent_at):
+            frame = session.wait_response(future, cancelled)
+            data = None
+            if frame is not None:
+                METRICS.observe("bt_block_request_seconds", time.perf_counter() - started, peer=label)
+                METRICS.inc("bt_received_bytes_total", len(frame[1]), peer=label)
+                data = chunk_from_frame(peer_ip, peer_port, frame, message.get("compression"), message.get("length", CHUNK_SIZE))
+            results.append(data)
+            if data is None:
+                METRICS.inc("bt_block_failures_total", peer=label)
+    except TimeoutError:
+        print(f"[DOWNLOAD] Timeout al descargar chunk de {peer_ip}:{peer_port}.")
+        PEER_STATS.record_timeout((peer_ip, peer_port))
+        CONNECTION_POOL.discard(peer_ip, peer_port) # La sesión quedó atascada: descartarla
+    except Exception as e:
+        print(f"[DOWNLOAD] Error en la sesión con {peer_ip}:{peer_port}: {e}")
+        CONNECTION_POOL.discard(peer_ip, peer_port)
+    if len(results) < len(messages):
+        METRICS.inc("bt_block_failures_total", len(messages) - len(results), peer=label)
+    return results + [None] * (len(messages) - len(results))
+
+def request_chunks_from_peer(peer_ip, peer_port, filename, chunk_indexes, cancelled=None):
+    """
+    Pide varios chunks de CHUNK_SIZE a un peer (peers que no anuncian tamaño de pieza).
+    Retorna una lista con los bytes de cada chunk, o None en los que fallaron.
+    Si el peer no soporta sesiones, los pide uno a uno con una conexión por solicitud.
+    """
+    messages = [{"command": "REQUEST_CHUNK", "filename": filename, "chunk_index": i} for i in chunk_indexes]
+    results = pipeline_requests(peer_ip, peer_port, messages, cancelled)
+    if results is None:
+        return [download_chunk_legacy(peer_ip, peer_port, filename, i) for i in chunk_indexes]
+    return results
+
+def request_blocks_from_peer(peer_ip, peer_port, filename, piece_size, piece_index, blocks, cancelled=None, compression=None):
+    """
+    Pide bloques (offset, longitud) de una pieza, todos en vuelo a la vez. Retorna una lista con
+    los bytes de cada bloque, o None en los que fallaron: una falla a mitad solo cuesta esos bloques.
+    Con 'compression' (un códec) el peer puede enviar cada bloque comprimido; los peers antiguos lo ignoran.
+    """
+    messages = [{"command": "REQUEST_BLOCK", "filename": filename, "piece": piece_index, "offset": offset,
+                 "length": length, "piece_size": piece_size} for offset, length in blocks]
+    if compression is not None:
+        for message in messages:
+            message["compression"] = compression
+    results = pipeline_requests(peer_ip, peer_port, messages, cancelled)
+    if results is None:
+        print(f"[DOWNLOAD] El peer {peer_ip}:{peer_port} no soporta sesiones ni bloques.")
+        return [None] * len(blocks)
+    return results
+
+def download_chunk_from_peer(peer_ip, peer_port, filename, chunk_index, cancelled=None):
+    """
+    Solicita y descarga un chunk específico de un peer, reutilizando la sesión persistente.
+    Retorna los bytes del chunk o None si falla o se cancela.
+    """
+    return request_chunks_from_peer(peer_ip, peer_port, filename, [chunk_index], cancelled)[0]
+
 # MODIFICACIÓN: Eliminado el parámetro 'chunk_size_limit' ya que no se usa.
-def download_chunk_from_peer(peer_ip, peer_port, filename, chunk_index):
+def download_chunk_legacy(peer_ip, peer_port, filename, chunk_index):
     """
-    Solicita y descarga un chunk específico de un peer utilizando un protocolo JSON.
+    Descarga un chunk abriendo una conexión solo para esta solicitud (peers sin sesiones persistentes).
+    Pide el modo binario (cabecera + bytes crudos); si el peer es antiguo y responde
+    con JSON/base64, la respuesta se decodifica igualmente.
     Retorna los bytes del chunk o None si falla.
     """
     try:
@@ -185,17 +477,18 @@ def download_chunk_from_peer(peer_ip, peer_port, filename, chunk_index):
             request_message = {
                 "command": "REQUEST_CHUNK",
                 "filename": filename,
-                "chunk_index": chunk_index
+                "chunk_index": chunk_index,
+                "transfer": "binary"
             }
             s.sendall(json.dumps(request_message).encode())
-            
-            response_data = b""
-            # Recibir todos los datos que el servidor envíe hasta que cierre la conexión.
-            while True:
-                chunk_recv = s.recv(4096)
-                if not chunk_recv:
-                    break
-                response_data += chunk_recv
+
+            # Los primeros bytes indican el modo de la respuesta: frame binario o JSON de un peer antiguo
+            prefix = recv_prefix(s, FRAME_HEADER.size)
+            if len(prefix) == FRAME_HEADER.size and prefix.startswith(FRAME_MAGIC):
+                return chunk_from_frame(peer_ip, peer_port, recv_frame(s, prefix))
+
+            # Modo JSON/base64: recibir todos los datos que el servidor envíe hasta que cierre la conexión.
+            response_data = recv_until_close(s, prefix)
             
             if response_data:
                 try:
@@ -215,6 +508,7 @@ def download_chunk_from_peer(peer_ip, peer_port, filename, chunk_index):
 
     except socket.timeout:
         print(f"[DOWNLOAD] Timeout al descargar chunk de {peer_ip}:{peer_port}.")
+        PEER_STATS.record_timeout((peer_ip, peer_port))
     except ConnectionRefusedError:
         print(f"[DOWNLOAD] Conexión rechazada por {peer_ip}:{peer_port} al descargar chunk.")
     except Exception as e:
@@ -225,6 +519,30 @@ def download_chunk_from_peer(peer_ip, peer_port, filename, chunk_index):
 def get_file_info_from_peer(peer_ip, peer_port, filename):
     """
     Solicita al peer la información del archivo (tamaño total y número de chunks).
+    Usa la sesión persistente del pool si el peer la soporta.
+    """
+    try:
+        session = CONNECTION_POOL.get_session(peer_ip, peer_port)
+        if session is None:
+            return get_file_info_legacy(peer_ip, peer_port, filename)
+        start = time.monotonic()
+        frame_type, payload = session.request({"command": "GET_FILE_INFO", "filename": filename})
+        PEER_STATS.record_rtt((peer_ip, peer_port), time.monotonic() - start)
+        decoded_response = json.loads(payload.decode())
+        return decoded_response if decoded_response.get("status") == "success" else None
+    except TimeoutError:
+        print(f"[PEER] Timeout al solicitar info del peer {peer_ip}:{peer_port}.")
+        PEER_STATS.record_timeout((peer_ip, peer_port))
+    except ConnectionRefusedError:
+        print(f"[PEER] Conexión rechazada por {peer_ip}:{peer_port} al solicitar info.")
+    except Exception as e:
+        print(f"[PEER] Error inesperado al solicitar info del peer {peer_ip}:{peer_port}: {e}")
+    CONNECTION_POOL.discard(peer_ip, peer_port)
+    return None
+
+def get_file_info_legacy(peer_ip, peer_port, filename):
+    """
+    Solicita la información del archivo con una conexión solo para esta solicitud (peers antiguos).
     """
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -237,13 +555,8 @@ def get_file_info_from_peer(peer_ip, peer_port, filename):
             }
             s.sendall(json.dumps(request_message).encode())
 
-            response_data = b""
             # Recibir todos los datos que el servidor envíe hasta que cierre la conexión.
-            while True:
-                chunk = s.recv(4096)
-                if not chunk:
-                    break
-                response_data += chunk
+            response_data = recv_until_close(s)
             
             if response_data:
                 try:
@@ -264,6 +577,7 @@ def get_file_info_from_peer(peer_ip, peer_port, filename):
 
     except socket.timeout:
         print(f"[PEER] Timeout al solicitar info del peer {peer_ip}:{peer_port}.")
+        PEER_STATS.record_timeout((peer_ip, peer_port))
     except ConnectionRefusedError:
         print(f"[PEER] Conexión rechazada por {peer_ip}:{peer_port} al solicitar info.")
     except Exception as e:
@@ -271,20 +585,42 @@ def get_file_info_from_peer(peer_ip, peer_port, filename):
     
     return None
 
-def download_file(filename):
+def find_corrupt_chunks(filepath, manifest, chunk_indexes):
+    """Retorna los índices de 'chunk_indexes' (piezas) cuyos datos en disco no coinciden con el manifiesto."""
+    piece_size = manifest["chunk_size"]
+    corrupt_chunks = []
+    with open(filepath, "rb") as f:
+        for chunk_index in chunk_indexes:
+            f.seek(chunk_index * piece_size)
+            if not verify_chunk(manifest, chunk_index, f.read(piece_size)):
+                corrupt_chunks.append(chunk_index)
+    return corrupt_chunks
+
+def download_file(filename, num_workers=DOWNLOAD_WORKERS, on_progress=None, control=None):
+    """
+    Descarga un archivo repartiendo sus piezas entre los peers que lo tienen, con 'num_workers'
+    piezas a la vez. Cada pieza se pide en bloques (si el peer anunció su tamaño de pieza) y se
+    escribe en su offset dentro del archivo preasignado. 'on_progress(bytes, total)' se llama
+    con cada pieza verificada. 'control' es la Download de DOWNLOAD_MANAGER si la descarga está
+    administrada (pausa, cancelación y límites). Retorna True si el archivo quedó completo.
+    """
+    from tqdm import tqdm # Solo al descargar: importarlo retrasa el arranque del peer
     filepath = os.path.join(RECEIVED_DIR, filename) 
     
-    load_progress()
-    downloaded_bytes_count = get_progress(filename)
     file_size = None # Inicializar file_size aquí
+    manifest = None # Hashes por chunk para verificar cada chunk al recibirlo
+    piece_size = CHUNK_SIZE # Los peers que no anuncian tamaño de pieza usan chunks de CHUNK_SIZE
+    block_mode = False # True: piezas pedidas en bloques (REQUEST_BLOCK); False: un REQUEST_CHUNK por chunk
+    compression = None # Códec que se pide en cada bloque, si el peer de la info lo ofreció para este archivo
 
     # Buscar un peer para obtener la información del archivo (incluido el tamaño)
-    peers_for_info_and_download = get_peers_with_file(TRACKER_IP, TRACKER_PORT, filename)
+    peers_for_info_and_download = TRACKER_CLIENT.get_peers_with_file(filename)
     if not peers_for_info_and_download:
         print(f"[PEER] Ningún peer tiene el archivo '{filename}'.")
-        return
+        return False
     
-    # Intenta obtener el tamaño del archivo de un peer
+    # Intenta obtener el tamaño del archivo de un peer (primero los que no están baneados por timeouts)
+    peers_for_info_and_download.sort(key=lambda p: PEER_STATS.is_banned((p['ip'], p['port'])))
     for peer_info in peers_for_info_and_download:
         if peer_info['ip'] == PEER_ADVERTISED_IP and peer_info['port'] == PEER_PORT:
             continue # No pedir información a sí mismo
@@ -292,101 +628,224 @@ def download_file(filename):
         file_info = get_file_info_from_peer(peer_info['ip'], peer_info['port'], filename)
         if file_info and 'file_size' in file_info:
             file_size = file_info['file_size']
+            manifest = file_info.get('manifest')
+            block_mode = isinstance(file_info.get('piece_size'), int) and file_info['piece_size'] > 0
+            piece_size = file_info['piece_size'] if block_mode else CHUNK_SIZE
+            compression = choose_codec(file_info.get('compression')) if block_mode else None
+            if manifest is not None and not is_valid_manifest(manifest, file_size, piece_size):
+                print(f"[PEER] Manifiesto inválido de {peer_info['peer_id']} para '{filename}'. Se ignorará.")
+                manifest = None
             break
     
     if file_size is None:
         print(f"[PEER] No se pudo obtener el tamaño del archivo '{filename}' de ningún peer disponible.")
-        return # Salir si no se puede obtener el tamaño
+        return False # Salir si no se puede obtener el tamaño
 
-    # Lógica de reanudación o inicio de descarga
+    # Lógica de reanudación o inicio de descarga.
+    # El archivo se preasigna con su tamaño final: si hay estado de reanudación, la descarga está incompleta.
+    resume_state = load_resume_state(filename, RECEIVED_DIR)
     if os.path.exists(filepath):
         #print(f"[PEER] El archivo '{filename}' ya existe localmente. Verificando tamaño...")
         current_local_size = os.path.getsize(filepath)
         
-        if current_local_size == file_size:
+        if current_local_size == file_size and resume_state is None:
             print(f"[PEER] El archivo '{filename}' ya está completo. Actualizando tracker y saliendo.")
-            remove_progress(filename) 
             # MODIFICACIÓN: Usar PEER_ADVERTISED_IP al actualizar el tracker
-            register_or_update_peer(TRACKER_IP, TRACKER_PORT, PEER_ID, PEER_ADVERTISED_IP, PEER_PORT, SHARED_DIR, RECEIVED_DIR, initial_registration=False)
-            return 
-        elif current_local_size < file_size:
+            TRACKER_CLIENT.announce(PEER_ID, PEER_ADVERTISED_IP, PEER_PORT, SHARED_DIR, RECEIVED_DIR, initial_registration=False, bitfields=partial_bitfields())
+            return True
+        elif resume_state is not None and resume_state.file_size == file_size:
+            if resume_state.piece_size != piece_size:
+                # Descarga empezada con otro tamaño de pieza: se conservan las piezas nuevas ya cubiertas
+                resume_state = resume_state.with_piece_size(piece_size)
+            print(f"[PEER] El archivo '{filename}' está incompleto ({resume_state.bitfield.count()}/{resume_state.bitfield.num_chunks} chunks). Reanudando descarga.")
+        elif resume_state is None and current_local_size < file_size:
+            # Archivo a medias de una descarga secuencial antigua: sus piezas completas son reutilizables
+            resume_state = ResumeState(filename, file_size, piece_size=piece_size)
+            for chunk_index in range(current_local_size // piece_size):
+                resume_state.bitfield.set(chunk_index)
             print(f"[PEER] El archivo '{filename}' está incompleto ({current_local_size}/{file_size} bytes). Reanudando descarga.")
-            downloaded_bytes_count = current_local_size 
-            save_progress(filename, downloaded_bytes_count)
-        else: # current_local_size > file_size
-            print(f"[PEER] Advertencia: El archivo '{filename}' local es más grande de lo esperado. Reiniciando descarga.")
+        else: # Tamaño local o estado de reanudación que no corresponden a este archivo
+            print(f"[PEER] Advertencia: El archivo '{filename}' local no coincide con el esperado. Reiniciando descarga.")
             os.remove(filepath) 
-            remove_progress(filename)
-            downloaded_bytes_count = 0 
-    else: # Archivo no existe localmente, iniciar descarga desde cero
-        downloaded_bytes_count = 0 
-        remove_progress(filename) # Asegurarse de que no haya progreso antiguo corrupto
+            remove_resume_state(filename)
+            resume_state = None
+    elif resume_state is not None: # Estado de reanudación sin archivo: descartarlo
+        remove_resume_state(filename)
+        resume_state = None
+
+    if resume_state is None:
+        resume_state = ResumeState(filename, file_size, piece_size=piece_size)
 
     # Asegurarse de que el directorio de recepción existe
     os.makedirs(RECEIVED_DIR, exist_ok=True)
 
+    # Guardar el estado antes de preasignar, para que un archivo a medias nunca parezca completo
+    resume_state.flush()
+    preallocate_file(filepath, file_size)
+
+    bitfield = resume_state.bitfield
+    missing_chunks = bitfield.missing() # Se reanuda directamente en cualquier chunk que falte
+
+    if manifest is None:
+        print(f"[PEER] El peer no envió hashes por chunk para '{filename}': solo se comprobará el tamaño de cada chunk.")
+    elif len(missing_chunks) < bitfield.num_chunks:
+        # Verificar lo ya descargado: los chunks corruptos se vuelven a pedir
+        present_chunks = sorted(set(range(bitfield.num_chunks)) - set(missing_chunks))
+        corrupt_chunks = find_corrupt_chunks(filepath, manifest, present_chunks)
+        if corrupt_chunks:
+            print(f"[PEER] {len(corrupt_chunks)} chunks ya descargados de '{filename}' no coinciden con el manifiesto. Se volverán a descargar.")
+            bitfield = Bitfield(bitfield.num_chunks)
+            for chunk_index in set(present_chunks) - set(corrupt_chunks):
+                bitfield.set(chunk_index)
+            resume_state = ResumeState(filename, file_size, bitfield, piece_size)
+            resume_state.flush()
+            missing_chunks = bitfield.missing()
+
+    downloaded_bytes_count = file_size - sum(piece_length(file_size, piece_size, i) for i in missing_chunks)
     print(f"[PEER] Iniciando descarga de '{filename}' ({file_size} bytes). Progreso actual: {downloaded_bytes_count} bytes.")
 
-    mode = "ab" if downloaded_bytes_count > 0 else "wb" 
-    with open(filepath, mode) as f:
-        if mode == "ab":
-            f.seek(0, os.SEEK_END)
+    # Anunciar los chunks que ya se tienen para que otros peers puedan pedirlos mientras se descarga el resto
+    partial_downloads[filename] = {"file_size": file_size, "manifest": manifest, "bitfield": bitfield, "piece_size": piece_size}
+    forget_local_bitfield(filename) # El sidecar cambió: desde aquí manda partial_downloads
+    last_announce = [time.monotonic()]
+    TRACKER_CLIENT.announce(PEER_ID, PEER_ADVERTISED_IP, PEER_PORT, SHARED_DIR, RECEIVED_DIR, initial_registration=False, bitfields=partial_bitfields())
 
-        with tqdm(initial=downloaded_bytes_count, total=file_size, unit="B", unit_scale=True,
-                    desc=f"Descargando {filename}", ascii=True) as pbar:
-            
-            while downloaded_bytes_count < file_size:
-                available_peers = get_peers_with_file(TRACKER_IP, TRACKER_PORT, filename)
-                available_peers = [p for p in available_peers if not (p['ip'] == PEER_ADVERTISED_IP and p['port'] == PEER_PORT)] # Usar advertised IP aquí también
-
-                if not available_peers:
-                    print(f"\n[PEER] Todos los peers con '{filename}' se desconectaron o no hay otros peers. Reintentando en 10 segundos...")
-                    time.sleep(10)
-                    continue
-                
-                random.shuffle(available_peers)
-                # --- PASO 1: Calcular el índice del chunk actual para la descripción ---
-                chunk_index_for_display = downloaded_bytes_count // CHUNK_SIZE
-                
-                # --- PASO 2: Actualizar la descripción de la barra de progreso ---
-                # Esta línea debe ir aquí, antes de intentar descargar el chunk
-                pbar.set_description(f"Descargando {filename} [Chunk {chunk_index_for_display}]")
-
-                chunk_downloaded_this_iteration = False
-                for peer in available_peers:
-                    peer_ip, peer_port = peer['ip'], peer['port']
-                    
-                    chunk_index = downloaded_bytes_count // CHUNK_SIZE
-                    
-                    #print(f"\n[PEER] Intentando descargar chunk {chunk_index} de '{filename}' desde {peer['peer_id']} ({peer_ip}:{peer_port})...")
-                    
-                    # MODIFICACIÓN: Eliminado el parámetro 'chunk_size_limit'
-                    chunk_data = download_chunk_from_peer(peer_ip, peer_port, filename, chunk_index) 
-                    
-                    if chunk_data is not None and len(chunk_data) > 0:
-                        f.write(chunk_data)
-                        downloaded_bytes_count += len(chunk_data)
-                        pbar.update(len(chunk_data))
-                        save_progress(filename, downloaded_bytes_count) 
-                        chunk_downloaded_this_iteration = True
-                        break 
-                    else:
-                        print(f"\n[PEER] No se pudo descargar el chunk {chunk_index} de {peer['peer_id']}.")
-                        pass 
-                
-                if not chunk_downloaded_this_iteration and downloaded_bytes_count < file_size:
-                    print(f"\n[PEER] No se pudo conectar con ningún peer para continuar la descarga de '{filename}'. Reintentando en 5 segundos...")
-                    time.sleep(5)
+    def available_peers():
+        peers = TRACKER_CLIENT.get_peers_with_file(filename)
+        return [p for p in peers if not (p['ip'] == PEER_ADVERTISED_IP and p['port'] == PEER_PORT) # Usar advertised IP aquí también
+                and ("bitfield" not in p or p["bitfield"].get("piece_size", CHUNK_SIZE) == piece_size)] # Bitfield en otras piezas: no sirve
+
+    def fetch_blocks(peer, piece_index, blocks, cancelled):
+        if block_mode:
+            results = request_blocks_from_peer(peer['ip'], peer['port'], filename, piece_size, piece_index, blocks, cancelled, compression)
+        else:
+            results = [download_chunk_from_peer(peer['ip'], peer['port'], filename, piece_index, cancelled)] # Chunk entero
+        if control is not None:
+            control.throttle(sum(len(data) for data in results if data is not None)) # Su parte de la tasa de bajada
+        return results
+
+    def chunk_is_valid(chunk_index, data):
+        return verify_chunk(manifest, chunk_index, data)
+
+    with tqdm(initial=downloaded_bytes_count, total=file_size, unit="B", unit_scale=True,
+                desc=f"Descargando {filename}", ascii=True) as pbar:
+        progress_lock = threading.Lock()
+
+        def on_chunk_done(chunk_index, num_bytes):
+            with progress_lock:
+                pbar.update(num_bytes)
+                if on_progress is not None:
+                    on_progress(pbar.n, file_size)
+                pbar.set_description(f"Descargando {filename} [Chunk {chunk_index}]")
+                # El chunk ya está verificado en disco: se puede servir y reanudar (el sidecar se escribe por lotes)
+                resume_state.mark(chunk_index)
+                if time.monotonic() - last_announce[0] >= ANNOUNCE_INTERVAL:
+                    last_announce[0] = time.monotonic()
+                    threading.Thread(target=TRACKER_CLIENT.announce, daemon=True,
+                                     args=(PEER_ID, PEER_ADVERTISED_IP, PEER_PORT, SHARED_DIR, RECEIVED_DIR),
+                                     kwargs={"initial_registration": False, "bitfields": partial_bitfields()}).start()
+
+        scheduler = ChunkScheduler(filename, filepath, file_size, missing_chunks,
+                                   fetch_blocks, available_peers, num_workers=num_workers, on_chunk_done=on_chunk_done,
+                                   verify_chunk=chunk_is_valid if manifest else None, peer_stats=PEER_STATS,
+                                   piece_size=piece_size, block_size=BLOCK_SIZE if block_mode else piece_size)
+        if control is not None:
+            control.attach(scheduler) # Desde aquí se puede pausar o cancelar
+        try:
+            download_complete = scheduler.run()
+        finally:
+            partial_downloads.pop(filename, None)
+    for key, value in scheduler.endgame.items():
+        ENDGAME_STATS[key] += value
+    print_peer_contributions(filename, scheduler.chunks_by_peer)
+    if scheduler.endgame["duplicate_requests"]:
+        print(f"[PEER] Endgame: {scheduler.endgame['duplicate_requests']} solicitudes duplicadas, "
+              f"{scheduler.endgame['won_by_duplicate']} llegaron antes que la original.")
     
-    if downloaded_bytes_count >= file_size:
+    if download_complete:
         print(f"\n[PEER] Descarga de '{filename}' completada.")
-        remove_progress(filename) 
+        remove_resume_state(filename) 
+        forget_local_bitfield(filename)
+        LOCAL_CATALOG.refresh(filename) # El archivo ya no cambia de nombre, pero sí su mtime
         # MODIFICACIÓN: Usar PEER_ADVERTISED_IP al actualizar el tracker
-        register_or_update_peer(TRACKER_IP, TRACKER_PORT, PEER_ID, PEER_ADVERTISED_IP, PEER_PORT, SHARED_DIR, RECEIVED_DIR, initial_registration=False) 
+        TRACKER_CLIENT.announce(PEER_ID, PEER_ADVERTISED_IP, PEER_PORT, SHARED_DIR, RECEIVED_DIR, initial_registration=False, bitfields=partial_bitfields()) 
     else:
+        resume_state.flush()
+        forget_local_bitfield(filename)
         print(f"\n[PEER] Descarga de '{filename}' finalizada pero incompleta. Progreso guardado.")
+    return download_complete
+
+# --- COLA DE DESCARGAS ---
+def run_managed_download(download):
+    return download_file(download.filename, on_progress=download.progress, control=download)
+
+def discard_download(filename):
+    """Borra el archivo a medias y el estado de reanudación de una descarga cancelada."""
+    remove_resume_state(filename)
+    forget_local_bitfield(filename)
+    try:
+        os.remove(os.path.join(RECEIVED_DIR, filename))
+    except FileNotFoundError:
+        pass
+    LOCAL_CATALOG.refresh(filename)
+    print(f"[PEER] Descarga de '{filename}' cancelada: se descartó lo descargado.")
+
+# Todas las descargas pasan por la cola: prioridades, límites globales y un solo hilo por archivo
+DOWNLOAD_MANAGER = DownloadManager(run_managed_download, discard=discard_download)
+
+def print_peer_contributions(filename, chunks_by_peer):
+    """Resumen de qué peers sirvieron la descarga y cómo se comportaron, para entender si fue lenta."""
+    stats = PEER_STATS.snapshot()
+    print(f"\n[PEER] Peers que sirvieron '{filename}':")
+    for ip, port in sorted(chunks_by_peer, key=chunks_by_peer.get, reverse=True):
+        print(f"  - {ip}:{port}: {chunks_by_peer[(ip, port)]} chunks | {format_peer_stats(stats.get(f'{ip}:{port}', {}))}")
+
+def format_peer_stats(stats):
+    throughput = stats.get("throughput")
+    rtt = stats.get("rtt")
+    text = (f"{throughput / (1024 * 1024):.2f} MB/s" if throughput else "sin medir") + \
+           (f", RTT {rtt * 1000:.1f} ms" if rtt is not None else "") + \
+           f", fallos {stats.get('failure_rate', 0.0):.0%}, timeouts {stats.get('timeouts', 0)}"
+    if stats.get("banned"):
+        text += f", baneado {stats['banned']} s"
+    return text
 
 # --- MENÚ PRINCIPAL ---
+def format_upload_stats(stats):
+    """Resumen legible de UploadLimiter.snapshot()."""
+    rate = lambda value: f"{value / 1024:.0f} KB/s" if value > 0 else "sin límite"
+    delays = stats["queue_delay_ms"]
+    lines = [f"Slots: {stats['active']}/{stats['slots']} en uso, {stats['queued']} en cola (máx. {stats['max_queue']})",
+             f"Tasa global: {rate(stats['global_rate'])}, por peer: {rate(stats['peer_rate'])}",
+             f"Servidos: {stats['served']} ({stats['bytes']} bytes), rechazados por cola llena: {stats['rejected']}, "
+             f"espera por límite de tasa: {stats['throttled_seconds']} s",
+             f"Espera en cola (ms): p50 {delays['p50']}, p95 {delays['p95']}, p99 {delays['p99']}, máx. {delays['max']}"]
+    for address, conn_stats in sorted(stats["connections"].items()):
+        throughput = f"{conn_stats['throughput'] / (1024 * 1024):.2f} MB/s" if conn_stats["throughput"] else "-"
+        queue_delay = f"{conn_stats['queue_delay'] * 1000:.1f} ms" if conn_stats["queue_delay"] is not None else "-"
+        lines.append(f"- {address}: {throughput}, cola {queue_delay} (máx. {conn_stats['max_queue_delay'] * 1000:.1f} ms), "
+                     f"{conn_stats['requests']} solicitudes, {conn_stats['bytes']} bytes")
+    return "\n".join(lines)
+
+def format_downloads(downloads, limits):
+    """Resumen legible de DOWNLOAD_MANAGER.snapshot() y de sus límites."""
+    rate = f"{limits['global_rate'] / 1024:.0f} KB/s" if limits["global_rate"] > 0 else "sin límite"
+    lines = [f"Activas: {limits['active']}/{limits['max_active']}, conexiones: {limits['max_connections']}, tasa global: {rate}"]
+    for filename, download in sorted(downloads.items(), key=lambda item: item[1]["added"]):
+        percent = f"{download['bytes'] * 100 / download['total']:.1f}%" if download["total"] else "-"
+        connections = f", {download['connections']} conexiones" if download["status"] == "running" and download["connections"] else ""
+        lines.append(f"- {filename}: {download['status']} ({download['priority']}), {percent}{connections}")
+    return "\n".join(lines)
+
+def ask_int(prompt):
+    value = input(f"{prompt}: ").strip()
+    return int(value) if value else None
+
+def ask_rate(prompt):
+    """Pide una tasa en KB/s y la retorna en bytes/s (None si se deja vacía)."""
+    value = input(f"{prompt}: ").strip()
+    return int(float(value) * 1024) if value else None
+
 def main_menu():
     """Presenta el menú de opciones al usuario del peer."""
     while True:
@@ -400,24 +859,27 @@ def main_menu():
         print("2. Mostrar archivos disponibles en la red")
         print("3. Descargar archivo")
         print("4. Forzar actualización de archivos compartidos al tracker")
-        print("5. Salir")
+        print("5. Ver estadísticas de la caché del seeder")
+        print("6. Ver estadísticas de los peers remotos")
+        print("7. Ver y ajustar los límites de subida")
+        print("8. Ver y gestionar la cola de descargas")
+        print("9. Salir")
         choice = input("Seleccione una opción: ")
 
         if choice == '1':
             # clear_console() # Eliminado: se limpia al inicio del bucle
             print("\n--- Archivos Locales ---")
-            local_files = [f for f in os.listdir(SHARED_DIR) if os.path.isfile(os.path.join(SHARED_DIR, f))]
-            local_files.extend([f for f in os.listdir(RECEIVED_DIR) if os.path.isfile(os.path.join(RECEIVED_DIR, f))])
+            local_files = LOCAL_CATALOG.entries()
             if local_files:
-                for f in sorted(list(set(local_files))): 
-                    print(f"- {f}")
+                for f in sorted(local_files): 
+                    print(f"- {f} ({local_files[f]['size']} bytes, {local_files[f]['num_chunks']} chunks)")
             else:
                 print("No hay archivos locales.")
             input("\nPresione Enter para continuar...") 
         elif choice == '2':
             # clear_console() # Eliminado: se limpia al inicio del bucle
             print("\n--- Archivos Disponibles en la Red (según el tracker) ---")
-            network_status = get_network_status(TRACKER_IP, TRACKER_PORT)
+            network_status = TRACKER_CLIENT.get_network_status()
             if network_status:
                 available_files = set()
                 for pid, info in network_status.items():
@@ -435,7 +897,7 @@ def main_menu():
         elif choice == '3':
             # clear_console() # Eliminado: se limpia al inicio del bucle
             print("\n--- Archivos Disponibles en la Red (según el tracker) ---")
-            network_status = get_network_status(TRACKER_IP, TRACKER_PORT)
+            network_status = TRACKER_CLIENT.get_network_status()
             if network_status:
                 available_files = set()
                 for pid, info in network_status.items():
@@ -451,18 +913,72 @@ def main_menu():
                 print("[PEER] No se pudo obtener el estado de la red del tracker.")
 
             filename = input("Ingrese el nombre del archivo a descargar: ")
-            threading.Thread(target=download_file, args=(filename,)).start()
-            input("\nLa descarga ha comenzado en segundo plano. Presione Enter para continuar...")
+            priority = input(f"Prioridad ({', '.join(PRIORITIES)}; Enter = normal): ").strip() or "normal"
+            try:
+                download, added = DOWNLOAD_MANAGER.submit(filename, priority)
+            except ValueError as e:
+                input(f"\n{e}. Presione Enter para continuar...")
+                continue
+            if not added:
+                print(f"\n'{filename}' ya está en la cola ({download['status']}).")
+            input(f"\nDescarga {'en cola' if download['status'] == 'queued' else 'iniciada'} en segundo plano. Presione Enter para continuar...")
         elif choice == '4':
             # clear_console() # Eliminado: se limpia al inicio del bucle
             # MODIFICACIÓN: Usar PEER_ADVERTISED_IP al actualizar el tracker
-            success = register_or_update_peer(TRACKER_IP, TRACKER_PORT, PEER_ID, PEER_ADVERTISED_IP, PEER_PORT, SHARED_DIR, RECEIVED_DIR, initial_registration=False)
+            success = TRACKER_CLIENT.announce(PEER_ID, PEER_ADVERTISED_IP, PEER_PORT, SHARED_DIR, RECEIVED_DIR, initial_registration=False, bitfields=partial_bitfields())
             if success:
                 print("\nArchivos locales actualizados en el tracker.")
             else:
                 print("\nNo se pudieron actualizar los archivos en el tracker.")
             input("\nPresione Enter para continuar...")
         elif choice == '5':
+            print("\n--- Caché del Seeder ---")
+            for key, value in SEEDER_CACHE.stats().items():
+                print(f"- {key}: {value}")
+            input("\nPresione Enter para continuar...")
+        elif choice == '6':
+            print("\n--- Peers Remotos ---")
+            peer_stats = PEER_STATS.snapshot()
+            if peer_stats:
+                for address, stats in sorted(peer_stats.items()):
+                    print(f"- {address}: {format_peer_stats(stats)} ({stats['successes']} chunks, {stats['bytes']} bytes)")
+            else:
+                print("Todavía no se ha descargado de ningún peer.")
+            print(f"Endgame: {ENDGAME_STATS['duplicate_requests']} solicitudes duplicadas ({ENDGAME_STATS['duplicate_bytes']} bytes), "
+                  f"{ENDGAME_STATS['won_by_duplicate']} ganaron a la original, {ENDGAME_STATS['cancelled']} canceladas.")
+            print(f"Compresión: {COMPRESSION_STATS['compressed_blocks']} bloques comprimidos, {COMPRESSION_STATS['wire_bytes']} bytes "
+                  f"recibidos por {COMPRESSION_STATS['raw_bytes']} bytes de datos.")
+            input("\nPresione Enter para continuar...")
+        elif choice == '7':
+            print("\n--- Subida (seeder) ---")
+            print(format_upload_stats(UPLOAD_LIMITER.snapshot()))
+            print("\nNuevos límites (Enter para mantener el valor actual):")
+            try:
+                UPLOAD_LIMITER.configure(slots=ask_int("Slots de subida"), max_queue=ask_int("Tamaño máximo de la cola"),
+                                         global_rate=ask_rate("Tasa global (KB/s, 0 = sin límite)"),
+                                         peer_rate=ask_rate("Tasa por peer (KB/s, 0 = sin límite)"))
+            except ValueError:
+                print("Valor no válido: se mantienen los límites.")
+            input("\nPresione Enter para continuar...")
+        elif choice == '8':
+            print("\n--- Cola de Descargas ---")
+            print(format_downloads(DOWNLOAD_MANAGER.snapshot(), DOWNLOAD_MANAGER.limits()))
+            print("\nAcciones: p <archivo> (pausar), r <archivo> (reanudar), c <archivo> (cancelar), l (límites), Enter (volver)")
+            action, _, filename = input("Acción: ").strip().partition(" ")
+            actions = {"p": DOWNLOAD_MANAGER.pause, "r": DOWNLOAD_MANAGER.resume, "c": DOWNLOAD_MANAGER.cancel}
+            if action in actions:
+                if not actions[action](filename.strip()):
+                    print(f"No se puede aplicar esa acción a '{filename.strip()}' en su estado actual.")
+            elif action == "l":
+                try:
+                    DOWNLOAD_MANAGER.configure(max_active=ask_int("Descargas a la vez"), max_connections=ask_int("Conexiones en total"),
+                                               global_rate=ask_rate("Tasa global de bajada (KB/s, 0 = sin límite)"))
+                except ValueError:
+                    print("Valor no válido: se mantienen los límites.")
+            elif action:
+                print("Acción no válida.")
+            input("\nPresione Enter para continuar...")
+        elif choice == '9':
             print("[PEER] Saliendo...")
             break
         else:
@@ -474,7 +990,7 @@ def main():
     # Registro inicial al tracker
     print("[PEER] Registrando peer con el tracker...")
     # MODIFICACIÓN: Usar PEER_ADVERTISED_IP para el registro inicial
-    if not register_or_update_peer(TRACKER_IP, TRACKER_PORT, PEER_ID, PEER_ADVERTISED_IP, PEER_PORT, SHARED_DIR, RECEIVED_DIR, initial_registration=True):
+    if not TRACKER_CLIENT.announce(PEER_ID, PEER_ADVERTISED_IP, PEER_PORT, SHARED_DIR, RECEIVED_DIR, initial_registration=True, bitfields=partial_bitfields()):
         print("[PEER] Falló el registro inicial. Asegúrese de que el tracker esté corriendo.")
         exit() # Salir si el registro inicial falla
     print("[PEER] Registro exitoso. Iniciando servicios...")
@@ -486,6 +1002,9 @@ def main():
     # Inicia el heartbeat periódico al tracker en un hilo daemon
     threading.Thread(target=heartbeat_to_tracker, daemon=True).start()
 
+    if METRICS_HTTP_PORT is not None:
+        start_metrics_http("127.0.0.1", METRICS_HTTP_PORT) # Solo local: no tiene autenticación
+
     main_menu()
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+# bittorrent_project/peer_ctl.py
+"""
+Cliente de la API de control de peer_daemon.py. Imprime la respuesta en JSON.
+
+Uso: python peer_ctl.py [--port 7001] status | files | downloads | metrics | shutdown
+     python peer_ctl.py [--port 7001] download <archivo> [--priority high|normal|low]
+     python peer_ctl.py [--port 7001] pause | resume | cancel <archivo>
+     python peer_ctl.py [--port 7001] upload-limits [--slots N] [--max-queue N] [--global-rate B/s] [--peer-rate B/s]
+     python peer_ctl.py [--port 7001] download-limits [--max-active N] [--max-connections N] [--global-rate B/s]
+"""
+import sys
+import json
+import argparse
+
+from network_utils import send_json
+
+CONTROL_IP = "127.0.0.1"
+DEFAULT_CONTROL_PORT = 7001 # Puerto por defecto del daemon (6001) + 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Cliente de la API de control del peer")
+    parser.add_argument("--port", type=int, default=DEFAULT_CONTROL_PORT, help="Puerto de control del daemon")
+    parser.add_argument("command", choices=["status", "files", "downloads", "metrics", "shutdown", "download", "pause", "resume",
+                                            "cancel", "upload-limits", "download-limits"])
+    parser.add_argument("filename", nargs="?", help="Archivo (comandos download, pause, resume y cancel)")
+    parser.add_argument("--priority", choices=["high", "normal", "low"])
+    parser.add_argument("--slots", type=int)
+    parser.add_argument("--max-queue", type=int)
+    parser.add_argument("--global-rate", type=int, help="Bytes/s (0 = sin límite)")
+    parser.add_argument("--peer-rate", type=int, help="Bytes/s (0 = sin límite)")
+    parser.add_argument("--max-active", type=int, help="Descargas a la vez")
+    parser.add_argument("--max-connections", type=int, help="Solicitudes en curso entre todas las descargas")
+    args = parser.parse_args()
+
+    message = {"command": args.command.upper().replace("-", "_")}
+    if args.command in ("download", "pause", "resume", "cancel"):
+        if not args.filename:
+            parser.error(f"{args.command} necesita el nombre del archivo")
+        message.update(filename=args.filename, priority=args.priority)
+    elif args.command == "upload-limits":
+        message.update(slots=args.slots, max_queue=args.max_queue, global_rate=args.global_rate, peer_rate=args.peer_rate)
+    elif args.command == "download-limits":
+        message.update(max_active=args.max_active, max_connections=args.max_connections, global_rate=args.global_rate)
+
+    # Sin reintentos largos: si el daemon no responde, se avisa enseguida
+    response = send_json(CONTROL_IP, args.port, message, retries=1, timeout=10)
+    if response is None:
+        print(f"No se pudo contactar al daemon en {CONTROL_IP}:{args.port}.")
+        sys.exit(1)
+    print(json.dumps(response, indent=2, ensure_ascii=False))
+    sys.exit(0 if response.get("status") == "success" else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# bittorrent_project/peer_daemon.py
+"""
+Peer sin interacción (daemon). La configuración sale de un archivo JSON, de variables de entorno
+BT_* y de flags de línea de comandos (en ese orden de prioridad creciente); no se pregunta nada
+por consola ni se consulta la red para averiguar la IP salvo con --detect-ip.
+
+El peer empieza a servir chunks en cuanto sus puertos escuchan: el registro con los trackers y los
+heartbeats siguen en segundo plano (con reintentos si ningún tracker responde). Una API de control
+local (JSON por TCP en 127.0.0.1, el mismo protocolo que usan peers y tracker) permite pedir
+descargas (que pasan por la cola de DOWNLOAD_MANAGER) y consultar el estado; peer_ctl.py es un cliente para la consola.
+
+Uso: python peer_daemon.py [--config peer.json] [--peer-id A] [--port 6001] [--control-port 7001]
+                           [--ip 127.0.0.1 | --detect-ip] [--tracker-ip IP] [--tracker-port 8080]
+                           [--trackers ip:puerto,ip:puerto]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import argparse
+import threading
+
+START_TIME = time.perf_counter() # Antes de cualquier import pesado: el arranque se mide desde aquí
+
+from network_utils import start_listener, get_aws_instance_ips
+
+# Clave del archivo de configuración -> variable de entorno que la fija (y que lee peer.py)
+CONFIG_ENV = {
+    "peer_id": "BT_PEER_ID",
+    "ip": "BT_PEER_IP",
+    "advertised_ip": "BT_PEER_ADVERTISED_IP",
+    "port": "BT_PEER_PORT",
+    "tracker_ip": "BT_TRACKER_IP",
+    "tracker_port": "BT_TRACKER_PORT",
+    "trackers": "BT_TRACKERS",
+    "metrics_port": "BT_METRICS_PORT",
+    "control_port": "BT_CONTROL_PORT",
+    "workdir": "BT_WORKDIR",
+}
+INT_KEYS = {"port", "tracker_port", "metrics_port", "control_port"}
+# Valores por defecto; None: lo decide peer.py (p.ej. la dirección del tracker) o se deriva de otro valor
+CONFIG_DEFAULTS = {
+    "peer_id": None, # hostname-puerto
+    "ip": "127.0.0.1",
+    "advertised_ip": None, # La de binding
+    "port": 6001,
+    "tracker_ip": None,
+    "tracker_port": None,
+    "trackers": None, # Varios trackers: "ip:puerto,ip:puerto" (o una lista en el archivo JSON)
+    "metrics_port": None,
+    "control_port": None, # Puerto del peer + 1000
+    "workdir": None, # Directorio con sample_files/ y received_files/ (por defecto, el actual)
+    "detect_ip": False,
+}
+CONTROL_IP = "127.0.0.1" # La API de control no tiene autenticación: nunca se expone fuera del host
+CONTROL_PORT_OFFSET = 1000
+LISTENER_START_TIMEOUT = 5 # Segundos máximos para que los puertos empiecen a escuchar
+REGISTER_RETRY_MAX = 30 # Segundos máximos entre reintentos del registro con el tracker
+
+state = {"status": "starting", "registered": False, "startup_ms": None}
+shutdown_event = threading.Event()
+peer = None # Módulo peer, importado una vez que la configuración está en el entorno
+
+class ConfigError(Exception):
+    pass
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Peer BitTorrent sin interacción con API de control local")
+    parser.add_argument("--config", help="Archivo JSON con la configuración (claves: " + ", ".join(CONFIG_DEFAULTS) + ")")
+    parser.add_argument("--peer-id")
+    parser.add_argument("--ip", help="IP de binding (y la anunciada si no se indica --advertised-ip)")
+    parser.add_argument("--advertised-ip", help="IP que se anuncia al tracker (p.ej. la pública)")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--tracker-ip")
+    parser.add_argument("--tracker-port", type=int)
+    parser.add_argument("--trackers", help="Varios trackers: ip:puerto,ip:puerto (reemplaza a --tracker-ip/--tracker-port)")
+    parser.add_argument("--control-port", type=int, help="Puerto de la API de control en 127.0.0.1")
+    parser.add_argument("--metrics-port", type=int, help="Métricas Prometheus en http://127.0.0.1:<puerto>/metrics")
+    parser.add_argument("--workdir", help="Directorio de trabajo (sample_files/ y received_files/)")
+    parser.add_argument("--detect-ip", action="store_true", default=None,
+                        help="Averiguar la IP con los metadatos de AWS o la IP de salida (consulta la red)")
+    return parser.parse_args(argv)
+
+def load_config(args):
+    """Configuración final: valores por defecto < archivo JSON < variables de entorno < flags."""
+    config = dict(CONFIG_DEFAULTS)
+    if args.config:
+        try:
+            with open(args.config, "r") as f:
+                from_file = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise ConfigError(f"No se pudo leer '{args.config}': {e}")
+        if not isinstance(from_file, dict):
+            raise ConfigError(f"'{args.config}' debe contener un objeto JSON")
+        unknown = set(from_file) - set(CONFIG_DEFAULTS)
+        if unknown:
+            raise ConfigError(f"Claves desconocidas en '{args.config}': {', '.join(sorted(unknown))}")
+        config.update(from_file)
+    for key, env_name in CONFIG_ENV.items():
+        if os.environ.get(env_name):
+            config[key] = os.environ[env_name]
+    for key in CONFIG_DEFAULTS:
+        value = getattr(args, key)
+        if value is not None:
+            config[key] = value
+
+    for key in INT_KEYS:
+        if config[key] is not None:
+            try:
+                config[key] = int(config[key])
+            except (TypeError, ValueError):
+                raise ConfigError(f"'{key}' debe ser un número de puerto: {config[key]!r}")
+    if isinstance(config["trackers"], list):
+        config["trackers"] = ",".join(str(tracker) for tracker in config["trackers"])
+    if config["control_port"] is None:
+        config["control_port"] = config["port"] + CONTROL_PORT_OFFSET
+    if config["peer_id"] is None:
+        config["peer_id"] = f"{socket.gethostname()}-{config['port']}"
+    return config
+
+def apply_config(config):
+    """Deja la configuración donde la lee peer.py (variables de entorno) e importa el peer."""
+    global peer
+    if config["workdir"]:
+        os.makedirs(config["workdir"], exist_ok=True)
+        os.chdir(config["workdir"])
+    if config["detect_ip"]:
+        bind_ip, public_ip = get_aws_instance_ips()
+        if bind_ip is None:
+            raise ConfigError("No se pudo determinar la IP del peer")
+        config["ip"] = bind_ip
+        config["advertised_ip"] = config["advertised_ip"] or public_ip
+    for key, env_name in CONFIG_ENV.items():
+        if config[key] is not None:
+            os.environ[env_name] = str(config[key])
+    import peer as peer_module # Con BT_PEER_ID, BT_PEER_IP y BT_PEER_PORT definidos no pregunta ni consulta la red
+    peer = peer_module
+
+# --- API DE CONTROL ---
+def control_command(request):
+    """Atiende un comando de control ya decodificado y retorna la respuesta."""
+    command = request.get("command")
+    if command == "STATUS":
+        return {"status": "success", "state": state["status"], "peer_id": peer.PEER_ID,
+                "bind": f"{peer.PEER_BIND_IP}:{peer.PEER_PORT}", "advertised_ip": peer.PEER_ADVERTISED_IP,
+                "trackers": peer.TRACKER_CLIENT.snapshot(), "registered": state["registered"],
+                "startup_ms": state["startup_ms"], "uptime": round(time.perf_counter() - START_TIME, 3),
+                "downloads_running": peer.DOWNLOAD_MANAGER.limits()["active"]}
+    if command == "FILES":
+        return {"status": "success", "files": {name: {"size": entry["size"], "num_chunks": entry["num_chunks"]}
+                                               for name, entry in peer.LOCAL_CATALOG.entries().items()}}
+    if command in ("DOWNLOAD", "PAUSE", "RESUME", "CANCEL"):
+        filename = request.get("filename")
+        if not isinstance(filename, str) or not filename or os.path.basename(filename) != filename:
+            return {"status": "error", "message": "Invalid filename"}
+        if command == "DOWNLOAD":
+            try:
+                download, added = peer.DOWNLOAD_MANAGER.submit(filename, request.get("priority") or "normal")
+            except ValueError as e:
+                return {"status": "error", "message": str(e)}
+            return {"status": "success", "download": download, "added": added}
+        actions = {"PAUSE": peer.DOWNLOAD_MANAGER.pause, "RESUME": peer.DOWNLOAD_MANAGER.resume, "CANCEL": peer.DOWNLOAD_MANAGER.cancel}
+        if not actions[command](filename):
+            return {"status": "error", "message": f"Cannot {command.lower()} '{filename}' in its current state"}
+        return {"status": "success", "download": peer.DOWNLOAD_MANAGER.snapshot().get(filename)}
+    if command == "DOWNLOADS":
+        return {"status": "success", "downloads": peer.DOWNLOAD_MANAGER.snapshot(), "limits": peer.DOWNLOAD_MANAGER.limits()}
+    if command == "DOWNLOAD_LIMITS":
+        try:
+            peer.DOWNLOAD_MANAGER.configure(**{key: request[key] for key in ("max_active", "max_connections", "global_rate")
+                                               if request.get(key) is not None})
+        except (TypeError, ValueError) as e:
+            return {"status": "error", "message": f"Invalid limits: {e}"}
+        return {"status": "success", "limits": peer.DOWNLOAD_MANAGER.limits()}
+    if command == "UPLOAD_LIMITS":
+        try:
+            peer.UPLOAD_LIMITER.configure(**{key: request[key] for key in ("slots", "max_queue", "global_rate", "peer_rate")
+                                             if request.get(key) is not None})
+        except (TypeError, ValueError) as e:
+            return {"status": "error", "message": f"Invalid limits: {e}"}
+        return {"status": "success", "stats": peer.UPLOAD_LIMITER.snapshot()}
+    if command == "METRICS":
+        return {"status": "success", "metrics": peer.METRICS.snapshot()}
+    if command == "SHUTDOWN":
+        return {"status": "success", "state": "stopping"} # handle_control detiene el daemon tras responder
+    return {"status": "error", "message": "Unknown command"}
+
+async def handle_control(conn, addr):
+    try:
+        request = json.loads((await conn.read_request()).decode())
+        if not isinstance(request, dict):
+            raise ValueError("la solicitud no es un objeto JSON")
+    except (ValueError, UnicodeDecodeError) as e: # JSONDecodeError es un ValueError
+        await conn.send_json({"status": "error", "message": f"Invalid request: {e}"})
+        return
+    response = await conn.run_blocking(control_command, request) # Puede tocar el disco (FILES) o el tracker
+    await conn.send_json_stream(response)
+    if request.get("command") == "SHUTDOWN" and response["status"] == "success":
+        shutdown_event.set()
+
+# --- ARRANQUE ---
+def start_serving(ip, port, handler, name):
+    """Inicia un listener en su hilo y espera a que el puerto escuche. Retorna False si no pudo."""
+    ready = threading.Event()
+    thread = threading.Thread(target=start_listener, args=(ip, port, handler), kwargs={"on_ready": ready.set}, daemon=True)
+    thread.start()
+    while not ready.wait(0.01):
+        if not thread.is_alive() or time.perf_counter() - START_TIME > LISTENER_START_TIMEOUT:
+            print(f"[DAEMON] No se pudo iniciar {name} en {ip}:{port}.")
+            return False
+    return True
+
+def register_and_heartbeat():
+    """Registro inicial con los trackers (reintentando con espera creciente) y luego heartbeats periódicos."""
+    trackers = ", ".join(f"{ip}:{port}" for ip, port in peer.TRACKERS)
+    delay = 1
+    while not peer.TRACKER_CLIENT.announce(peer.PEER_ID, peer.PEER_ADVERTISED_IP, peer.PEER_PORT, peer.SHARED_DIR, peer.RECEIVED_DIR,
+                                           initial_registration=True, bitfields=peer.partial_bitfields()):
+        print(f"[DAEMON] Registro con los trackers ({trackers}) fallido. Reintento en {delay} s.")
+        if shutdown_event.wait(delay):
+            return
+        delay = min(delay * 2, REGISTER_RETRY_MAX)
+    state["registered"] = True
+    print(f"[DAEMON] Registrado con los trackers ({trackers}).")
+    peer.heartbeat_to_tracker()
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        config = load_config(args)
+        apply_config(config)
+    except ConfigError as e:
+        print(f"[DAEMON] Configuración inválida: {e}")
+        sys.exit(2)
+
+    if not start_serving(peer.PEER_BIND_IP, peer.PEER_PORT, peer.serve_file_handler, "el servicio de archivos"):
+        sys.exit(1)
+    if not start_serving(CONTROL_IP, config["control_port"], handle_control, "la API de control"):
+        sys.exit(1)
+    state["status"] = "serving"
+    state["startup_ms"] = round((time.perf_counter() - START_TIME) * 1000, 1)
+    print(f"[DAEMON] Peer '{peer.PEER_ID}' sirviendo en {peer.PEER_BIND_IP}:{peer.PEER_PORT} "
+          f"(control en {CONTROL_IP}:{config['control_port']}) tras {state['startup_ms']} ms.")
+
+    threading.Thread(target=register_and_heartbeat, daemon=True).start()
+    if peer.METRICS_HTTP_PORT is not None:
+        peer.start_metrics_http("127.0.0.1", peer.METRICS_HTTP_PORT)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: shutdown_event.set())
+    try:
+        while not shutdown_event.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    state["status"] = "stopping"
+    print("[DAEMON] Deteniendo el peer. Las descargas en curso se reanudarán en el próximo inicio.")
+
+if __name__ == "__main__":
+    main()
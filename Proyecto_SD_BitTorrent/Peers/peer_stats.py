@@ -0,0 +1,122 @@
+# bittorrent_project/peer_stats.py
+import time
+import random
+import threading
+
+from metrics import METRICS
+
+EWMA_ALPHA = 0.3 # Peso de la última muestra en las medias móviles
+MIN_SAMPLES = 3 # Muestras necesarias para considerar medido a un peer
+PROBE_PROBABILITY = 0.1 # Fracción de asignaciones que se usan para medir peers nuevos
+BAN_AFTER_TIMEOUTS = 2 # Timeouts seguidos tras los que un peer se excluye temporalmente
+BAN_DURATION = 30 # Segundos del primer baneo; se duplica con cada reincidencia
+MAX_BAN_DURATION = 300
+
+def ewma(previous, sample, alpha=EWMA_ALPHA):
+    return sample if previous is None else alpha * sample + (1 - alpha) * previous
+
+class PeerStats:
+    """
+    Estadísticas por peer (ip, puerto), compartidas por todas las descargas: throughput, RTT y tasa
+    de fallos como medias móviles exponenciales, y baneos temporales tras timeouts repetidos.
+    choose() elige el peer con menor tiempo estimado para entregar un chunk más, y a veces
+    prueba un peer poco medido para descubrir si es rápido.
+    """
+    def __init__(self, probe_probability=PROBE_PROBABILITY):
+        self.probe_probability = probe_probability
+        self.lock = threading.Lock()
+        self.peers = {} # (ip, port) -> estadísticas
+
+    def entry(self, key):
+        stats = self.peers.get(key)
+        if stats is None:
+            stats = {"throughput": None, "rtt": None, "failure_rate": 0.0, "samples": 0,
+                     "successes": 0, "failures": 0, "timeouts": 0, "consecutive_timeouts": 0,
+                     "bytes": 0, "bans": 0, "banned_until": 0.0}
+            self.peers[key] = stats
+        return stats
+
+    def record_success(self, key, num_bytes, elapsed):
+        """Chunk recibido y verificado: 'elapsed' segundos desde la solicitud hasta tenerlo completo."""
+        with self.lock:
+            stats = self.entry(key)
+            stats["throughput"] = ewma(stats["throughput"], num_bytes / max(elapsed, 1e-6))
+            stats["failure_rate"] = ewma(stats["failure_rate"], 0.0)
+            stats["samples"] += 1
+            stats["successes"] += 1
+            stats["bytes"] += num_bytes
+            stats["consecutive_timeouts"] = 0
+
+    def record_rtt(self, key, elapsed):
+        """Tiempo de ida y vuelta de una solicitud pequeña (p.ej. GET_FILE_INFO)."""
+        with self.lock:
+            stats = self.entry(key)
+            stats["rtt"] = ewma(stats["rtt"], elapsed)
+
+    def record_failure(self, key):
+        """Error, chunk corrupto o de tamaño inesperado."""
+        with self.lock:
+            stats = self.entry(key)
+            stats["failure_rate"] = ewma(stats["failure_rate"], 1.0)
+            stats["samples"] += 1
+            stats["failures"] += 1
+
+    def record_timeout(self, key):
+        """Timeout de la sesión con el peer. Tras varios seguidos, el peer queda baneado un tiempo."""
+        with self.lock:
+            stats = self.entry(key)
+            stats["timeouts"] += 1
+            METRICS.inc("bt_peer_timeouts_total", peer=f"{key[0]}:{key[1]}")
+            stats["consecutive_timeouts"] += 1
+            if stats["consecutive_timeouts"] >= BAN_AFTER_TIMEOUTS:
+                duration = min(BAN_DURATION * (2 ** stats["bans"]), MAX_BAN_DURATION)
+                stats["banned_until"] = time.monotonic() + duration
+                stats["bans"] += 1
+                stats["consecutive_timeouts"] = 0
+                print(f"\n[PEER STATS] Peer {key[0]}:{key[1]} baneado {duration} s por timeouts repetidos.")
+
+    def is_banned(self, key):
+        with self.lock:
+            stats = self.peers.get(key)
+            return stats is not None and stats["banned_until"] > time.monotonic()
+
+    def expected_time(self, stats, in_flight, chunk_bytes, default_throughput):
+        """
+        Segundos estimados para que el peer entregue un chunk más, con 'in_flight' ya pedidos.
+        El throughput medido ya incluye la latencia de cada solicitud; el RTT solo se suma a los
+        peers que aún no tienen throughput.
+        """
+        if stats and stats["throughput"]:
+            return (in_flight + 1) * chunk_bytes / (stats["throughput"] * max(1.0 - stats["failure_rate"], 0.05))
+        rtt = stats["rtt"] if stats and stats["rtt"] else 0.0
+        return rtt + (in_flight + 1) * chunk_bytes / default_throughput
+
+    def choose(self, candidates, in_flight, chunk_bytes):
+        """
+        Elige un peer de 'candidates' (dicts con "ip" y "port"). 'in_flight' mapea (ip, port) a las
+        solicitudes en curso. Los peers sin medir se estiman con el throughput medio de los medidos.
+        """
+        with self.lock:
+            # Solo se sondean peers sin solicitudes en curso: uno que no responde nunca acumularía muestras
+            # y seguiría atrayendo sondeos hasta atascar a todos los workers
+            unmeasured = [p for p in candidates if self.peers.get((p['ip'], p['port']), {}).get("samples", 0) < MIN_SAMPLES
+                          and not in_flight.get((p['ip'], p['port']), 0)]
+            if unmeasured and len(unmeasured) < len(candidates) and random.random() < self.probe_probability:
+                return random.choice(unmeasured) # Sondeo
+
+            known = [s["throughput"] for s in self.peers.values() if s["throughput"]]
+            default_throughput = sum(known) / len(known) if known else 1.0
+            return min(candidates, key=lambda p: self.expected_time(self.peers.get((p['ip'], p['port'])),
+                                                                     in_flight.get((p['ip'], p['port']), 0),
+                                                                     chunk_bytes, default_throughput))
+
+    def snapshot(self):
+        """Copia de las estadísticas para consultarlas: "ip:puerto" -> valores (con 'banned' en segundos restantes)."""
+        now = time.monotonic()
+        with self.lock:
+            result = {}
+            for (ip, port), stats in self.peers.items():
+                entry = dict(stats)
+                entry["banned"] = max(0.0, round(entry.pop("banned_until") - now, 1))
+                result[f"{ip}:{port}"] = entry
+            return result
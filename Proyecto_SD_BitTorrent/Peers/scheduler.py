@@ -0,0 +1,321 @@
+# bittorrent_project/scheduler.py
+import os
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from metrics import METRICS
+from file_manager import write_at, Bitfield, piece_length, piece_blocks, num_pieces, CHUNK_SIZE
+
+DOWNLOAD_WORKERS = 8 # Chunks descargándose a la vez por archivo
+PEERS_REFRESH_INTERVAL = 10 # Segundos entre consultas al tracker por la lista de peers
+FAILURE_BACKOFF = 1 # Pausa de un worker tras un fallo, para no martillar a peers caídos
+ENDGAME_GRACE = 0.5 # Segundos sin respuesta antes de pedir un chunk a otro peer más
+ENDGAME_MAX_REQUESTS = 3 # Solicitudes simultáneas como máximo por chunk (la original y dos duplicadas)
+ENDGAME_MAX_DUPLICATE_BYTES = 4 * 1024 * 1024 # Tope de tráfico duplicado por descarga
+
+class ChunkScheduler:
+    """
+    Descarga los chunks (piezas de 'piece_size' bytes) pendientes de un archivo con varios workers
+    en paralelo. Cada chunk se pide en bloques de 'block_size' y se asigna al peer con menos solicitudes en vuelo entre los que lo tienen (o, con
+    'peer_stats', al que se estima que lo entregará antes, saltando los baneados), se
+    verifica, se escribe en su offset dentro del archivo preasignado y, si el peer falla o envía
+    datos corruptos, vuelve a la cola para otro peer. Si falla a mitad, los bloques recibidos se
+    conservan y solo se vuelven a pedir los que faltan. Los chunks que menos peers tienen se piden
+    primero (rarest first), para que el contenido nuevo se reparta rápido por la red.
+    En el endgame (todo lo que falta ya está pedido, así que quedan como mucho 'num_workers' chunks),
+    los workers libres vuelven a pedir los chunks que tardan a otros peers: gana la primera
+    respuesta válida y se cancelan las demás.
+    """
+    def __init__(self, filename, filepath, file_size, chunk_indexes, fetch_blocks, get_peers,
+                 num_workers=DOWNLOAD_WORKERS, on_chunk_done=None, peers_refresh_interval=PEERS_REFRESH_INTERVAL,
+                 verify_chunk=None, peer_stats=None, piece_size=CHUNK_SIZE, block_size=CHUNK_SIZE):
+        self.filename = filename
+        self.filepath = filepath
+        self.file_size = file_size
+        # fetch_blocks(peer, chunk_index, [(offset, longitud)], cancelled) -> [bytes o None por bloque] (cancelled: Future)
+        self.fetch_blocks = fetch_blocks
+        self.get_peers = get_peers # get_peers() -> lista de peers {"peer_id", "ip", "port"[, "bitfield"]}
+        self.num_workers = num_workers
+        self.worker_limit = num_workers # Solicitudes en curso permitidas (set_worker_limit la baja sin parar workers)
+        self.busy = 0 # Solicitudes en curso, incluidas las duplicadas del endgame
+        self.on_chunk_done = on_chunk_done # on_chunk_done(chunk_index, num_bytes)
+        self.peers_refresh_interval = peers_refresh_interval
+        self.verify_chunk = verify_chunk # verify_chunk(chunk_index, data) -> bool (None: solo se comprueba el tamaño)
+        self.peer_stats = peer_stats # PeerStats compartido entre descargas (None: elegir por solicitudes en vuelo)
+        self.piece_size = piece_size
+        self.block_size = block_size
+
+        self.pending = deque(sorted(chunk_indexes))
+        self.in_progress = set()
+        self.num_chunks = num_pieces(file_size, piece_size)
+        self.completed = set(range(self.num_chunks)) - set(self.pending) # Lo que no hay que pedir ya está en disco
+        self.failed_peers = {} # chunk_index -> peers que fallaron ese chunk
+        self.in_flight = {} # (ip, port) -> solicitudes en curso con ese peer
+        self.chunks_by_peer = {} # (ip, port) -> chunks de esta descarga que entregó ese peer
+        self.requests = {} # chunk_index -> {cancelled (Future): ((ip, port), es_duplicada)} solicitudes en curso
+        self.requested_at = {} # chunk_index -> instante de su última solicitud
+        self.claimed = {} # chunk_index -> cancelled de la solicitud cuya respuesta se está escribiendo en disco
+        self.blocks = {} # chunk_index -> {offset: bytes} bloques recibidos de chunks aún incompletos
+        self.endgame = {"duplicate_requests": 0, "duplicate_bytes": 0, "won_by_duplicate": 0, "cancelled": 0}
+        self.peers = []
+        self.stopped = False
+        self.cond = threading.Condition()
+        self.fd = None
+
+    def chunk_length(self, chunk_index):
+        """Tamaño esperado de un chunk (el último puede ser más corto)."""
+        return piece_length(self.file_size, self.piece_size, chunk_index)
+
+    def missing_blocks(self, chunk_index):
+        """Bloques (offset, longitud) del chunk que aún no se recibieron."""
+        with self.cond:
+            received = self.blocks.get(chunk_index, {})
+            return [block for block in piece_blocks(self.chunk_length(chunk_index), self.block_size) if block[0] not in received]
+
+    def add_blocks(self, chunk_index, received):
+        """Guarda bloques recibidos. Retorna el chunk completo si ya están todos sus bloques, o None."""
+        with self.cond:
+            blocks = self.blocks.setdefault(chunk_index, {})
+            blocks.update(received)
+            offsets = [offset for offset, _ in piece_blocks(self.chunk_length(chunk_index), self.block_size)]
+            if any(offset not in blocks for offset in offsets):
+                return None
+            return b"".join(blocks[offset] for offset in offsets)
+
+    def is_done(self):
+        return not self.pending and not self.in_progress
+
+    def refresh_peers(self):
+        peers = []
+        for peer in self.get_peers():
+            if "bitfield" in peer:
+                # Peer que aún descarga el archivo: solo puede servir los chunks de su bitfield
+                try:
+                    peer["have"] = Bitfield.from_dict(peer["bitfield"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if peer["have"].num_chunks != self.num_chunks:
+                    continue # Bitfield de otra versión del archivo o con otro tamaño de pieza
+            peers.append(peer)
+        with self.cond:
+            self.peers = peers
+            # Rarest first: ordenar lo pendiente por cuántos peers tienen cada chunk (los que nadie tiene, al final)
+            availability = {i: sum(1 for p in peers if self.peer_has(p, i)) for i in self.pending}
+            self.pending = deque(sorted(self.pending, key=lambda i: (availability[i] == 0, availability[i], i)))
+            self.cond.notify_all()
+        return peers
+
+    def peer_has(self, peer, chunk_index):
+        have = peer.get("have")
+        return have is None or have.has(chunk_index)
+
+    def choose_peer(self, candidates, chunk_index):
+        random.shuffle(candidates)
+        if self.peer_stats is not None:
+            # Los peers baneados por timeouts solo se usan si no queda ningún otro
+            candidates = [p for p in candidates if not self.peer_stats.is_banned((p['ip'], p['port']))] or candidates
+            return self.peer_stats.choose(candidates, self.in_flight, self.chunk_length(chunk_index))
+        return min(candidates, key=lambda p: self.in_flight.get((p['ip'], p['port']), 0))
+
+    def start_request(self, chunk_index, peer, duplicate):
+        """Registra una solicitud en curso. Se llama con el lock tomado. Retorna su Future de cancelación."""
+        key = (peer['ip'], peer['port'])
+        cancelled = Future()
+        self.in_flight[key] = self.in_flight.get(key, 0) + 1
+        self.busy += 1
+        self.in_progress.add(chunk_index)
+        self.requests.setdefault(chunk_index, {})[cancelled] = (key, duplicate)
+        self.requested_at[chunk_index] = time.monotonic()
+        return cancelled
+
+    def endgame_assignment(self):
+        """
+        Solicitud duplicada para el chunk en curso que más tarda, o None si no toca (aún no es el
+        endgame, ninguno lleva ENDGAME_GRACE sin respuesta, no hay otro peer o se agotó el tope).
+        Se llama con el lock tomado.
+        """
+        if self.pending:
+            return None
+        now = time.monotonic()
+        for chunk_index in sorted(self.in_progress - self.claimed.keys(), key=lambda i: self.requested_at[i]):
+            requests = self.requests[chunk_index]
+            length = sum(block_length for _, block_length in self.missing_blocks(chunk_index))
+            if (len(requests) >= ENDGAME_MAX_REQUESTS or now - self.requested_at[chunk_index] < ENDGAME_GRACE
+                    or self.endgame["duplicate_bytes"] + length > ENDGAME_MAX_DUPLICATE_BYTES):
+                continue
+            busy = {key for key, _ in requests.values()} | self.failed_peers.get(chunk_index, set())
+            candidates = [p for p in self.peers if self.peer_has(p, chunk_index) and (p['ip'], p['port']) not in busy]
+            if not candidates:
+                continue
+            peer = self.choose_peer(candidates, chunk_index)
+            self.endgame["duplicate_requests"] += 1
+            self.endgame["duplicate_bytes"] += length
+            print(f"\n[SCHEDULER] Endgame: chunk {chunk_index} pedido también a {peer['peer_id']}.")
+            return chunk_index, peer, self.start_request(chunk_index, peer, duplicate=True)
+        return None
+
+    def next_assignment(self):
+        """
+        Bloquea hasta que haya un chunk pendiente y un peer para pedirlo.
+        Retorna (chunk_index, peer, cancelled) o None al terminar; 'cancelled' se completa si otra
+        solicitud del mismo chunk gana antes.
+        """
+        with self.cond:
+            while True:
+                if self.stopped or self.is_done():
+                    return None
+                if self.busy >= self.worker_limit:
+                    self.cond.wait() # Sobre el límite de esta descarga: esperar a que termine otra solicitud
+                    continue
+                for position, chunk_index in enumerate(self.pending):
+                    holders = [p for p in self.peers if self.peer_has(p, chunk_index)]
+                    if holders:
+                        break
+                else:
+                    assignment = self.endgame_assignment()
+                    if assignment is not None:
+                        return assignment
+                    # Ningún peer conocido tiene los chunks pendientes (o todo está pedido): en el endgame
+                    # se vuelve a mirar pronto por si algún chunk lleva demasiado sin respuesta
+                    self.cond.wait(timeout=ENDGAME_GRACE if self.in_progress else None)
+                    continue
+
+                del self.pending[position]
+                excluded = self.failed_peers.get(chunk_index, set())
+                candidates = [p for p in holders if (p['ip'], p['port']) not in excluded]
+                if not candidates:
+                    # Todos los peers fallaron este chunk: volver a intentarlo con cualquiera
+                    self.failed_peers.pop(chunk_index, None)
+                    candidates = holders
+                peer = self.choose_peer(candidates, chunk_index)
+                return chunk_index, peer, self.start_request(chunk_index, peer, duplicate=False)
+
+    def claim(self, chunk_index, cancelled):
+        """
+        Reserva el chunk para escribir la respuesta de esta solicitud. Retorna False si otra
+        solicitud ya lo entregó; si no, cancela las demás solicitudes del chunk.
+        """
+        with self.cond:
+            if cancelled.done() or chunk_index in self.claimed or chunk_index in self.completed:
+                return False
+            self.claimed[chunk_index] = cancelled
+            for other in self.requests[chunk_index]:
+                if other is not cancelled and not other.done():
+                    other.set_result(True)
+                    self.endgame["cancelled"] += 1
+            return True
+
+    def finish_assignment(self, chunk_index, peer, cancelled, success):
+        with self.cond:
+            requests = self.requests[chunk_index]
+            key, duplicate = requests.pop(cancelled)
+            self.in_flight[key] -= 1
+            self.busy -= 1
+            if self.claimed.get(chunk_index) is cancelled:
+                del self.claimed[chunk_index]
+            if success:
+                self.completed.add(chunk_index)
+                self.blocks.pop(chunk_index, None)
+                self.in_progress.discard(chunk_index) # Las solicitudes canceladas que sigan en curso ya no cuentan
+                self.chunks_by_peer[key] = self.chunks_by_peer.get(key, 0) + 1
+                self.failed_peers.pop(chunk_index, None)
+                if duplicate:
+                    self.endgame["won_by_duplicate"] += 1
+            elif not cancelled.done():
+                self.failed_peers.setdefault(chunk_index, set()).add(key)
+            if not requests:
+                del self.requests[chunk_index]
+                if chunk_index not in self.completed:
+                    # Reencolar el chunk para que lo pida otro peer
+                    self.in_progress.discard(chunk_index)
+                    self.pending.append(chunk_index)
+                    METRICS.inc("bt_piece_retries_total")
+            self.cond.notify_all()
+
+    def worker(self):
+        while True:
+            assignment = self.next_assignment()
+            if assignment is None:
+                return
+            chunk_index, peer, cancelled = assignment
+            success = False
+            received_bytes = 0
+            start = time.monotonic()
+            try:
+                blocks = self.missing_blocks(chunk_index)
+                received = {}
+                for (offset, length), data in zip(blocks, self.fetch_blocks(peer, chunk_index, blocks, cancelled)):
+                    if data is not None and len(data) == length:
+                        received[offset] = data
+                    elif data is not None:
+                        print(f"\n[SCHEDULER] Chunk {chunk_index} de {peer['peer_id']} con tamaño inesperado ({len(data)} bytes en el bloque {offset}).")
+                received_bytes = sum(len(data) for data in received.values())
+                chunk_data = None if cancelled.done() else self.add_blocks(chunk_index, received)
+                if cancelled.done():
+                    pass # Otra solicitud entregó el chunk primero
+                elif chunk_data is None:
+                    missing = len(blocks) - len(received)
+                    detail = f" ({missing} de {len(blocks)} bloques; los recibidos se conservan)" if len(blocks) > 1 else ""
+                    print(f"\n[SCHEDULER] No se pudo descargar el chunk {chunk_index} de {peer['peer_id']}{detail}.")
+                elif self.verify_chunk and not self.verify_chunk(chunk_index, chunk_data):
+                    with self.cond:
+                        self.blocks.pop(chunk_index, None) # No se sabe qué bloque está mal: se vuelven a pedir todos
+                    print(f"\n[SCHEDULER] Chunk {chunk_index} de {peer['peer_id']} corrupto (hash inválido). Se pedirá a otro peer.")
+                elif self.claim(chunk_index, cancelled):
+                    write_at(self.fd, chunk_index * self.piece_size, chunk_data)
+                    success = True
+            except Exception as e:
+                print(f"\n[SCHEDULER] Error al descargar/escribir el chunk {chunk_index} de {peer['peer_id']}: {e}")
+            lost = cancelled.done() # Cancelada: no cuenta como fallo del peer
+            if self.peer_stats is not None and received_bytes and (success or lost):
+                self.peer_stats.record_success((peer['ip'], peer['port']), received_bytes, time.monotonic() - start)
+            elif self.peer_stats is not None and not lost:
+                self.peer_stats.record_failure((peer['ip'], peer['port']))
+            self.finish_assignment(chunk_index, peer, cancelled, success)
+            if success and self.on_chunk_done:
+                self.on_chunk_done(chunk_index, self.chunk_length(chunk_index))
+            elif not success and not lost:
+                time.sleep(FAILURE_BACKOFF)
+
+    def set_worker_limit(self, limit):
+        """Cambia cuántas solicitudes puede tener en curso la descarga (entre 1 y num_workers)."""
+        with self.cond:
+            self.worker_limit = max(1, min(limit, self.num_workers))
+            self.cond.notify_all()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            for requests in self.requests.values():
+                for cancelled in requests:
+                    if not cancelled.done():
+                        cancelled.set_result(True) # Que los workers no sigan esperando respuestas
+            self.cond.notify_all()
+
+    def run(self):
+        """Ejecuta la descarga hasta completar todos los chunks (o hasta stop()). Retorna True si quedó completa."""
+        self.fd = os.open(self.filepath, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        workers = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.num_workers)]
+        try:
+            for w in workers:
+                w.start()
+            last_refresh = None
+            while True:
+                with self.cond:
+                    if self.stopped or self.is_done():
+                        break
+                if last_refresh is None or time.monotonic() - last_refresh >= self.peers_refresh_interval:
+                    last_refresh = time.monotonic()
+                    if not self.refresh_peers():
+                        print(f"\n[SCHEDULER] Ningún peer disponible con '{self.filename}'. Reintentando en {self.peers_refresh_interval} segundos...")
+                with self.cond:
+                    self.cond.wait(timeout=1)
+            self.stop() # Despierta a los workers que esperaban trabajo
+            for w in workers:
+                w.join()
+        finally:
+            os.close(self.fd)
+        return not self.pending and not self.in_progress
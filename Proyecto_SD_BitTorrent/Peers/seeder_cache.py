@@ -0,0 +1,269 @@
+# bittorrent_project/seeder_cache.py
+import os
+import threading
+from collections import OrderedDict
+
+from file_manager import read_at
+from compression import compress, is_compressible, MAX_COMPRESSED_RATIO
+
+MAX_OPEN_FILES = 64 # Descriptores abiertos como máximo en el pool
+CHUNK_CACHE_BYTES = 64 * 1024 * 1024 # Bytes máximos de chunks recientes en memoria
+HOT_KEYS = 4096 # Chunks pedidos recientemente que se recuerdan para decidir si guardarlos en memoria
+
+class PooledFile:
+    """Archivo abierto del pool. No se cierra mientras alguien lo esté usando (p.ej. un sendfile en curso)."""
+    def __init__(self, path, file):
+        self.path = path
+        self.file = file
+        self.users = 0
+        self.retired = False # Expulsado o invalidado: se cierra al quedar sin usuarios
+
+class SeederCache:
+    """
+    Caché del lado seeder: nombre de archivo -> ruta resuelta, pool acotado de archivos abiertos
+    y LRU de chunks servidos recientemente (crudos o comprimidos), con un tope en bytes. Cada resolución compara el tamaño,
+    mtime e inodo del archivo con los que se cachearon; si cambiaron se descarta todo lo de ese archivo.
+    Con un 'catalog' (FileCatalog) las rutas nuevas se buscan en memoria en vez de probar cada directorio.
+    """
+    def __init__(self, directories, max_open_files=MAX_OPEN_FILES, max_chunk_bytes=CHUNK_CACHE_BYTES, hot_keys=HOT_KEYS, catalog=None):
+        self.directories = directories # En orden de prioridad (SHARED_DIR antes que RECEIVED_DIR)
+        self.catalog = catalog
+        self.max_open_files = max_open_files
+        self.max_chunk_bytes = max_chunk_bytes
+        self.hot_keys = hot_keys
+        self.lock = threading.Lock()
+
+        self.paths = {} # filename -> ruta resuelta
+        self.versions = {} # ruta -> (inodo, tamaño, mtime_ns) con que se cachearon sus datos
+        self.files = OrderedDict() # ruta -> PooledFile (orden LRU)
+        self.chunks = OrderedDict() # (ruta, offset, longitud[, códec]) -> bytes (orden LRU)
+        self.chunk_bytes = 0
+        self.seen = OrderedDict() # (ruta, offset, longitud) pedidos una vez: a la segunda se guardan en memoria
+        self.compressible = {} # ruta -> si vale la pena comprimir sus bloques
+
+        self.counters = {"path_hits": 0, "path_misses": 0, "chunk_hits": 0, "chunk_misses": 0,
+                         "chunk_evictions": 0, "file_opens": 0, "file_evictions": 0, "invalidations": 0,
+                         "compressed_hits": 0, "compressed_chunks": 0, "compression_skipped": 0, "compression_saved_bytes": 0}
+
+    # --- RESOLUCIÓN DE RUTAS ---
+    def resolve(self, filename):
+        """
+        Ruta del archivo en los directorios del peer, o None. Invalida la caché del archivo si cambió.
+        Bloqueante (stat y, con un catálogo, quizás un rescan de los directorios): desde el listener se
+        llama con run_blocking.
+        """
+        path = self.paths.get(filename)
+        st = None
+        if path is not None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                path = None
+        if path is None:
+            if self.catalog is not None:
+                catalog_path = self.catalog.path(filename)
+                candidates = [catalog_path] if catalog_path else []
+            else:
+                candidates = [os.path.join(directory, filename) for directory in self.directories]
+            for candidate in candidates:
+                try:
+                    st = os.stat(candidate)
+                except OSError:
+                    continue
+                path = candidate
+                break
+            if path is None:
+                self.paths.pop(filename, None)
+                return None
+            self.paths[filename] = path
+            resolved = True
+        else:
+            resolved = False
+
+        version = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            self.counters["path_misses" if resolved else "path_hits"] += 1
+            if self.versions.get(path) != version:
+                if path in self.versions:
+                    self.counters["invalidations"] += 1
+                self.invalidate(path)
+                self.versions[path] = version
+        return path
+
+    def file_size(self, path):
+        version = self.versions.get(path)
+        return version[1] if version is not None else os.path.getsize(path)
+
+    def invalidate(self, path):
+        """Descarta los chunks, el descriptor y la marca de uso de un archivo. Se llama con el lock tomado."""
+        for key in [key for key in self.chunks if key[0] == path]:
+            self.chunk_bytes -= len(self.chunks.pop(key))
+        for key in [key for key in self.seen if key[0] == path]:
+            del self.seen[key]
+        pooled = self.files.pop(path, None)
+        if pooled is not None:
+            self.retire(pooled)
+        self.versions.pop(path, None)
+        self.compressible.pop(path, None)
+
+    # --- POOL DE ARCHIVOS ABIERTOS ---
+    def retire(self, pooled):
+        pooled.retired = True
+        if pooled.users == 0:
+            pooled.file.close()
+
+    def acquire(self, path):
+        """Retorna el PooledFile de 'path' (abriéndolo si hace falta). Liberar con release()."""
+        with self.lock:
+            pooled = self.files.get(path)
+            if pooled is not None:
+                self.files.move_to_end(path)
+                pooled.users += 1
+                return pooled
+        pooled = PooledFile(path, open(path, "rb")) # Abrir fuera del lock
+        with self.lock:
+            self.counters["file_opens"] += 1
+            current = self.files.get(path)
+            if current is not None:
+                pooled.file.close() # Otro hilo lo abrió mientras tanto
+                pooled = current
+            else:
+                self.files[path] = pooled
+                # Expulsar los menos usados que no estén en uso; si todos lo están, se excede el tope un momento
+                for old_path in list(self.files):
+                    if len(self.files) <= self.max_open_files:
+                        break
+                    old = self.files[old_path]
+                    if old.users == 0 and old is not pooled:
+                        del self.files[old_path]
+                        self.retire(old)
+                        self.counters["file_evictions"] += 1
+            pooled.users += 1
+            return pooled
+
+    def release(self, pooled):
+        with self.lock:
+            pooled.users -= 1
+            if pooled.retired and pooled.users == 0:
+                pooled.file.close()
+
+    # --- LRU DE CHUNKS ---
+    def get_cached_chunk(self, path, offset, length):
+        """Rango (chunk o bloque) en memoria o None. No toca el disco, así que puede llamarse desde el event loop."""
+        key = (path, offset, length)
+        with self.lock:
+            chunk_data = self.chunks.get(key)
+            if chunk_data is not None:
+                self.chunks.move_to_end(key)
+                self.counters["chunk_hits"] += 1
+                return chunk_data
+            self.counters["chunk_misses"] += 1
+            return None
+
+    def is_hot(self, path, offset, length):
+        """True si el rango ya se pidió hace poco (merece guardarse en memoria). Registra el pedido."""
+        key = (path, offset, length)
+        with self.lock:
+            if key in self.seen:
+                del self.seen[key]
+                return True
+            self.seen[key] = True
+            if len(self.seen) > self.hot_keys:
+                self.seen.popitem(last=False)
+            return False
+
+    def store_chunk(self, path, offset, length, chunk_data, version, codec=None):
+        if len(chunk_data) > self.max_chunk_bytes:
+            return
+        key = (path, offset, length) if codec is None else (path, offset, length, codec)
+        with self.lock:
+            if self.versions.get(path) != version or key in self.chunks:
+                return # El archivo cambió mientras se leía
+            self.chunks[key] = chunk_data
+            self.chunk_bytes += len(chunk_data)
+            while self.chunk_bytes > self.max_chunk_bytes:
+                _, evicted = self.chunks.popitem(last=False)
+                self.chunk_bytes -= len(evicted)
+                self.counters["chunk_evictions"] += 1
+
+    def read_chunk(self, path, offset, length):
+        """Lee un rango con el descriptor del pool y lo guarda en la LRU (bloqueante: ejecutar en el executor)."""
+        version = self.versions.get(path)
+        pooled = self.acquire(path)
+        try:
+            chunk_data = read_at(pooled.file.fileno(), offset, length)
+        finally:
+            self.release(pooled)
+        if chunk_data:
+            self.store_chunk(path, offset, length, chunk_data, version)
+        return chunk_data
+
+    # --- CHUNKS COMPRIMIDOS ---
+    def get_compressed_chunk(self, path, offset, length, codec):
+        """
+        Rango comprimido con 'codec' en memoria, b"" si se sabe que no conviene comprimirlo (archivo
+        ya comprimido o bloque que no se reduce), o None si hay que comprimirlo. No toca el disco.
+        """
+        with self.lock:
+            if self.compressible.get(path) is False:
+                return b""
+            key = (path, offset, length, codec)
+            compressed = self.chunks.get(key)
+            if compressed is not None:
+                self.chunks.move_to_end(key)
+                self.counters["compressed_hits"] += 1
+            return compressed
+
+    def is_compressible(self, path):
+        """Si vale la pena comprimir el archivo (extensión y muestra del contenido), una vez por versión. Bloqueante."""
+        compressible = self.compressible.get(path)
+        if compressible is None:
+            version = self.versions.get(path)
+            compressible = is_compressible(path)
+            with self.lock:
+                if self.versions.get(path) == version:
+                    self.compressible[path] = compressible
+        return compressible
+
+    def compress_chunk(self, path, offset, length, codec):
+        """
+        Lee y comprime un rango, y guarda el resultado en la LRU para no recomprimir los bloques populares.
+        Retorna b"" si no conviene comprimirlo. Bloqueante: ejecutar en el executor.
+        """
+        version = self.versions.get(path)
+        if not self.is_compressible(path):
+            return b""
+        chunk_data = self.get_cached_chunk(path, offset, length)
+        if chunk_data is None:
+            pooled = self.acquire(path) # Sin pasar por read_chunk: en la LRU solo queda la versión comprimida
+            try:
+                chunk_data = read_at(pooled.file.fileno(), offset, length)
+            finally:
+                self.release(pooled)
+        compressed = compress(codec, chunk_data)
+        if len(compressed) > len(chunk_data) * MAX_COMPRESSED_RATIO:
+            compressed = b"" # Se recuerda que este bloque va sin comprimir
+        with self.lock:
+            if compressed:
+                self.counters["compressed_chunks"] += 1
+                self.counters["compression_saved_bytes"] += len(chunk_data) - len(compressed)
+            else:
+                self.counters["compression_skipped"] += 1
+        self.store_chunk(path, offset, length, compressed, version, codec)
+        return compressed
+
+    def open_chunk(self, path, offset, length):
+        """
+        Prepara un rango para sendfile con el descriptor del pool. Retorna (PooledFile, offset, longitud),
+        con la longitud recortada al final del archivo; quien llama debe llamar a release() al terminar.
+        """
+        length = max(0, min(length, self.file_size(path) - offset))
+        return self.acquire(path), offset, length
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats.update({"cached_chunks": len(self.chunks), "cached_bytes": self.chunk_bytes,
+                          "max_cached_bytes": self.max_chunk_bytes, "open_files": len(self.files),
+                          "max_open_files": self.max_open_files, "resolved_paths": len(self.paths)})
+        return stats
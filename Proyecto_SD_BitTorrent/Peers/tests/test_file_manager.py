@@ -0,0 +1,100 @@
+# bittorrent_project/tests/test_file_manager.py
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import file_manager
+from file_manager import (Bitfield, ResumeState, load_resume_state, has_resume_state, resume_state_path,
+                          LEGACY_RESUME_HEADER, LEGACY_RESUME_MAGIC, CHUNK_SIZE)
+
+class BitfieldTest(unittest.TestCase):
+    def test_dict_round_trip(self):
+        bitfield = Bitfield(13)
+        for chunk_index in (0, 7, 8, 12):
+            bitfield.set(chunk_index)
+        copy = Bitfield.from_dict(json.loads(json.dumps(bitfield.to_dict())))
+        self.assertEqual(copy.num_chunks, 13)
+        self.assertEqual([i for i in range(13) if copy.has(i)], [0, 7, 8, 12])
+        self.assertEqual(copy.missing(), [1, 2, 3, 4, 5, 6, 9, 10, 11])
+
+    def test_from_dict_rejects_wrong_length(self):
+        data = Bitfield(16).to_dict()
+        data["num_chunks"] = 17 # Haría falta un byte más
+        with self.assertRaises(ValueError):
+            Bitfield.from_dict(data)
+        with self.assertRaises(ValueError):
+            Bitfield.from_dict({"num_chunks": -1, "bits": ""})
+
+    def test_has_range(self):
+        bitfield = Bitfield(4)
+        bitfield.set(1)
+        bitfield.set(2)
+        self.assertTrue(bitfield.has_range(100, 100, 200)) # Piezas 1 y 2 exactas
+        self.assertTrue(bitfield.has_range(100, 150, 10))
+        self.assertFalse(bitfield.has_range(100, 150, 200)) # Llega a la pieza 3
+        self.assertFalse(bitfield.has_range(100, 99, 2)) # Empieza en la pieza 0
+        self.assertFalse(bitfield.has_range(100, 100, 0))
+        self.assertFalse(bitfield.has_range(100, 350, 100)) # Más allá del archivo
+
+class ResumeStateTest(unittest.TestCase):
+    def setUp(self):
+        self.previous_dir = os.getcwd()
+        self.work_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.work_dir.name) # RESUME_DIR y el progreso antiguo son rutas relativas
+        file_manager.downloads_progress = {}
+
+    def tearDown(self):
+        file_manager.downloads_progress = {}
+        os.chdir(self.previous_dir)
+        self.work_dir.cleanup()
+
+    def test_sidecar_round_trip(self):
+        state = ResumeState("a.bin", 10 * 256 * 1024 + 5, piece_size=256 * 1024)
+        for chunk_index in (0, 3, 10):
+            state.mark(chunk_index)
+        state.flush()
+        self.assertTrue(has_resume_state("a.bin"))
+
+        loaded = load_resume_state("a.bin")
+        self.assertEqual((loaded.file_size, loaded.piece_size), (state.file_size, 256 * 1024))
+        self.assertEqual(loaded.bitfield.num_chunks, 11)
+        self.assertEqual([i for i in range(11) if loaded.bitfield.has(i)], [0, 3, 10])
+        self.assertFalse(os.path.exists(resume_state_path("a.bin") + ".tmp"))
+
+    def test_legacy_sidecar_is_read_with_chunk_size_pieces(self):
+        bitfield = Bitfield(3)
+        bitfield.set(1)
+        os.makedirs(file_manager.RESUME_DIR)
+        with open(resume_state_path("old.bin"), "wb") as f:
+            f.write(LEGACY_RESUME_HEADER.pack(LEGACY_RESUME_MAGIC, 3 * CHUNK_SIZE, 3) + bytes(bitfield.bits))
+
+        loaded = load_resume_state("old.bin")
+        self.assertEqual((loaded.file_size, loaded.piece_size), (3 * CHUNK_SIZE, CHUNK_SIZE))
+        self.assertEqual(loaded.bitfield.missing(), [0, 2])
+
+    def test_json_progress_migrates_to_sidecar(self):
+        os.makedirs("received")
+        with open(os.path.join("received", "b.bin"), "wb") as f:
+            f.truncate(4 * CHUNK_SIZE)
+        with open(file_manager.progress_file, "w") as f:
+            json.dump({"b.bin": 2 * CHUNK_SIZE + 10}, f)
+        file_manager.load_progress()
+
+        loaded = load_resume_state("b.bin", "received")
+        self.assertEqual(loaded.bitfield.missing(), [2, 3]) # Solo los chunks completos del prefijo
+        self.assertTrue(os.path.exists(resume_state_path("b.bin")))
+        self.assertNotIn("b.bin", file_manager.downloads_progress)
+        self.assertEqual(load_resume_state("b.bin").bitfield.missing(), [2, 3]) # Ahora desde el sidecar
+
+    def test_corrupt_sidecar_is_ignored(self):
+        os.makedirs(file_manager.RESUME_DIR)
+        with open(resume_state_path("c.bin"), "wb") as f:
+            f.write(b"BTR2\x00\x01")
+        self.assertIsNone(load_resume_state("c.bin"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+# bittorrent_project/tests/test_network_utils.py
+import os
+import sys
+import socket
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from network_utils import send_frame, recv_frame, FRAME_HEADER, FRAME_MAGIC, FRAME_JSON, FRAME_DATA
+
+class FrameTest(unittest.TestCase):
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+        self.receiver.settimeout(5)
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def test_round_trip(self):
+        send_frame(self.sender, FRAME_JSON, b'{"status": "success"}')
+        send_frame(self.sender, FRAME_DATA, b"")
+        self.assertEqual(recv_frame(self.receiver), (FRAME_JSON, b'{"status": "success"}'))
+        self.assertEqual(recv_frame(self.receiver), (FRAME_DATA, b""))
+
+    def test_large_payload_arrives_whole(self):
+        payload = os.urandom(3 * 1024 * 1024) # Más que el buffer del socket: llega en muchos recv
+        writer = threading.Thread(target=send_frame, args=(self.sender, FRAME_DATA, payload))
+        writer.start()
+        frame_type, received = recv_frame(self.receiver)
+        writer.join()
+        self.assertEqual(frame_type, FRAME_DATA)
+        self.assertEqual(received, payload)
+
+    def test_header_already_read(self):
+        send_frame(self.sender, FRAME_DATA, b"abc")
+        header = self.receiver.recv(FRAME_HEADER.size, socket.MSG_WAITALL)
+        self.assertEqual(recv_frame(self.receiver, header), (FRAME_DATA, b"abc"))
+
+    def test_invalid_magic(self):
+        self.sender.sendall(FRAME_HEADER.pack(b"X" * len(FRAME_MAGIC), FRAME_DATA, 0))
+        with self.assertRaises(ValueError):
+            recv_frame(self.receiver)
+
+    def test_truncated_payload(self):
+        self.sender.sendall(FRAME_HEADER.pack(FRAME_MAGIC, FRAME_DATA, 10) + b"abc")
+        self.sender.close()
+        with self.assertRaises(ConnectionError):
+            recv_frame(self.receiver)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+# bittorrent_project/tests/test_upload_limiter.py
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import upload_limiter
+from upload_limiter import TokenBucket
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(upload_limiter.time, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_is_free(self):
+        bucket = TokenBucket(1000, burst_seconds=2)
+        self.assertEqual(bucket.reserve(1500), 0.0)
+        self.assertEqual(bucket.reserve(500), 0.0)
+
+    def test_debt_is_paid_at_the_rate(self):
+        bucket = TokenBucket(1000, burst_seconds=1)
+        self.assertAlmostEqual(bucket.reserve(3000), 2.0) # Bloque mayor que la ráfaga
+        self.assertAlmostEqual(bucket.reserve(1000), 3.0) # La deuda se acumula
+        self.now += 3.0
+        self.assertEqual(bucket.reserve(0), 0.0)
+
+    def test_refill_is_capped(self):
+        bucket = TokenBucket(1000, burst_seconds=1)
+        bucket.reserve(1000)
+        self.now += 60
+        self.assertTrue(bucket.is_full(self.now))
+        self.assertAlmostEqual(bucket.reserve(2000), 1.0) # Solo una ráfaga acumulada, no 60 s
+
+    def test_no_rate_does_not_limit(self):
+        bucket = TokenBucket(0)
+        self.assertEqual(bucket.reserve(10 ** 9), 0.0)
+        bucket.set_rate(100)
+        self.assertAlmostEqual(bucket.reserve(300), 3.0) # Sin tokens acumulados al activar el límite
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+# bittorrent_project/tracker_client.py
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from network_utils import send_json, TrackerAnnouncer, CatalogVersions
+
+# Con varios trackers el peer se anuncia a todos en paralelo y las consultas van primero al que
+# respondió más rápido; si falla o tarda más de TRACKER_TIMEOUT, se pasa al siguiente.
+TRACKER_TIMEOUT = 3 # Segundos por intento con cada tracker (en vez de 3 x 15 s con uno solo)
+TRACKER_RETRIES = 1 # Intentos por tracker antes de pasar al siguiente
+ANNOUNCE_RETRIES = 2 # Intentos de cada anuncio (un tracker caído no frena a los demás)
+LATENCY_ALPHA = 0.3 # Peso de la última muestra en la latencia media de cada tracker
+TRACKER_BACKOFF = 5 # Segundos sin anunciarse a un tracker que falló (se duplica con cada fallo seguido)
+MAX_TRACKER_BACKOFF = 60
+
+def parse_trackers(text, default_port=8080):
+    """'ip:puerto,ip:puerto' (el puerto es opcional) -> [(ip, puerto)] sin repetidos."""
+    trackers = []
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        ip, _, port = item.rpartition(":") if ":" in item else (item, "", "")
+        address = (ip, int(port) if port else default_port)
+        if address not in trackers:
+            trackers.append(address)
+    return trackers
+
+class TrackerClient:
+    """
+    Acceso del peer a uno o varios trackers. announce() se anuncia a todos a la vez (cada tracker con su
+    TrackerAnnouncer; comparten la numeración del catálogo) y con cada respuesta mide su latencia.
+    request() consulta los trackers en orden: primero los que no fallaron la última vez, y entre ellos
+    los de menor latencia media. Un tracker que falla se saltea en los anuncios durante un tiempo
+    creciente, para que uno caído no demore cada anuncio (y cada descarga) con sus reintentos.
+    """
+    def __init__(self, trackers, catalog=None):
+        self.trackers = list(trackers)
+        self.versions = CatalogVersions()
+        self.announcers = {address: TrackerAnnouncer(catalog, self.versions, timeout=TRACKER_TIMEOUT, retries=ANNOUNCE_RETRIES)
+                           for address in self.trackers}
+        self.lock = threading.Lock()
+        self.latency = {} # (ip, puerto) -> segundos (media móvil)
+        self.failures = {} # (ip, puerto) -> fallos seguidos
+        self.retry_at = {} # (ip, puerto) -> monotonic desde el que se vuelve a anunciar a un tracker que falló
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(self.trackers)))
+
+    def record(self, address, elapsed):
+        """Registra el resultado de una solicitud a un tracker (elapsed None: falló)."""
+        with self.lock:
+            if elapsed is None:
+                self.failures[address] = self.failures.get(address, 0) + 1
+                backoff = min(MAX_TRACKER_BACKOFF, TRACKER_BACKOFF * 2 ** (self.failures[address] - 1))
+                self.retry_at[address] = time.monotonic() + backoff
+                return
+            self.failures[address] = 0
+            self.retry_at.pop(address, None)
+            previous = self.latency.get(address)
+            self.latency[address] = elapsed if previous is None else LATENCY_ALPHA * elapsed + (1 - LATENCY_ALPHA) * previous
+
+    def ranked(self):
+        """Trackers en el orden en que se consultan."""
+        with self.lock:
+            return sorted(self.trackers, key=lambda address: (self.failures.get(address, 0) > 0,
+                                                              self.latency.get(address, 0.0), self.trackers.index(address)))
+
+    def announce_one(self, address, *args, **kwargs):
+        start = time.monotonic()
+        success = self.announcers[address].announce(address[0], address[1], *args, **kwargs)
+        self.record(address, time.monotonic() - start if success else None)
+        return success
+
+    def announce(self, peer_id, peer_bind_ip, peer_port, shared_dir, received_dir, initial_registration=False, advertised_ip=None, bitfields=None):
+        """Mismos argumentos que TrackerAnnouncer.announce sin el tracker. Retorna True si al menos un tracker quedó al día."""
+        now = time.monotonic()
+        with self.lock:
+            # Si todos están en espera tras fallar, se intenta con todos igual
+            targets = [address for address in self.trackers if self.retry_at.get(address, 0) <= now] or self.trackers
+        futures = [self.executor.submit(self.announce_one, address, peer_id, peer_bind_ip, peer_port, shared_dir, received_dir,
+                                        initial_registration=initial_registration, advertised_ip=advertised_ip, bitfields=bitfields)
+                   for address in targets]
+        results = [future.result() for future in futures]
+        return any(results)
+
+    def request(self, message, is_valid):
+        """Envía 'message' al primer tracker que dé una respuesta válida según is_valid(respuesta). None si ninguno."""
+        for address in self.ranked():
+            start = time.monotonic()
+            response = send_json(address[0], address[1], message, retries=TRACKER_RETRIES, timeout=TRACKER_TIMEOUT)
+            if response is not None and is_valid(response):
+                self.record(address, time.monotonic() - start)
+                return response
+            self.record(address, None)
+            print(f"[TRACKERS] Sin respuesta válida de {address[0]}:{address[1]}. Probando con otro tracker.")
+        return None
+
+    def get_peers_with_file(self, filename):
+        response = self.request({"command": "GET_PEERS_WITH_FILE", "filename": filename},
+                                lambda r: isinstance(r.get("response"), list))
+        return response["response"] if response else []
+
+    def get_network_status(self):
+        response = self.request({"command": "GET_NETWORK_STATUS"}, lambda r: isinstance(r, dict))
+        return response or {}
+
+    def snapshot(self):
+        with self.lock:
+            return {f"{ip}:{port}": {"latency_ms": round(self.latency[(ip, port)] * 1000, 2) if (ip, port) in self.latency else None,
+                                     "failures": self.failures.get((ip, port), 0)} for ip, port in self.trackers}
@@ -0,0 +1,216 @@
+# bittorrent_project/upload_limiter.py
+import time
+import asyncio
+import threading
+from collections import deque
+
+UPLOAD_SLOTS = 8 # Respuestas de datos que el seeder envía a la vez; las demás esperan en cola
+MAX_UPLOAD_QUEUE = 64 # Solicitudes en espera a partir de las que se responde "Upload queue full"
+GLOBAL_UPLOAD_RATE = 0 # Bytes/s de subida en total (0 = sin límite)
+PEER_UPLOAD_RATE = 0 # Bytes/s de subida por peer remoto (IP) (0 = sin límite)
+PEER_BUCKET_IDLE = 60 # Segundos sin uso tras los que se descarta el token bucket (lleno) de un peer
+BURST_SECONDS = 1.0 # Ráfaga que admite cada token bucket, en segundos de su tasa
+STATS_ALPHA = 0.2 # Peso de la última muestra en las medias por conexión
+DELAY_SAMPLES = 1024 # Esperas en cola recientes con las que se calculan los percentiles
+
+class TokenBucket:
+    """
+    Token bucket en bytes. reserve() descuenta los bytes aunque el saldo quede negativo y retorna
+    los segundos que hay que esperar para pagar esa deuda: así un bloque mayor que la ráfaga
+    también respeta la tasa media. Con rate <= 0 no limita.
+    """
+    def __init__(self, rate, burst_seconds=BURST_SECONDS):
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self.tokens = self.capacity()
+        self.updated = time.monotonic()
+
+    def capacity(self):
+        return self.rate * self.burst_seconds
+
+    def is_full(self, now):
+        return self.rate <= 0 or self.tokens + (now - self.updated) * self.rate >= self.capacity()
+
+    def refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.capacity(), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate):
+        self.refill(time.monotonic())
+        self.rate = rate
+        self.tokens = min(self.tokens, self.capacity())
+
+    def reserve(self, num_bytes):
+        if self.rate <= 0:
+            return 0.0
+        self.refill(time.monotonic())
+        self.tokens -= num_bytes
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+def ewma(previous, sample, alpha=STATS_ALPHA):
+    return sample if previous is None else alpha * sample + (1 - alpha) * previous
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+class UploadLimiter:
+    """
+    Control de la subida del seeder: un número fijo de slots de envío con una cola de espera FIFO,
+    y límites de tasa global y por peer (token buckets). Lleva por conexión el throughput y la
+    espera en cola. acquire(), throttle() y release() se llaman desde el event loop del listener;
+    configure() y snapshot() pueden llamarse desde cualquier hilo. Los buckets de peers que no
+    piden nada en PEER_BUCKET_IDLE segundos se descartan.
+    """
+    def __init__(self, slots=UPLOAD_SLOTS, max_queue=MAX_UPLOAD_QUEUE, global_rate=GLOBAL_UPLOAD_RATE, peer_rate=PEER_UPLOAD_RATE):
+        self.lock = threading.Lock()
+        self.slots = slots
+        self.max_queue = max_queue
+        self.peer_rate = peer_rate
+        self.global_bucket = TokenBucket(global_rate)
+        self.peer_buckets = {} # ip -> TokenBucket
+        self.last_prune = time.monotonic()
+        self.active = 0
+        self.waiters = deque() # Futures de las solicitudes en cola, en orden de llegada
+        self.loop = None
+        self.connections = {} # "ip:puerto" -> estadísticas de la conexión
+        self.delays = deque(maxlen=DELAY_SAMPLES)
+        self.totals = {"served": 0, "bytes": 0, "rejected": 0, "throttled_seconds": 0.0}
+
+    def connection(self, addr):
+        key = f"{addr[0]}:{addr[1]}" if addr else "?"
+        stats = self.connections.get(key)
+        if stats is None:
+            stats = {"requests": 0, "bytes": 0, "throughput": None, "queue_delay": None,
+                     "max_queue_delay": 0.0, "throttle_delay": None}
+            self.connections[key] = stats
+        return stats
+
+    def grant_slots(self):
+        """Pasa slots libres a las solicitudes en cola. Se llama con el lock tomado, en el event loop."""
+        while self.active < self.slots and self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.active += 1
+
+    def peer_bucket(self, addr, now):
+        """Token bucket de la IP de 'addr' (creándolo si hace falta). Se llama con el lock tomado."""
+        if not addr:
+            return None
+        if now - self.last_prune >= PEER_BUCKET_IDLE:
+            self.last_prune = now
+            # Un bucket lleno y sin uso se comporta igual que uno nuevo: se puede descartar
+            for ip, bucket in list(self.peer_buckets.items()):
+                if now - bucket.updated >= PEER_BUCKET_IDLE and bucket.is_full(now):
+                    del self.peer_buckets[ip]
+        bucket = self.peer_buckets.get(addr[0])
+        if bucket is None:
+            bucket = self.peer_buckets[addr[0]] = TokenBucket(self.peer_rate)
+        return bucket
+
+    async def acquire(self, addr):
+        """
+        Espera un slot de subida para enviar a 'addr'. Retorna un ticket para throttle() y release(),
+        o None si la cola está llena (el cliente debe pedirlo a otro peer).
+        """
+        self.loop = asyncio.get_running_loop()
+        queued_at = time.monotonic()
+        with self.lock:
+            if self.active < self.slots and not self.waiters:
+                self.active += 1
+                waiter = None
+            elif len(self.waiters) >= self.max_queue:
+                self.totals["rejected"] += 1
+                return None
+            else:
+                waiter = self.loop.create_future()
+                self.waiters.append(waiter)
+        if waiter is not None:
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self.lock:
+                    if waiter in self.waiters:
+                        self.waiters.remove(waiter)
+                    elif not waiter.cancelled():
+                        self.active -= 1 # El slot ya se le había asignado
+                        self.grant_slots()
+                raise
+
+        queue_delay = time.monotonic() - queued_at
+        with self.lock:
+            self.delays.append(queue_delay)
+        return {"addr": addr, "queue_delay": queue_delay, "throttle_delay": 0.0, "started": time.monotonic()}
+
+    async def throttle(self, ticket, num_bytes):
+        """
+        Espera los tokens para enviar 'num_bytes' con el slot del ticket. Se llama con los bytes que
+        realmente se escriben (comprimidos o en base64), justo antes de enviarlos.
+        """
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.peer_bucket(ticket["addr"], now)
+            delay = max(self.global_bucket.reserve(num_bytes), bucket.reserve(num_bytes) if bucket else 0.0)
+            self.totals["throttled_seconds"] += delay
+        ticket["throttle_delay"] += delay
+        if delay > 0:
+            await asyncio.sleep(delay) # Si se cancela, release() del ticket libera el slot
+        ticket["started"] = time.monotonic()
+
+    def release(self, ticket, sent_bytes):
+        """Libera el slot del ticket y registra los bytes enviados (0 si el envío falló)."""
+        elapsed = time.monotonic() - ticket["started"]
+        with self.lock:
+            self.active -= 1
+            self.grant_slots()
+            stats = self.connection(ticket["addr"])
+            stats["requests"] += 1
+            stats["queue_delay"] = ewma(stats["queue_delay"], ticket["queue_delay"])
+            stats["max_queue_delay"] = max(stats["max_queue_delay"], ticket["queue_delay"])
+            stats["throttle_delay"] = ewma(stats["throttle_delay"], ticket["throttle_delay"])
+            if sent_bytes:
+                stats["bytes"] += sent_bytes
+                stats["throughput"] = ewma(stats["throughput"], sent_bytes / max(elapsed + ticket["throttle_delay"], 1e-6))
+                self.totals["served"] += 1
+                self.totals["bytes"] += sent_bytes
+
+    def forget(self, addr):
+        """Descarta las estadísticas de una conexión que se cerró."""
+        with self.lock:
+            self.connections.pop(f"{addr[0]}:{addr[1]}" if addr else "?", None)
+
+    def configure(self, slots=None, global_rate=None, peer_rate=None, max_queue=None):
+        """Cambia los límites en caliente. Los valores None se mantienen."""
+        with self.lock:
+            if slots is not None:
+                self.slots = max(1, slots)
+            if max_queue is not None:
+                self.max_queue = max(0, max_queue)
+            if global_rate is not None:
+                self.global_bucket.set_rate(global_rate)
+            if peer_rate is not None:
+                self.peer_rate = peer_rate
+                for bucket in self.peer_buckets.values():
+                    bucket.set_rate(peer_rate)
+        if self.loop is not None and slots is not None:
+            self.loop.call_soon_threadsafe(self.grant_slots_locked) # Los futures solo se tocan en su event loop
+
+    def grant_slots_locked(self):
+        with self.lock:
+            self.grant_slots()
+
+    def snapshot(self):
+        """Límites, ocupación, totales, percentiles de espera en cola (ms) y estadísticas por conexión."""
+        with self.lock:
+            delays = sorted(self.delays)
+            result = {"slots": self.slots, "active": self.active, "queued": len(self.waiters), "max_queue": self.max_queue,
+                      "global_rate": self.global_bucket.rate, "peer_rate": self.peer_rate, "peer_buckets": len(self.peer_buckets),
+                      **self.totals}
+            result["throttled_seconds"] = round(result["throttled_seconds"], 3)
+            result["queue_delay_ms"] = {name: round(percentile(delays, fraction) * 1000, 2)
+                                        for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))}
+            result["connections"] = {key: dict(stats) for key, stats in self.connections.items()}
+            return result
@@ -0,0 +1,64 @@
+# bittorrent_project/expiry_wheel.py
+import math
+import time
+import threading
+
+class ExpiryWheel:
+    """
+    Rueda de tiempos para expirar peers sin contacto. Cada peer está en el casillero del tick en que
+    vence (último contacto + ttl, redondeado hacia arriba al tick). touch() lo mueve de casillero en O(1)
+    y advance() recorre solo los casilleros ya vencidos. Los tiempos son de time.monotonic(): no les
+    afectan los cambios de hora del sistema.
+    """
+    def __init__(self, ttl, tick=1.0):
+        self.ttl = ttl
+        self.tick = tick
+        self.lock = threading.Lock()
+        self.buckets = {} # tick de vencimiento -> claves que vencen en él
+        self.deadlines = {} # clave -> tick de vencimiento (solo las que siguen vivas)
+        self.last_contact = {} # clave -> monotonic del último contacto (también de las expiradas)
+        self.current = math.floor(time.monotonic() / tick) # Último tick procesado
+
+    def touch(self, key, now=None):
+        """Registra un contacto de 'key' ('now' en monotonic; por defecto, ahora)."""
+        now = time.monotonic() if now is None else now
+        deadline = max(math.ceil((now + self.ttl) / self.tick), self.current + 1)
+        with self.lock:
+            self.last_contact[key] = now
+            old = self.deadlines.get(key)
+            if old == deadline:
+                return
+            if old is not None:
+                bucket = self.buckets.get(old)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self.buckets[old]
+            self.deadlines[key] = deadline
+            self.buckets.setdefault(deadline, set()).add(key)
+
+    def is_alive(self, key):
+        with self.lock:
+            return key in self.deadlines
+
+    def last_seen(self, key):
+        """Monotonic del último contacto de 'key', o None si no se ha visto desde que inició el tracker."""
+        with self.lock:
+            return self.last_contact.get(key)
+
+    def advance(self, now=None):
+        """Procesa los ticks vencidos hasta 'now' y retorna las claves que expiraron."""
+        now_tick = math.floor((time.monotonic() if now is None else now) / self.tick)
+        expired = []
+        with self.lock:
+            if now_tick - self.current > len(self.buckets):
+                # Pausa larga: más rápido revisar los casilleros que existen que cada tick transcurrido
+                ticks = sorted(t for t in self.buckets if t <= now_tick)
+            else:
+                ticks = range(self.current + 1, now_tick + 1)
+            for t in ticks:
+                for key in self.buckets.pop(t, ()):
+                    del self.deadlines[key]
+                    expired.append(key)
+            self.current = max(self.current, now_tick)
+        return expired
@@ -2,9 +2,43 @@
 import os
 import hashlib
 import json # Asegúrate de importar json aquí
+import threading
+import base64
+import struct
+import time
 
-CHUNK_SIZE = 1024 * 512  # 512 KB
+from metrics import METRICS
 
+CHUNK_SIZE = 1024 * 512  # 512 KB: tamaño de pieza de los peers que no anuncian uno (REQUEST_CHUNK)
+
+# Tamaño de pieza por archivo: potencia de dos que deja unas TARGET_PIECES piezas, entre los dos topes.
+# Las piezas se piden en bloques de BLOCK_SIZE (pieza, offset, longitud), varios en vuelo a la vez.
+MIN_PIECE_SIZE = 128 * 1024
+MAX_PIECE_SIZE = 4 * 1024 * 1024
+TARGET_PIECES = 512
+BLOCK_SIZE = 256 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024 # Bloque más grande que se acepta servir
+
+def piece_size_for(file_size):
+    """Tamaño de pieza de un archivo, escalado a su tamaño (archivos pequeños, piezas pequeñas)."""
+    piece_size = MIN_PIECE_SIZE
+    while piece_size < MAX_PIECE_SIZE and file_size > piece_size * TARGET_PIECES:
+        piece_size *= 2
+    return piece_size
+
+def num_pieces(file_size, piece_size):
+    return (file_size + piece_size - 1) // piece_size
+
+def piece_length(file_size, piece_size, piece_index):
+    """Tamaño de una pieza (la última puede ser más corta)."""
+    return max(0, min(piece_size, file_size - piece_index * piece_size))
+
+def piece_blocks(length, block_size=BLOCK_SIZE):
+    """Bloques (offset, longitud) en que se divide una pieza de 'length' bytes."""
+    return [(offset, min(block_size, length - offset)) for offset in range(0, length, block_size)]
+
+# Formato antiguo de progreso: un offset en bytes por archivo dentro de un JSON.
+# Ya no se escribe; solo se lee para migrar las descargas interrumpidas al bitmap de reanudación.
 progress_file = "downloads_progress.json"
 downloads_progress = {} # Diccionario para almacenar el progreso de las descargas
 
@@ -21,13 +55,6 @@ def load_progress():
     else:
         downloads_progress = {}
 
-def save_progress(filename, downloaded_bytes):
-    """Guarda el progreso de un archivo específico."""
-    global downloads_progress
-    downloads_progress[filename] = downloaded_bytes
-    with open(progress_file, "w") as f:
-        json.dump(downloads_progress, f, indent=2)
-
 def get_progress(filename):
     """Retorna los bytes descargados de un archivo, o 0 si no hay progreso."""
     return downloads_progress.get(filename, 0)
@@ -40,6 +67,207 @@ def remove_progress(filename):
         with open(progress_file, "w") as f:
             json.dump(downloads_progress, f, indent=2)
 
+class Bitfield:
+    """Mapa de bits con los chunks que se tienen de un archivo (bit más significativo primero, como BitTorrent)."""
+    def __init__(self, num_chunks, data=None):
+        self.num_chunks = num_chunks
+        self.bits = bytearray(data) if data is not None else bytearray((num_chunks + 7) // 8)
+
+    def set(self, chunk_index):
+        self.bits[chunk_index >> 3] |= 0x80 >> (chunk_index & 7)
+
+    def has(self, chunk_index):
+        return 0 <= chunk_index < self.num_chunks and bool(self.bits[chunk_index >> 3] & (0x80 >> (chunk_index & 7)))
+
+    def count(self):
+        return sum(bin(byte).count("1") for byte in self.bits)
+
+    def is_complete(self):
+        return self.count() == self.num_chunks
+
+    def missing(self):
+        return [i for i in range(self.num_chunks) if not self.has(i)]
+
+    def has_range(self, piece_size, offset, length):
+        """True si se tienen todas las piezas que cubren los bytes [offset, offset + length)."""
+        if length <= 0:
+            return False
+        return all(self.has(i) for i in range(offset // piece_size, (offset + length - 1) // piece_size + 1))
+
+    def to_dict(self):
+        """Forma compacta para JSON: número de chunks y bits en base64."""
+        return {"num_chunks": self.num_chunks, "bits": base64.b64encode(bytes(self.bits)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Inverso de to_dict. ValueError si los bits no corresponden al número de chunks."""
+        num_chunks = int(data["num_chunks"])
+        bits = base64.b64decode(data["bits"])
+        if num_chunks < 0 or len(bits) != (num_chunks + 7) // 8:
+            raise ValueError(f"Bitfield de {len(bits)} bytes para {num_chunks} chunks")
+        return cls(num_chunks, bits)
+
+# --- ESTADO DE REANUDACIÓN (BITMAP POR ARCHIVO) ---
+# Cada descarga en curso guarda un bitmap de chunks en un archivo sidecar dentro de RESUME_DIR.
+# Se escribe por lotes (cada FLUSH_EVERY_CHUNKS chunks o FLUSH_INTERVAL segundos) con un renombrado atómico.
+RESUME_DIR = "resume_state"
+RESUME_HEADER = struct.Struct("!4sQII") # magic, tamaño del archivo, número de piezas, tamaño de pieza
+RESUME_MAGIC = b"BTR2"
+LEGACY_RESUME_HEADER = struct.Struct("!4sQI") # Formato anterior, siempre con piezas de CHUNK_SIZE
+LEGACY_RESUME_MAGIC = b"BTRS"
+FLUSH_EVERY_CHUNKS = 32
+FLUSH_INTERVAL = 2.0
+
+def resume_state_path(filename):
+    return os.path.join(RESUME_DIR, filename + ".bitmap")
+
+class ResumeState:
+    """Bitmap de piezas descargadas (y verificadas) de un archivo, persistido en su sidecar."""
+    def __init__(self, filename, file_size, bitfield=None, piece_size=CHUNK_SIZE):
+        self.filename = filename
+        self.file_size = file_size
+        self.piece_size = piece_size
+        self.bitfield = bitfield or Bitfield(num_pieces(file_size, piece_size))
+        self.pending_marks = 0 # Chunks marcados desde la última escritura del sidecar
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    def mark(self, chunk_index):
+        """Marca un chunk como descargado. El sidecar se reescribe por lotes, no en cada chunk."""
+        with self.lock:
+            self.bitfield.set(chunk_index)
+            self.pending_marks += 1
+            due = self.pending_marks >= FLUSH_EVERY_CHUNKS or time.monotonic() - self.last_flush >= FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def with_piece_size(self, piece_size):
+        """
+        Estado equivalente con otro tamaño de pieza: se marcan las piezas nuevas cubiertas por
+        completo por piezas que ya se tenían (conviene verificarlas luego contra el manifiesto).
+        """
+        bitfield = Bitfield(num_pieces(self.file_size, piece_size))
+        for piece_index in range(bitfield.num_chunks):
+            length = piece_length(self.file_size, piece_size, piece_index)
+            if self.bitfield.has_range(self.piece_size, piece_index * piece_size, length):
+                bitfield.set(piece_index)
+        return ResumeState(self.filename, self.file_size, bitfield, piece_size)
+
+    def flush(self):
+        """Escribe el bitmap en un archivo temporal y lo renombra sobre el sidecar (nunca queda a medias)."""
+        with self.lock, METRICS.timer("bt_save_progress_seconds"):
+            data = RESUME_HEADER.pack(RESUME_MAGIC, self.file_size, self.bitfield.num_chunks, self.piece_size) + bytes(self.bitfield.bits)
+            self.pending_marks = 0
+            self.last_flush = time.monotonic()
+            os.makedirs(RESUME_DIR, exist_ok=True)
+            path = resume_state_path(self.filename)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+def load_resume_state(filename, received_dir=None):
+    """
+    Carga el estado de reanudación de un archivo, o None si no hay una descarga interrumpida.
+    Si solo existe progreso en el formato JSON antiguo, lo convierte en bitmap (el prefijo descargado)
+    usando el tamaño del archivo preasignado en 'received_dir'.
+    """
+    path = resume_state_path(filename)
+    if os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            if data[:4] == LEGACY_RESUME_MAGIC:
+                magic, file_size, num_chunks = LEGACY_RESUME_HEADER.unpack_from(data)
+                piece_size, bits = CHUNK_SIZE, data[LEGACY_RESUME_HEADER.size:]
+            else:
+                magic, file_size, num_chunks, piece_size = RESUME_HEADER.unpack_from(data)
+                bits = data[RESUME_HEADER.size:]
+            if magic not in (RESUME_MAGIC, LEGACY_RESUME_MAGIC) or len(bits) != (num_chunks + 7) // 8 or piece_size <= 0:
+                raise ValueError("sidecar inválido")
+            return ResumeState(filename, file_size, Bitfield(num_chunks, bits), piece_size)
+        except (OSError, struct.error, ValueError):
+            print(f"[FILE_MANAGER] Advertencia: estado de reanudación de '{filename}' corrupto. Se ignorará.")
+            return None
+
+    if filename in downloads_progress and received_dir is not None:
+        filepath = os.path.join(received_dir, filename)
+        if os.path.exists(filepath):
+            state = ResumeState(filename, os.path.getsize(filepath))
+            for chunk_index in range(min(get_progress(filename), state.file_size) // CHUNK_SIZE):
+                state.bitfield.set(chunk_index)
+            state.flush()
+            remove_progress(filename)
+            return state
+    return None
+
+def has_resume_state(filename):
+    """Indica si hay una descarga en curso o interrumpida (sidecar o progreso antiguo) para el archivo."""
+    return os.path.exists(resume_state_path(filename)) or filename in downloads_progress
+
+def resume_state_filenames():
+    """Archivos con una descarga en curso o interrumpida."""
+    filenames = set(downloads_progress)
+    if os.path.isdir(RESUME_DIR):
+        filenames.update(f[:-len(".bitmap")] for f in os.listdir(RESUME_DIR) if f.endswith(".bitmap"))
+    return list(filenames)
+
+def remove_resume_state(filename):
+    """Elimina el estado de reanudación de un archivo (descarga completada o reiniciada)."""
+    path = resume_state_path(filename)
+    if os.path.exists(path):
+        os.remove(path)
+    remove_progress(filename)
+
+def preallocate_file(filepath, file_size):
+    """Crea (o ajusta) el archivo con su tamaño final para poder escribir cada chunk en su offset."""
+    mode = "r+b" if os.path.exists(filepath) else "wb"
+    with open(filepath, mode) as f:
+        f.truncate(file_size)
+
+write_lock = threading.Lock() # Solo se usa donde no existen os.pwrite/os.pread (Windows)
+
+def write_at(fd, offset, data):
+    """Escritura posicional: escribe 'data' en 'offset' sin depender de un puntero de archivo compartido."""
+    view = memoryview(data)
+    if hasattr(os, "pwrite"):
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+    else:
+        with write_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+
+def read_at(fd, offset, size):
+    """Lectura posicional: lee hasta 'size' bytes desde 'offset' sin mover un puntero de archivo compartido."""
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    with write_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+def read_chunk(filepath, chunk_index):
+    """Lee un chunk del archivo (bloqueante: el servidor lo ejecuta en su executor de disco)."""
+    with open(filepath, "rb") as f:
+        f.seek(chunk_index * CHUNK_SIZE)
+        return f.read(CHUNK_SIZE)
+
+def open_chunk(filepath, chunk_index):
+    """
+    Abre el archivo para enviar un chunk con sendfile. Retorna (archivo, offset, longitud);
+    la longitud es 0 si el chunk está fuera de rango. Quien llama debe cerrar el archivo.
+    """
+    f = open(filepath, "rb")
+    offset = chunk_index * CHUNK_SIZE
+    length = max(0, min(CHUNK_SIZE, os.fstat(f.fileno()).st_size - offset))
+    return f, offset, length
+
 def split_file(filepath, output_dir):
     os.makedirs(output_dir, exist_ok=True)
     filename = os.path.basename(filepath)
@@ -66,6 +294,66 @@ def join_chunks(chunk_files, output_filepath):
                 print(f"[FILE_MANAGER] Advertencia: Chunk no encontrado para unir: {chunk}")
 
 
+# --- MANIFIESTO DE HASHES POR CHUNK ---
+HASH_ALGORITHM = "sha256"
+
+manifest_cache = {} # filepath -> (tamaño, mtime, manifiesto)
+manifest_lock = threading.Lock()
+
+def chunk_digest(data):
+    """Hash hexadecimal de un chunk."""
+    return hashlib.new(HASH_ALGORITHM, data).hexdigest()
+
+def manifest_root(chunk_hashes):
+    """Hash raíz del archivo: hash de la concatenación de los hashes binarios de todos los chunks."""
+    root = hashlib.new(HASH_ALGORITHM)
+    for chunk_hash in chunk_hashes:
+        root.update(bytes.fromhex(chunk_hash))
+    return root.hexdigest()
+
+def compute_manifest(filepath, piece_size=None):
+    """Lee el archivo pieza a pieza y retorna su manifiesto (hash de cada pieza y hash raíz)."""
+    if piece_size is None:
+        piece_size = piece_size_for(os.path.getsize(filepath))
+    chunk_hashes = []
+    with open(filepath, "rb") as f:
+        while chunk := f.read(piece_size):
+            chunk_hashes.append(chunk_digest(chunk))
+    return {
+        "algorithm": HASH_ALGORITHM,
+        "chunk_size": piece_size,
+        "chunk_hashes": chunk_hashes,
+        "root_hash": manifest_root(chunk_hashes)
+    }
+
+def get_manifest(filepath):
+    """Retorna el manifiesto del archivo, recalculándolo solo si cambió su tamaño o fecha de modificación."""
+    stat = os.stat(filepath)
+    with manifest_lock:
+        cached = manifest_cache.get(filepath)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+    manifest = compute_manifest(filepath, piece_size_for(stat.st_size))
+    with manifest_lock:
+        manifest_cache[filepath] = (stat.st_size, stat.st_mtime_ns, manifest)
+    return manifest
+
+def is_valid_manifest(manifest, file_size, piece_size=CHUNK_SIZE):
+    """Comprueba que el manifiesto recibido de un peer sea coherente con el tamaño del archivo, la pieza y su hash raíz."""
+    try:
+        if manifest.get("algorithm") != HASH_ALGORITHM or manifest.get("chunk_size") != piece_size:
+            return False
+        chunk_hashes = manifest["chunk_hashes"]
+        if len(chunk_hashes) != num_pieces(file_size, piece_size):
+            return False
+        return manifest_root(chunk_hashes) == manifest["root_hash"]
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return False
+
+def verify_chunk(manifest, chunk_index, data):
+    """Verifica un chunk recibido contra el hash del manifiesto."""
+    return chunk_digest(data) == manifest["chunk_hashes"][chunk_index]
+
 def get_file_hash(filepath):
     hash_md5 = hashlib.md5()
     with open(filepath, "rb") as f:
@@ -0,0 +1,155 @@
+# bittorrent_project/metrics.py
+import time
+import bisect
+import threading
+
+# Contadores e histogramas en memoria, compartidos por todo el proceso (peer o tracker).
+# Cada operación es una suma bajo un lock, así que pueden quedar siempre activos. Se consultan con
+# el comando GET_METRICS (JSON) o, si se inicia, por HTTP en formato de texto de Prometheus.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_HTTP_PATH = "/metrics"
+
+# Nombre -> (tipo, descripción). Las métricas no declaradas se exportan como 'untyped'.
+DESCRIPTIONS = {
+    "bt_connections_active": ("gauge", "Conexiones entrantes abiertas en el listener"),
+    "bt_connections_total": ("counter", "Conexiones entrantes aceptadas"),
+    "bt_send_json_retries_total": ("counter", "Reintentos de send_json por timeout o conexión rechazada"),
+    "bt_block_request_seconds": ("histogram", "Latencia de cada solicitud de bloque o chunk, por peer"),
+    "bt_received_bytes_total": ("counter", "Bytes de datos recibidos (por la red), por peer"),
+    "bt_served_bytes_total": ("counter", "Bytes de datos enviados, por peer"),
+    "bt_block_failures_total": ("counter", "Bloques o chunks que fallaron (error, corrupción o cancelación), por peer"),
+    "bt_peer_timeouts_total": ("counter", "Timeouts de sesión con peers remotos, por peer"),
+    "bt_piece_retries_total": ("counter", "Piezas que volvieron a la cola para pedirse de nuevo"),
+    "bt_save_progress_seconds": ("histogram", "Duración de cada escritura del sidecar de reanudación"),
+    "bt_tracker_request_seconds": ("histogram", "Tiempo de atención de cada solicitud del tracker, por comando"),
+    "bt_tracker_save_log_seconds": ("histogram", "Duración de save_log (encolar el cambio de un peer)"),
+    "bt_tracker_journal_write_seconds": ("histogram", "Duración de cada escritura de un lote en el journal"),
+    "bt_tracker_snapshot_seconds": ("histogram", "Duración de cada snapshot completo del estado del tracker"),
+}
+
+def label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+class Metrics:
+    """Registro de contadores (también usados como gauges) e histogramas con etiquetas."""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {} # (nombre, etiquetas) -> valor
+        self.histograms = {} # (nombre, etiquetas) -> [cuentas por bucket..., suma, cantidad]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, label_key(labels))
+        index = bisect.bisect_left(self.buckets, value) # Primer bucket con límite >= value
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.buckets) + 3)
+            histogram[index] += 1 # El último bucket es +Inf
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def timer(self, name, **labels):
+        """Context manager que registra en el histograma 'name' los segundos que tarda el bloque."""
+        return Timer(self, name, labels)
+
+    def snapshot(self):
+        """Copia en JSON: contadores como {"nombre": {"etiquetas": valor}} e histogramas con count, sum y buckets."""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(values) for key, values in self.histograms.items()}
+        result = {"counters": {}, "histograms": {}}
+        for (name, labels), value in counters.items():
+            result["counters"].setdefault(name, {})[format_labels(labels) or "total"] = value
+        for (name, labels), values in histograms.items():
+            cumulative, buckets = 0, {}
+            for bound, count in zip(list(self.buckets) + ["+Inf"], values):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            result["histograms"].setdefault(name, {})[format_labels(labels) or "total"] = {
+                "count": values[-1], "sum": round(values[-2], 6), "buckets": buckets}
+        return result
+
+    def prometheus(self):
+        """Todas las métricas en el formato de texto de Prometheus."""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(values)) for key, values in self.histograms.items())
+        lines = []
+        described = set()
+        def header(name, default_type):
+            if name not in described:
+                described.add(name)
+                metric_type, description = DESCRIPTIONS.get(name, (default_type, ""))
+                if description:
+                    lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {metric_type}")
+        for (name, labels), value in counters:
+            header(name, "untyped")
+            lines.append(f"{name}{prometheus_labels(labels)} {value}")
+        for (name, labels), values in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ["+Inf"], values):
+                cumulative += count
+                lines.append(f"{name}_bucket{prometheus_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{prometheus_labels(labels)} {values[-2]}")
+            lines.append(f"{name}_count{prometheus_labels(labels)} {values[-1]}")
+        return "\n".join(lines) + "\n"
+
+class Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+def format_labels(labels):
+    return ",".join(f"{key}={value}" for key, value in labels)
+
+def prometheus_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+METRICS = Metrics() # Registro del proceso
+
+def start_metrics_http(ip, port, metrics=METRICS):
+    """
+    Sirve las métricas en http://ip:puerto/metrics (formato Prometheus) en un hilo daemon.
+    Pensado para 127.0.0.1: no tiene autenticación. Retorna el servidor (server.shutdown() lo detiene).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer # Solo si se pide el endpoint (arranque rápido)
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != METRICS_HTTP_PATH:
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Sin una línea por cada scrape
+
+    server = ThreadingHTTPServer((ip, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[METRICS] Métricas en http://{ip}:{port}{METRICS_HTTP_PATH}")
+    return server
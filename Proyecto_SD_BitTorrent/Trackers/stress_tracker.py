@@ -0,0 +1,97 @@
+# bittorrent_project/stress_tracker.py
+"""
+Prueba de carga del tracker con catálogos enormes. Registra peers que anuncian muchos archivos
+(por defecto 100k cada uno), aplica un delta, consulta GET_PEERS_WITH_FILE y GET_NETWORK_STATUS,
+y comprueba que las respuestas sean correctas. También envía REGISTER de unos cientos de archivos
+partidos en varios segmentos TCP, en JSON plano y enmarcados. El tracker debe estar corriendo.
+
+Uso: python stress_tracker.py [ip] [puerto] [archivos_por_peer] [peers]
+"""
+import sys
+import json
+import time
+import socket
+
+from network_utils import send_json, recv_until_close, FRAME_HEADER, FRAME_MAGIC, FRAME_JSON
+
+SPLIT_FILES = 300 # Archivos del REGISTER que se envía partido en segmentos
+SPLIT_SEGMENTS = 4
+SPLIT_PAUSE = 0.05 # Segundos entre segmentos, para que el tracker los reciba por separado
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"[STRESS] {label}: {time.perf_counter() - start:.3f} s")
+    return result
+
+def send_split(tracker_ip, tracker_port, data, segments=SPLIT_SEGMENTS):
+    """Envía 'data' en varios segmentos TCP separados por pausas y retorna la respuesta decodificada (o None)."""
+    try:
+        with socket.create_connection((tracker_ip, tracker_port), timeout=30) as s:
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            step = -(-len(data) // segments)
+            for start in range(0, len(data), step):
+                s.sendall(data[start:start + step])
+                time.sleep(SPLIT_PAUSE)
+            return json.loads(recv_until_close(s).decode())
+    except (OSError, ValueError): # El tracker cerró antes de recibirlo todo o respondió algo inválido
+        return None
+
+def main():
+    tracker_ip = sys.argv[1] if len(sys.argv) > 1 else "127.0.0.1"
+    tracker_port = int(sys.argv[2]) if len(sys.argv) > 2 else 8080
+    num_files = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+    num_peers = int(sys.argv[4]) if len(sys.argv) > 4 else 2
+    failures = 0
+
+    def check(condition, message):
+        nonlocal failures
+        if not condition:
+            failures += 1
+            print(f"[STRESS] FALLO: {message}")
+
+    for p in range(num_peers):
+        peer_id = f"stress-{p}"
+        files = [f"stress_{p}_{i:06d}.bin" for i in range(num_files)] + ["stress_common.bin"]
+        message = {"command": "REGISTER", "peer_id": peer_id, "ip": "127.0.0.1", "port": 20000 + p,
+                   "files": files, "bitfields": {}, "version": 1, "status": "activo"}
+        size_mb = len(json.dumps(message)) / (1024 * 1024)
+        response = timed(f"REGISTER de {peer_id} ({num_files} archivos, {size_mb:.1f} MB)",
+                         lambda: send_json(tracker_ip, tracker_port, message, timeout=120))
+        check(response and response.get("response") == "REGISTERED", f"REGISTER de {peer_id}: {response}")
+
+    for framed in (False, True):
+        peer_id = f"stress-split-{'frame' if framed else 'plain'}"
+        message = {"command": "REGISTER", "peer_id": peer_id, "ip": "127.0.0.1", "port": 21000 + framed,
+                   "files": [f"{peer_id}_{i:04d}.bin" for i in range(SPLIT_FILES)], "bitfields": {}, "version": 1}
+        payload = json.dumps(message).encode()
+        data = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_JSON, len(payload)) + payload if framed else payload
+        response = timed(f"REGISTER partido en {SPLIT_SEGMENTS} segmentos ({len(data)} bytes, {'enmarcado' if framed else 'JSON plano'})",
+                         lambda: send_split(tracker_ip, tracker_port, data))
+        check(response and response.get("response") == "REGISTERED", f"REGISTER partido de {peer_id}: {response}")
+        holders = send_json(tracker_ip, tracker_port, {"command": "GET_PEERS_WITH_FILE", "filename": f"{peer_id}_{SPLIT_FILES - 1:04d}.bin"})
+        check(holders and [p["peer_id"] for p in holders.get("response", [])] == [peer_id], f"{peer_id} no quedó indexado: {holders}")
+
+    delta = {"command": "UPDATE_DELTA", "peer_id": "stress-0", "base_version": 1, "version": 2,
+             "added": ["stress_added.bin"], "removed": ["stress_0_000000.bin"], "bitfields": {}, "bitfields_removed": []}
+    response = timed("UPDATE_DELTA", lambda: send_json(tracker_ip, tracker_port, delta))
+    check(response and response.get("response") == "DELTA_APPLIED", f"UPDATE_DELTA: {response}")
+
+    holders = timed("GET_PEERS_WITH_FILE (archivo común)",
+                    lambda: send_json(tracker_ip, tracker_port, {"command": "GET_PEERS_WITH_FILE", "filename": "stress_common.bin"}))
+    stress_holders = [p for p in (holders or {}).get("response", []) if p["peer_id"].startswith("stress-")]
+    check(len(stress_holders) == num_peers, f"GET_PEERS_WITH_FILE devolvió {len(stress_holders)} de {num_peers} peers")
+    removed = send_json(tracker_ip, tracker_port, {"command": "GET_PEERS_WITH_FILE", "filename": "stress_0_000000.bin"})
+    check(removed is not None and not removed.get("response"), "el archivo quitado por el delta sigue indexado")
+
+    status = timed("GET_NETWORK_STATUS (respuesta por partes)",
+                   lambda: send_json(tracker_ip, tracker_port, {"command": "GET_NETWORK_STATUS"}, timeout=120))
+    for p in range(num_peers):
+        files = (status or {}).get(f"stress-{p}", {}).get("files", [])
+        check(len(files) == num_files + 1, f"stress-{p} tiene {len(files)} archivos en GET_NETWORK_STATUS")
+
+    print(f"[STRESS] {'OK' if failures == 0 else f'{failures} fallos'}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# bittorrent_project/tests/test_expiry_wheel.py
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from expiry_wheel import ExpiryWheel
+
+class ExpiryWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.wheel = ExpiryWheel(ttl=30, tick=1)
+        self.start = self.wheel.current # Tiempos relativos al tick inicial de la rueda
+
+    def test_expires_after_ttl(self):
+        self.wheel.touch("a", now=self.start + 0.5)
+        self.assertEqual(self.wheel.advance(now=self.start + 30), [])
+        self.assertEqual(self.wheel.advance(now=self.start + 31), ["a"])
+        self.assertFalse(self.wheel.is_alive("a"))
+        self.assertEqual(self.wheel.last_seen("a"), self.start + 0.5) # Se recuerda aun expirado
+
+    def test_touch_postpones_expiry(self):
+        self.wheel.touch("a", now=self.start + 1)
+        self.wheel.touch("a", now=self.start + 20)
+        self.assertEqual(self.wheel.advance(now=self.start + 40), [])
+        self.assertTrue(self.wheel.is_alive("a"))
+        self.assertEqual(self.wheel.advance(now=self.start + 50), ["a"])
+        self.assertEqual(self.wheel.buckets, {})
+
+    def test_long_pause_expires_everything_due(self):
+        self.wheel.touch("a", now=self.start + 1)
+        self.wheel.touch("b", now=self.start + 2)
+        self.wheel.touch("c", now=self.start + 100)
+        self.assertEqual(sorted(self.wheel.advance(now=self.start + 10 ** 6)), ["a", "b", "c"])
+        self.assertEqual(self.wheel.advance(now=self.start + 10 ** 6 + 1), [])
+
+    def test_old_contact_still_waits_for_next_tick(self):
+        self.wheel.advance(now=self.start + 100)
+        self.wheel.touch("a", now=self.start) # Contacto de hace más de ttl (p.ej. cargado del log)
+        self.assertTrue(self.wheel.is_alive("a"))
+        self.assertEqual(self.wheel.advance(now=self.start + 101), ["a"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,20 +1,369 @@
 # bittorrent_project/tracker.py
-import socket
+import asyncio
 import threading
 import json
 import time
 import os
-from datetime import datetime
+import random
 
-TRACKER_IP = '172.31.87.191'
-TRACKER_PORT = 8080
+from network_utils import start_listener, send_json, MessageTooLarge
+from tracker_store import TrackerStore
+from expiry_wheel import ExpiryWheel
+from metrics import METRICS, start_metrics_http
+
+TRACKER_IP = os.environ.get("BT_TRACKER_IP", '172.31.87.191') # Variables de entorno: p.ej. el tracker local de benchmark_swarm.py
+TRACKER_PORT = int(os.environ.get("BT_TRACKER_PORT", 8080))
+MAX_MESSAGE_SIZE = 32 * 1024 * 1024 # Tamaño máximo de una solicitud (p.ej. el REGISTER de un catálogo enorme)
+PEER_TTL = 30 # Segundos sin contacto tras los que un peer pasa a inactivo y sale del índice
+EXPIRY_TICK = 1 # Resolución (segundos) de la rueda de expiración
+STATUS_INTERVAL = 60 # Segundos entre impresiones del estado de la red
+LAST_SEEN_FORMAT = "%Y-%m-%d %H:%M:%S"
+METRICS_HTTP_PORT = int(os.environ.get("BT_METRICS_PORT", 0)) # 0: sin endpoint HTTP (GET_METRICS sigue disponible)
+# Comandos con su propia etiqueta en las métricas; el resto se cuenta como "unknown"
+KNOWN_COMMANDS = {"REGISTER", "UPDATE_FILES", "UPDATE_DELTA", "GET_PEERS_WITH_FILE", "GET_NETWORK_STATUS", "PING", "GET_METRICS", "GOSSIP"}
+# Réplica entre trackers: cada tracker envía a otros los peers que cambiaron (gossip) para que
+# cualquiera pueda responder GET_PEERS_WITH_FILE. Los trackers conocidos salen de BT_TRACKER_PEERS
+# ("ip:puerto,ip:puerto") y de los que le escriban desde su propia IP: de estos se aceptan a lo sumo
+# MAX_LEARNED_TRACKERS y se olvidan tras GOSSIP_MAX_FAILURES intentos seguidos sin respuesta. El gossip solo lleva la versión del catálogo y
+# el último contacto de cada peer; los archivos viajan cuando el otro tracker tiene una versión vieja.
+GOSSIP_INTERVAL = 1 # Segundos entre rondas de gossip con los cambios recientes
+GOSSIP_FANOUT = 2 # Trackers a los que se envía cada ronda (los que los reciben los reenvían)
+FULL_SYNC_INTERVAL = 30 # Segundos entre intercambios del estado completo con todos los trackers
+GOSSIP_TIMEOUT = 3 # Segundos por intento con otro tracker
+MAX_LEARNED_TRACKERS = 8 # Trackers aprendidos de mensajes GOSSIP (además de los de BT_TRACKER_PEERS)
+GOSSIP_MAX_FAILURES = 3 # Intentos seguidos sin respuesta tras los que se olvida un tracker aprendido
+
+def parse_tracker_peers(text):
+    """'ip:puerto,ip:puerto' -> [(ip, puerto)] sin repetidos ni el propio tracker."""
+    trackers = []
+    for item in text.split(","):
+        ip, _, port = item.strip().rpartition(":")
+        if ip and port and (ip, int(port)) != (TRACKER_IP, TRACKER_PORT) and (ip, int(port)) not in trackers:
+            trackers.append((ip, int(port)))
+    return trackers
+
+tracker_peers = parse_tracker_peers(os.environ.get("BT_TRACKER_PEERS", ""))
+configured_trackers = set(tracker_peers) # Nunca se olvidan, aunque no respondan
+gossip_lock = threading.Lock()
+dirty_peers = set() # peer_ids que cambiaron desde la última ronda de gossip
 
 peers = {}
+peers_lock = threading.Lock() # Los handlers, el hilo de expiración y el de gossip modifican 'peers'
 log_file = "tracker_log.json"
+journal_file = "tracker_journal.log"
+
+# Último contacto de cada peer en tiempo monotónico. La fecha legible ('last_seen') solo se genera
+# al mostrar o persistir el estado, no en cada heartbeat.
+expiry = ExpiryWheel(PEER_TTL, EXPIRY_TICK)
+
+def last_seen_string(peer_id, info):
+    last = expiry.last_seen(peer_id)
+    if last is None:
+        return info.get("last_seen") # Sin contacto desde que inició el tracker: la fecha del log
+    return time.strftime(LAST_SEEN_FORMAT, time.localtime(time.time() - (time.monotonic() - last)))
+
+def peer_view(peer_id, info):
+    """Copia de un peer para mostrar o persistir, con 'last_seen' como fecha legible."""
+    view = dict(info)
+    view["last_seen"] = last_seen_string(peer_id, info)
+    return view
+
+store = TrackerStore(log_file, journal_file, view=peer_view) # Journal + snapshots en segundo plano
+
+# Índice invertido: nombre de archivo -> peer_ids activos que lo tienen.
+# Se actualiza con cada cambio para que GET_PEERS_WITH_FILE no recorra toda la red.
+file_index = {}
+indexed_files = {} # peer_id -> archivos con los que está en el índice
+index_lock = threading.Lock() # El hilo de print_status también modifica el índice
+
+def save_log(peer_id):
+    """Encola el estado actual de un peer para el journal (sin escribir en disco aquí)."""
+    info = peers.get(peer_id)
+    with METRICS.timer("bt_tracker_save_log_seconds"):
+        store.record(peer_id, peer_view(peer_id, info) if info is not None else None)
+
+def mark_dirty(peer_id):
+    """Anota un peer para enviarlo a los demás trackers en la próxima ronda de gossip."""
+    if tracker_peers:
+        with gossip_lock:
+            dirty_peers.add(peer_id)
+
+def catalog_key(entry):
+    """(session, version) del catálogo de un peer: el mayor es el más nuevo."""
+    return (entry.get("session") or 0, entry.get("version") or 0)
+
+def gossip_entries(peer_ids, now, catalogs=False):
+    """
+    Resumen de cada peer conocido de 'peer_ids' para otro tracker: versión del catálogo y 'age'
+    (segundos desde el último contacto, None si no hubo). Con catalogs=True, también ip, puerto,
+    archivos y bitfields.
+    """
+    entries = {}
+    with peers_lock: # Una vez por lote: las listas de archivos no se copian (los handlers las reemplazan, no las modifican)
+        for peer_id in peer_ids:
+            info = peers.get(peer_id)
+            if info is None:
+                continue
+            last = expiry.last_seen(peer_id)
+            entry = {"session": info.get("session"), "version": info.get("version"), "age": None if last is None else now - last}
+            if catalogs:
+                entry.update(ip=info["ip"], port=info["port"], files=info["files"], bitfields=info.get("bitfields", {}))
+            entries[peer_id] = entry
+    return entries
+
+def touch_from_gossip(peer_id, info, age, now):
+    """
+    Adopta el último contacto que vio otro tracker si es más reciente que el propio. Se llama con
+    peers_lock tomado; retorna True si lo adoptó (hay que reenviarlo y, si se reactivó, reindexarlo).
+    La expiración sigue siendo local: cada tracker marca inactivos a los peers de los que nadie supo en PEER_TTL.
+    """
+    if age is None or age >= PEER_TTL:
+        return False
+    last = expiry.last_seen(peer_id)
+    if last is not None and now - age <= last + EXPIRY_TICK:
+        return False
+    expiry.touch(peer_id, now=now - age)
+    if info["status"] != "activo":
+        info["status"] = "activo"
+        save_log(peer_id)
+    return True
+
+def merge_summaries(summaries):
+    """
+    Aplica los resúmenes de otro tracker (los contactos más recientes que los propios) y retorna los
+    peer_ids de los que ese tracker tiene un catálogo más nuevo o desconocido, para pedírselos.
+    """
+    now = time.monotonic()
+    wanted = []
+    touched = []
+    with peers_lock:
+        for peer_id, summary in summaries.items():
+            info = peers.get(peer_id)
+            if info is None or catalog_key(summary) > catalog_key(info):
+                wanted.append(peer_id)
+            if info is not None and touch_from_gossip(peer_id, info, summary.get("age"), now):
+                touched.append(peer_id)
+    for peer_id in touched: # Fuera de peers_lock: el diff del índice puede ser largo
+        reindex_peer(peer_id)
+        mark_dirty(peer_id) # Para que el contacto llegue también a los trackers que este conoce
+    return wanted
+
+def merge_catalogs(catalogs):
+    """Incorpora los catálogos completos que envió otro tracker, si son más nuevos que los propios."""
+    now = time.monotonic()
+    changed = []
+    with peers_lock:
+        for peer_id, entry in catalogs.items():
+            info = peers.get(peer_id)
+            updated = info is None or catalog_key(entry) > catalog_key(info)
+            if updated:
+                info = peers[peer_id] = {
+                    "ip": entry["ip"],
+                    "port": entry["port"],
+                    "files": entry["files"],
+                    "bitfields": entry.get("bitfields", {}),
+                    "version": entry.get("version"),
+                    "session": entry.get("session"),
+                    "status": info["status"] if info is not None else "inactivo"
+                }
+                save_log(peer_id)
+            if touch_from_gossip(peer_id, info, entry.get("age"), now) or updated:
+                changed.append(peer_id)
+    for peer_id in changed:
+        reindex_peer(peer_id)
+        mark_dirty(peer_id)
+
+def gossip_reply(message, addr):
+    """Atiende un GOSSIP de otro tracker y retorna la respuesta. Fuera del event loop: toma peers_lock e index_lock."""
+    learn_tracker(message.get("from"), addr[0] if addr else None)
+    merge_catalogs(message.get("catalogs", {}))
+    # 'want': peers de los que el otro tracker tiene un catálogo más nuevo; los enviará en otro mensaje
+    response = {"response": "GOSSIP_OK", "framing": True, "want": merge_summaries(message.get("peers", {}))}
+    now = time.monotonic()
+    if message.get("want"):
+        response["catalogs"] = gossip_entries(message["want"], now, catalogs=True)
+    if message.get("pull"):
+        # Intercambio completo: se responde con los resúmenes propios para que el otro también se ponga al día
+        response["peers"] = gossip_entries(list(peers), now)
+    return response
+
+def learn_tracker(address, source_ip):
+    """
+    Agrega un tracker que se anunció con 'ip:puerto' a los conocidos. Solo si la IP es la de la conexión
+    (nadie puede hacer que se envíe el estado a un tercero) y quedan lugares para trackers aprendidos.
+    """
+    ip, _, port = (address or "").rpartition(":")
+    if not ip or not port.isdigit() or ip != source_ip:
+        return
+    with gossip_lock:
+        if (ip, int(port)) == (TRACKER_IP, TRACKER_PORT) or (ip, int(port)) in tracker_peers:
+            return
+        if len(tracker_peers) - len(configured_trackers) >= MAX_LEARNED_TRACKERS:
+            return
+        tracker_peers.append((ip, int(port)))
+    print(f"[TRACKER] Nuevo tracker conocido: {ip}:{port}.")
+
+def forget_tracker(address):
+    """Quita de los conocidos a un tracker aprendido (los de BT_TRACKER_PEERS se siguen reintentando)."""
+    with gossip_lock:
+        if address in configured_trackers or address not in tracker_peers:
+            return
+        tracker_peers.remove(address)
+    print(f"[TRACKER] Tracker {address[0]}:{address[1]} olvidado: {GOSSIP_MAX_FAILURES} intentos sin respuesta.")
+
+def gossip_request(address, fields, failures):
+    """
+    Envía un mensaje GOSSIP con 'fields' a otro tracker. Retorna su respuesta o None si no respondió.
+    'failures' cuenta los intentos seguidos sin respuesta de cada tracker.
+    """
+    message = {"command": "GOSSIP", "from": f"{TRACKER_IP}:{TRACKER_PORT}", **fields}
+    response = send_json(address[0], address[1], message, retries=1, timeout=GOSSIP_TIMEOUT)
+    if response is None:
+        failures[address] = failures.get(address, 0) + 1
+        if failures[address] == 1: # Se avisa una vez hasta que vuelva a responder
+            print(f"[TRACKER] Tracker {address[0]}:{address[1]} sin respuesta al gossip.")
+        if failures[address] >= GOSSIP_MAX_FAILURES:
+            forget_tracker(address)
+        METRICS.inc("bt_tracker_gossip_failures_total")
+    else:
+        failures.pop(address, None)
+    return response
 
-def save_log():
-    with open(log_file, "w") as f:
-        json.dump(peers, f, indent=2)
+def send_gossip(address, summaries, pull, failures):
+    """
+    Envía resúmenes a otro tracker (con pull, también recibe los suyos). Si alguno de los dos tiene
+    catálogos más nuevos que el otro, se intercambian en un segundo mensaje. Retorna False si no respondió.
+    """
+    response = gossip_request(address, {"peers": summaries, "pull": pull}, failures)
+    if response is None:
+        return False
+    wanted = merge_summaries(response.get("peers", {}))
+    theirs = response.get("want", [])
+    if wanted or theirs:
+        response = gossip_request(address, {"catalogs": gossip_entries(theirs, time.monotonic(), catalogs=True), "want": wanted}, failures)
+        if response is None:
+            return False
+        merge_catalogs(response.get("catalogs", {}))
+    return True
+
+def gossip():
+    """
+    Cada GOSSIP_INTERVAL envía los resúmenes de los peers que cambiaron (catálogo o último contacto)
+    a GOSSIP_FANOUT trackers al azar. Al iniciar y
+    cada FULL_SYNC_INTERVAL intercambia el estado completo con todos (push-pull), lo que repara lo que
+    se haya perdido con un tracker caído; con los que no respondan se reintenta en cada ronda.
+    """
+    last_full = None
+    unsynced = set() # Trackers con los que falta el intercambio completo
+    failures = {} # Tracker -> intentos seguidos sin respuesta
+    while True:
+        now = time.monotonic()
+        with gossip_lock:
+            pending = set(dirty_peers)
+            dirty_peers.clear()
+            known = list(tracker_peers)
+        if last_full is None or now - last_full >= FULL_SYNC_INTERVAL:
+            last_full = now
+            unsynced = set(known)
+        syncs = [address for address in known if address in unsynced]
+        if syncs:
+            summaries = gossip_entries(list(peers), now)
+            for address in syncs:
+                if send_gossip(address, summaries, True, failures):
+                    unsynced.discard(address)
+        others = [address for address in known if address not in syncs]
+        if pending and others:
+            summaries = gossip_entries(pending, now)
+            for address in random.sample(others, min(GOSSIP_FANOUT, len(others))):
+                send_gossip(address, summaries, False, failures)
+        time.sleep(GOSSIP_INTERVAL)
+
+def apply_index_delta(peer_id, added, removed):
+    """Agrega y quita archivos de un peer en el índice. Se llama con index_lock tomado."""
+    indexed = indexed_files.setdefault(peer_id, set())
+    for filename in removed:
+        holders = file_index.get(filename)
+        if holders is not None:
+            holders.discard(peer_id)
+            if not holders:
+                del file_index[filename]
+        indexed.discard(filename)
+    for filename in added:
+        file_index.setdefault(filename, set()).add(peer_id)
+        indexed.add(filename)
+
+def index_peer(peer_id, files):
+    """Pone al día el índice con los archivos actuales de un peer activo, aplicando solo las diferencias."""
+    new_files = set(files)
+    with index_lock:
+        old_files = indexed_files.get(peer_id, set())
+        apply_index_delta(peer_id, new_files - old_files, old_files - new_files)
+
+def reindex_peer(peer_id):
+    """
+    Pone al día el índice con el estado actual de un peer en 'peers' (sus archivos si está activo, ninguno
+    si no). Se llama sin peers_lock, después de cambiar el peer: el conjunto de archivos se arma fuera de
+    los locks y, si el peer cambió mientras tanto, se vuelve a armar, así gana siempre el estado más nuevo.
+    """
+    while True:
+        info = peers.get(peer_id)
+        files = info["files"] if info is not None and info["status"] == "activo" else ()
+        new_files = set(files)
+        with index_lock:
+            info = peers.get(peer_id)
+            if (info["files"] if info is not None and info["status"] == "activo" else ()) is not files:
+                continue
+            old_files = indexed_files.get(peer_id, set())
+            apply_index_delta(peer_id, new_files - old_files, old_files - new_files)
+            if not new_files:
+                indexed_files.pop(peer_id, None)
+            return
+
+def update_index(peer_id, added, removed):
+    """Aplica al índice el delta de archivos que envió un peer activo."""
+    with index_lock:
+        apply_index_delta(peer_id, added, removed)
+
+def rebuild_index():
+    """Construye el índice a partir de 'peers' (al cargar el log del tracker)."""
+    with index_lock:
+        file_index.clear()
+        indexed_files.clear()
+    for pid, info in peers.items():
+        if info.get("status") == "activo":
+            index_peer(pid, info.get("files", []))
+
+def schedule_loaded_peers():
+    """
+    Pone en la rueda de expiración a los peers activos del log, con el tiempo que les quedaba.
+    Los que ya superaron PEER_TTL quedan inactivos. Se llama al iniciar, antes de rebuild_index().
+    """
+    now_wall, now = time.time(), time.monotonic()
+    for pid, info in peers.items():
+        if info.get("status") != "activo":
+            continue
+        try:
+            age = now_wall - time.mktime(time.strptime(info["last_seen"], LAST_SEEN_FORMAT))
+        except (KeyError, TypeError, ValueError):
+            age = PEER_TTL
+        if age < PEER_TTL:
+            expiry.touch(pid, now=now - max(age, 0))
+        else:
+            info["status"] = "inactivo" # El snapshot inicial de store.start() lo persiste
+
+def expire_peers():
+    """Marca inactivos y saca del índice a los peers que llevan PEER_TTL segundos sin contacto."""
+    while True:
+        time.sleep(EXPIRY_TICK)
+        for pid in expiry.advance():
+            with peers_lock:
+                info = peers.get(pid)
+                if info is None or info["status"] != "activo" or expiry.is_alive(pid):
+                    continue # Volvió a contactar mientras se procesaba la rueda
+                info["status"] = "inactivo"
+                save_log(pid)
+            reindex_peer(pid) # Sale del índice (salvo que haya vuelto a contactar justo ahora)
+            print(f"[TRACKER] Peer '{pid}' inactivo: sin contacto en {expiry.ttl} s.")
 
 def print_status():
     while True:
@@ -22,13 +371,12 @@ def print_status():
         print("\n[TRACKER STATUS] Estado actual de la red:")
         active_peers = []
         inactive_peers = []
-        for pid, info in peers.items():
-            last_seen_time = datetime.strptime(info['last_seen'], "%Y-%m-%d %H:%M:%S")
-            if (datetime.now() - last_seen_time).total_seconds() < 30:
-                active_peers.append(f"- {pid} ({info['ip']}:{info['port']}) | Status: {info['status']} | Archivos: {info['files']} | Último contacto: {info['last_seen']}")
+        for pid, info in list(peers.items()):
+            line = f"- {pid} ({info['ip']}:{info['port']}) | Status: {info['status']} | Archivos: {info['files']} | Último contacto: {last_seen_string(pid, info)}"
+            if info["status"] == "activo":
+                active_peers.append(line)
             else:
-                info["status"] = "inactivo" # Actualizar estado a inactivo si no ha habido contacto
-                inactive_peers.append(f"- {pid} ({info['ip']}:{info['port']}) | Status: {info['status']} | Archivos: {info['files']} | Último contacto: {info['last_seen']}")
+                inactive_peers.append(line)
         
         print("\n--- Peers Activos ---")
         if active_peers:
@@ -44,14 +392,16 @@ def print_status():
         else:
             print("No hay peers inactivos.")
 
-        # Guardar el estado actual incluyendo los cambios de inactividad
-        save_log()
-        time.sleep(60)
+        time.sleep(STATUS_INTERVAL)
 
-def handle_peer(conn, addr):
+async def handle_peer(conn, addr):
+    data = None
+    command = None
+    start = time.perf_counter()
     try:
         # Ya no necesitamos el 'while True' aquí si el peer abre una nueva conexión para cada request
-        data = conn.recv(4096).decode()
+        # Solicitud enmarcada (cualquier tamaño hasta MAX_MESSAGE_SIZE) o JSON plano de un peer antiguo
+        data = (await conn.read_request(MAX_MESSAGE_SIZE)).decode()
         if not data:
             print(f"[TRACKER] Conexión vacía de {addr}. Cerrando.")
             return # Salir si no hay datos
@@ -61,105 +411,185 @@ def handle_peer(conn, addr):
 
         if command == "REGISTER":
             peer_id = message["peer_id"]
-            peers[peer_id] = {
-             "ip": message["ip"],
-            "port": message["port"],
-            "files": message["files"],
-            "status": "activo",
-            "last_seen": time.strftime("%Y-%m-%d %H:%M:%S")
-            }
-            save_log()
-            conn.send(json.dumps({"response": "REGISTERED"}).encode())
+            with peers_lock:
+                peers[peer_id] = {
+                "ip": message["ip"],
+                "port": message["port"],
+                "files": message["files"],
+                "bitfields": message.get("bitfields", {}), # Chunks que tiene de los archivos incompletos
+                "version": message.get("version"), # Versión del catálogo (para los heartbeats con deltas)
+                "session": message.get("session"), # Arranque del peer que numeró la versión
+                "status": "activo"
+                }
+                expiry.touch(peer_id)
+                save_log(peer_id)
+            reindex_peer(peer_id)
+            mark_dirty(peer_id)
+            await conn.send(json.dumps({"response": "REGISTERED", "framing": True}).encode())
             print(f"[TRACKER] Peer '{peer_id}' registrado desde {addr}")
 
         elif command == "UPDATE_FILES":
                 peer_id = message["peer_id"]
-                if peer_id in peers:
-                    peers[peer_id]["ip"] = message["ip"]
-                    peers[peer_id]["port"] = message["port"]
-                    peers[peer_id]["files"] = message["files"]
-                    peers[peer_id]["status"] = "activo"
-                    peers[peer_id]["last_seen"] = time.strftime("%Y-%m-%d %H:%M:%S")
-                    save_log()
-                    conn.send(json.dumps({"response": "FILES_UPDATED"}).encode()) # <-- ¡RESPUESTA ESENCIAL!
+                with peers_lock:
+                    known = peer_id in peers
+                    if known:
+                        peers[peer_id]["ip"] = message["ip"]
+                        peers[peer_id]["port"] = message["port"]
+                        peers[peer_id]["files"] = message["files"]
+                        peers[peer_id]["bitfields"] = message.get("bitfields", {})
+                        peers[peer_id]["version"] = message.get("version")
+                        peers[peer_id]["session"] = message.get("session")
+                        peers[peer_id]["status"] = "activo"
+                    else:
+                        peers[peer_id] = {
+                            "ip": message["ip"],
+                            "port": message["port"],
+                            "files": message["files"],
+                            "bitfields": message.get("bitfields", {}),
+                            "version": message.get("version"),
+                            "session": message.get("session"),
+                            "status": "activo"
+                        }
+                    expiry.touch(peer_id)
+                    save_log(peer_id)
+                reindex_peer(peer_id)
+                mark_dirty(peer_id)
+                if known:
+                    await conn.send(json.dumps({"response": "FILES_UPDATED"}).encode()) # <-- ¡RESPUESTA ESENCIAL!
                     print(f"[TRACKER] Peer '{peer_id}' archivos actualizados desde {addr}.")
                 else:
-                    peers[peer_id] = {
-                        "ip": message["ip"],
-                        "port": message["port"],
-                        "files": message["files"],
-                        "status": "activo",
-                        "last_seen": time.strftime("%Y-%m-%d %H:%M:%S")
-                    }
-                    save_log()
-                    conn.send(json.dumps({"response": "REGISTERED"}).encode()) # O FILES_UPDATED
+                    await conn.send(json.dumps({"response": "REGISTERED", "framing": True}).encode()) # O FILES_UPDATED
                     print(f"[TRACKER] Peer '{peer_id}' (nuevo o inactivo) registrado/actualizado vía UPDATE_FILES desde {addr}.")
 
+        elif command == "UPDATE_DELTA":
+                peer_id = message["peer_id"]
+                added = message.get("added", [])
+                removed = set(message.get("removed", []))
+                with peers_lock:
+                    peer = peers.get(peer_id)
+                    applied = peer is not None and peer.get("version") is not None and peer.get("version") == message["base_version"]
+                    was_active = applied and peer["status"] == "activo"
+                    if applied:
+                        # Listas y diccionarios nuevos: el journal puede tener aún una referencia a los anteriores
+                        files = [f for f in peer["files"] if f not in removed] + added
+                        bitfields = dict(peer.get("bitfields", {}))
+                        bitfields.update(message.get("bitfields", {}))
+                        for filename in message.get("bitfields_removed", []):
+                            bitfields.pop(filename, None)
+
+                        if was_active:
+                            update_index(peer_id, added, removed) # Solo el delta: no hace falta recorrer el catálogo
+                        peer["files"] = files
+                        peer["bitfields"] = bitfields
+                        peer["version"] = message["version"]
+                        peer["session"] = message.get("session", peer.get("session"))
+                        peer["status"] = "activo"
+                        expiry.touch(peer_id)
+                        save_log(peer_id)
+                if not applied:
+                    # El delta no parte de la versión que tenemos: el peer debe reenviar su catálogo completo
+                    await conn.send(json.dumps({"response": "RESYNC"}).encode())
+                else:
+                    if not was_active:
+                        reindex_peer(peer_id) # Vuelve al índice tras haber expirado
+                    mark_dirty(peer_id)
+                    await conn.send(json.dumps({"response": "DELTA_APPLIED"}).encode())
+                    if added or removed:
+                        print(f"[TRACKER] Peer '{peer_id}' archivos actualizados desde {addr} (+{len(added)} / -{len(removed)}).")
+
         elif command == "GET_PEERS_WITH_FILE":
                 filename = message["filename"]
-                result = [
-                    {"peer_id": pid, "ip": p["ip"], "port": p["port"]}
-                    for pid, p in peers.items() if filename in p["files"] and p["status"] == "activo"
-                ]
-                conn.send(json.dumps({"response": result}).encode())
+                result = []
+                with index_lock:
+                    holders = list(file_index.get(filename, ()))
+                for pid in holders: # Solo los peers activos que tienen el archivo, sin recorrer toda la red
+                    p = peers.get(pid)
+                    if p is None:
+                        continue
+                    entry = {"peer_id": pid, "ip": p["ip"], "port": p["port"]}
+                    bitfield = p.get("bitfields", {}).get(filename)
+                    if bitfield:
+                        entry["bitfield"] = bitfield # Peer con el archivo a medias: solo tiene estos chunks
+                    result.append(entry)
+                await conn.send_json_stream({"response": result}) # Se envía por partes si la lista es grande
                 print(f"[TRACKER] Solicitud de peers con '{filename}' respondida a {addr}.")
 
         elif command == "GET_NETWORK_STATUS":
-                conn.send(json.dumps(peers).encode())
+                # Copia del estado: otros handlers pueden modificarlo mientras se envía por partes
+                await conn.send_json_stream({pid: peer_view(pid, info) for pid, info in list(peers.items())})
                 print(f"[TRACKER] Estado de la red solicitado y respondido a {addr}.")
 
         elif command == "PING":
                 peer_id = message["peer_id"]
-                if peer_id in peers:
-                    peers[peer_id]["last_seen"] = time.strftime("%Y-%m-%d %H:%M:%S")
-                    peers[peer_id]["status"] = "activo"
-                conn.send(json.dumps({"response": "PONG"}).encode())
+                with peers_lock:
+                    peer = peers.get(peer_id)
+                    reactivated = peer is not None and peer["status"] != "activo"
+                    if peer is not None:
+                        expiry.touch(peer_id) # O(1): sin fechas ni escritura al log
+                        peer["status"] = "activo"
+                    # La versión permite al peer saber si el tracker tiene su catálogo al día
+                    version = peer.get("version") if peer is not None else None
+                if reactivated:
+                    reindex_peer(peer_id) # Vuelve al índice tras haber expirado
+                if peer is not None:
+                    mark_dirty(peer_id) # Solo un resumen (versión y último contacto) para los demás trackers
+                await conn.send(json.dumps({"response": "PONG", "version": version, "framing": True}).encode())
+
+        elif command == "GET_METRICS":
+                await conn.send_json_stream({"response": METRICS.snapshot()})
+
+        elif command == "GOSSIP":
+                # En el executor: los merges toman peers_lock e index_lock y pueden diferenciar catálogos enormes
+                response = await conn.run_blocking(gossip_reply, message, addr)
+                await conn.send_json_stream(response)
 
     except json.JSONDecodeError as json_e:
         print(f"[TRACKER ERROR] Error al decodificar JSON de {addr}: {json_e}")
-        print(f"[TRACKER ERROR] Datos recibidos (posiblemente corruptos): {data}")
-    except socket.timeout: # Añadir manejo explícito de timeout si recv toma mucho
+        print(f"[TRACKER ERROR] Datos recibidos (posiblemente corruptos): {data[:200]}")
+    except MessageTooLarge as e:
+        print(f"[TRACKER ERROR] Solicitud demasiado grande de {addr}: {e}")
+        try:
+            await conn.send(json.dumps({"response": "ERROR", "message": "Message too large"}).encode())
+        except Exception:
+            pass
+    except asyncio.TimeoutError: # El peer no envió la solicitud a tiempo
         print(f"[TRACKER ERROR] Timeout de socket al recibir datos de {addr}")
     except Exception as e:
         print(f"[TRACKER ERROR] Error inesperado al manejar peer {addr}: {e}")
     finally:
-        conn.close()
+        if command is not None:
+            label = command if command in KNOWN_COMMANDS else "unknown"
+            METRICS.observe("bt_tracker_request_seconds", time.perf_counter() - start, command=label)
+    # El servidor asyncio de network_utils cierra la conexión al terminar el handler
 
 def start_tracker():
     print(f"[TRACKER] Iniciando en {TRACKER_IP}:{TRACKER_PORT}")
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Permite reusar la dirección
-    
+    store.start(peers) # Hilo de persistencia: journal y snapshots fuera de las solicitudes
     try:
-        s.bind((TRACKER_IP, TRACKER_PORT))
-        s.listen()
-        print(f"[TRACKER] Escuchando conexiones en {TRACKER_IP}:{TRACKER_PORT}")
-
-        # Inicia un hilo para imprimir el estado de la red periódicamente
+        # Hilo de expiración de peers y, aparte, el que imprime el estado de la red periódicamente
+        threading.Thread(target=expire_peers, daemon=True).start()
         threading.Thread(target=print_status, daemon=True).start()
+        if tracker_peers:
+            print(f"[TRACKER] Replicando con: {', '.join(f'{ip}:{port}' for ip, port in tracker_peers)}")
+        threading.Thread(target=gossip, daemon=True).start() # También sin trackers conocidos: pueden anunciarse después
+        if METRICS_HTTP_PORT:
+            start_metrics_http("127.0.0.1", METRICS_HTTP_PORT) # Solo local: el endpoint no tiene autenticación
 
-        while True:
-            conn, addr = s.accept()
-            threading.Thread(target=handle_peer, args=(conn, addr)).start()
+        # Servidor asyncio compartido con los peers: concurrencia acotada y timeouts de lectura
+        start_listener(TRACKER_IP, TRACKER_PORT, handle_peer)
 
     except KeyboardInterrupt:
         print("\n[TRACKER] Detectado Ctrl+C. Cerrando tracker...")
-        save_log() # Guarda el estado final de los peers
+        store.close() # Guarda el estado final de los peers
     except Exception as e:
         print(f"[TRACKER] Error crítico: {e}")
     finally:
-        s.close()
         print("[TRACKER] Tracker cerrado.")
 
 if __name__ == "__main__":
-    # Cargar logs previos al inicio si existen
-    if os.path.exists(log_file):
-        with open(log_file, "r") as f:
-            try:
-                peers = json.load(f)
-                print("[TRACKER] Log de peers cargado exitosamente.")
-            except json.JSONDecodeError:
-                print("[TRACKER] Advertencia: Archivo de log corrupto, iniciando con peers vacíos.")
-                peers = {}
+    # Cargar el último snapshot y reaplicar el journal de cambios posteriores
+    peers = store.load()
+    schedule_loaded_peers()
+    rebuild_index()
          
     start_tracker()
@@ -0,0 +1,141 @@
+# bittorrent_project/tracker_store.py
+import os
+import json
+import time
+import queue
+import threading
+
+from metrics import METRICS
+
+JOURNAL_FLUSH_INTERVAL = 1 # Segundos máximos que un cambio espera en memoria antes de llegar al journal
+SNAPSHOT_INTERVAL = 60 # Segundos entre snapshots completos del estado
+SNAPSHOT_MAX_RECORDS = 10000 # Registros en el journal que fuerzan un snapshot antes de tiempo
+
+class TrackerStore:
+    """
+    Persistencia del estado del tracker fuera del camino de las solicitudes.
+    Cada cambio de un peer se encola y un hilo en segundo plano lo agrega al journal como una
+    línea JSON compacta. Periódicamente ese mismo hilo escribe un snapshot completo y vacía el
+    journal. Al iniciar se carga el snapshot y se reaplica el journal encima.
+    """
+    def __init__(self, snapshot_file, journal_file, snapshot_interval=SNAPSHOT_INTERVAL,
+                 flush_interval=JOURNAL_FLUSH_INTERVAL, snapshot_max_records=SNAPSHOT_MAX_RECORDS, view=None):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.snapshot_interval = snapshot_interval
+        self.flush_interval = flush_interval
+        self.snapshot_max_records = snapshot_max_records
+        self.view = view or (lambda peer_id, info: dict(info)) # Copia de un peer tal como se persiste
+        self.changes = queue.Queue()
+        self.peers = {}
+        self.journal = None
+        self.journal_records = 0
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def load(self):
+        """Carga el snapshot y reaplica el journal. Retorna el diccionario de peers reconstruido."""
+        peers = {}
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, "r") as f:
+                try:
+                    peers = json.load(f)
+                    print("[TRACKER] Log de peers cargado exitosamente.")
+                except json.JSONDecodeError:
+                    print("[TRACKER] Advertencia: Archivo de log corrupto, iniciando con peers vacíos.")
+                    peers = {}
+
+        replayed = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break # Última línea a medio escribir (el tracker se cerró de golpe)
+                    if record.get("peer") is None:
+                        peers.pop(record["id"], None)
+                    else:
+                        peers[record["id"]] = record["peer"]
+                    replayed += 1
+        if replayed:
+            print(f"[TRACKER] {replayed} cambios recuperados del journal.")
+        self.peers = peers
+        return peers
+
+    def start(self, peers):
+        """Empieza a persistir 'peers'. Escribe un snapshot inicial para partir con el journal vacío."""
+        self.peers = peers
+        self.write_snapshot()
+        self.journal = open(self.journal_file, "w")
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def record(self, peer_id, info):
+        """Registra el estado nuevo de un peer (None si se eliminó). No bloquea ni toca el disco."""
+        # Copia superficial: los handlers reemplazan las listas y diccionarios del peer, no los modifican
+        self.changes.put((peer_id, dict(info) if info is not None else None))
+
+    def write_journal(self, batch):
+        with METRICS.timer("bt_tracker_journal_write_seconds"):
+            for peer_id, info in batch:
+                self.journal.write(json.dumps({"id": peer_id, "peer": info}, separators=(",", ":")) + "\n")
+            self.journal.flush()
+        self.journal_records += len(batch)
+
+    def write_snapshot(self):
+        """Escribe el estado completo en un archivo temporal y lo reemplaza de forma atómica."""
+        with METRICS.timer("bt_tracker_snapshot_seconds"):
+            state = {pid: self.view(pid, info) for pid, info in list(self.peers.items())}
+            tmp_path = self.snapshot_file + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_file)
+
+    def take_snapshot(self):
+        """Snapshot y journal vacío. Reaplicar un cambio ya incluido en el snapshot es inofensivo."""
+        self.write_snapshot()
+        self.journal.seek(0)
+        self.journal.truncate()
+        self.journal_records = 0
+
+    def drain(self, timeout):
+        """Espera hasta 'timeout' por cambios y retorna todos los encolados."""
+        batch = []
+        try:
+            batch.append(self.changes.get(timeout=timeout))
+            while True:
+                batch.append(self.changes.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def run(self):
+        last_snapshot = time.monotonic()
+        while not self.stopped.is_set():
+            try:
+                batch = self.drain(self.flush_interval)
+                if batch:
+                    self.write_journal(batch)
+                if (self.journal_records >= self.snapshot_max_records
+                        or time.monotonic() - last_snapshot >= self.snapshot_interval):
+                    self.take_snapshot()
+                    last_snapshot = time.monotonic()
+            except Exception as e:
+                print(f"[TRACKER ERROR] Error al persistir el estado: {e}")
+                time.sleep(self.flush_interval)
+
+    def close(self):
+        """Detiene el hilo y deja un snapshot final con todo el estado."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.flush_interval + 5)
+        if self.journal is not None:
+            batch = self.drain(0)
+            if batch:
+                self.write_journal(batch)
+            self.take_snapshot()
+            self.journal.close()
+            self.journal = None